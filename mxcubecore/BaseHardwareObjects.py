@@ -23,6 +23,7 @@ from __future__ import absolute_import
 import ast
 import enum
 import logging
+import time
 import typing
 import warnings
 from collections import OrderedDict
@@ -46,6 +47,7 @@ from typing import (
 from gevent import (
     Timeout,
     event,
+    spawn_later,
 )
 from pydantic.v1 import (
     Field,
@@ -619,6 +621,19 @@ class HardwareObjectMixin(CommandContainer):
         # List of member names (methods) to be exported (Set at configuration stage)
         self._exports_config_list = []
 
+        # Minimum interval [ms] between two emissions of each of the
+        # coalesced_signals, only the latest value being emitted.
+        # 0 to emit all the signals (Set at configuration stage)
+        self.signal_rate_limit = 0
+
+        # Signals rate limited by signal_rate_limit (Set at configuration stage)
+        self.coalesced_signals = ["valueChanged"]
+
+        # Dictionary on the form:
+        # key: The coalesced signal name
+        # value: [time of the last emission, pending arguments, flush greenlet]
+        self._coalesced_signals_state: Dict[str, list] = {}
+
     def __bool__(self) -> Literal[True]:
         return True
 
@@ -898,8 +913,67 @@ class HardwareObjectMixin(CommandContainer):
         if len(args) == 1:
             if isinstance(args[0], tuple):
                 args = args[0]
+
+        if self.signal_rate_limit:
+            if signal in self.coalesced_signals:
+                self._emit_coalesced(signal, args)
+                return
+            if (
+                signal == "stateChanged"
+                and args
+                and args[0] == HardwareObjectState.READY
+            ):
+                # deliver the final values before the READY state
+                self.flush_signals()
+
         dispatcher.send(signal, self, *args)
 
+    def _emit_coalesced(self, signal: str, args: tuple) -> None:
+        """Emit signal at most every signal_rate_limit ms.
+
+        Signals emitted in between are replaced by the latest one, which is
+        sent when the interval has elapsed.
+
+        Args:
+            signal (str): Signal name.
+            args (tuple): Arguments sent with signal.
+        """
+        state = self._coalesced_signals_state.setdefault(signal, [0, None, None])
+        if state[2] is not None:
+            # an emission is already scheduled, just update its arguments
+            state[1] = args
+            return
+
+        delay = state[0] + self.signal_rate_limit / 1000.0 - time.monotonic()
+        if delay > 0:
+            state[1] = args
+            state[2] = spawn_later(delay, self._flush_signal, signal)
+        else:
+            state[0] = time.monotonic()
+            dispatcher.send(signal, self, *args)
+
+    def _flush_signal(self, signal: str) -> None:
+        """Emit the pending arguments of a coalesced signal, if any.
+
+        Args:
+            signal (str): Signal name.
+        """
+        state = self._coalesced_signals_state.get(signal)
+        if state is None or state[2] is None:
+            return
+
+        args = state[1]
+        state[0] = time.monotonic()
+        state[1] = state[2] = None
+        dispatcher.send(signal, self, *args)
+
+    def flush_signals(self) -> None:
+        """Emit at once the pending values of the coalesced signals."""
+        for signal, state in list(self._coalesced_signals_state.items()):
+            if state[2] is not None:
+                state[2].kill(block=False)
+                self._flush_signal(signal)
+
     def connect(
         self,
         sender: Union[str, object, Any],
@@ -1035,6 +1109,12 @@ class HardwareObject(HardwareObjectNode, HardwareObjectMixin):
         self._exports_config_list.extend(
             ast.literal_eval(self.get_property("exports", "[]").strip())
         )
+        self.signal_rate_limit = self.get_property(
+            "signal_rate_limit", self.signal_rate_limit
+        )
+        coalesced_signals = self.get_property("coalesced_signals")
+        if coalesced_signals:
+            self.coalesced_signals = ast.literal_eval(coalesced_signals.strip())
         HardwareObjectMixin.init(self)
 
     def __getstate__(self) -> str:
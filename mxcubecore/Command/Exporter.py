@@ -39,16 +39,31 @@ __license__ = "LGPLv3+"
 
 EXPORTER_CLIENTS = {}
 
-
-def start_exporter(address, port, timeout=3, retries=1):
-    """Start the exporter"""
+# first characters of the strings int() or float() may convert
+_NUMERIC_START = frozenset("0123456789+-. \t\n\r\x0b\x0ciInN")
+# characters float() accepts, but int() does not
+_NOT_INT_CHARS = frozenset(".eEnN")
+
+
+def start_exporter(address, port, timeout=3, retries=1, max_in_flight=1):
+    """Start the exporter.
+    Args:
+        address(str): Server address
+        port(int): Server port
+        timeout(float): Timeout [s]
+        retries(int): Number of retries
+        max_in_flight(int): Maximum number of pipelined requests. The
+                            highest value requested for a server is used.
+    """
     global EXPORTER_CLIENTS
     if (address, port) not in EXPORTER_CLIENTS:
-        client = Exporter(address, port, timeout)
+        client = Exporter(address, port, timeout, max_in_flight=max_in_flight)
         EXPORTER_CLIENTS[(address, port)] = client
         client.start()
         return client
-    return EXPORTER_CLIENTS[(address, port)]
+    client = EXPORTER_CLIENTS[(address, port)]
+    client.set_max_in_flight(max_in_flight)
+    return client
 
 
 class Exporter(ExporterClient.ExporterClient, object):
@@ -75,11 +90,15 @@ class Exporter(ExporterClient.ExporterClient, object):
     STATE_FAULT = "Fault"
     STATE_UNKNOWN = "Unknown"
 
-    def __init__(self, address, port, timeout=3, retries=1):
-        super(Exporter, self).__init__(address, port, PROTOCOL.STREAM, timeout, retries)
+    def __init__(self, address, port, timeout=3, retries=1, max_in_flight=1):
+        super(Exporter, self).__init__(
+            address, port, PROTOCOL.STREAM, timeout, retries, max_in_flight
+        )
 
         self.started = False
         self.callbacks = {}
+        # property name -> type of its values, see _to_python_value
+        self._value_types = {}
         self.events_queue = Queue()
         self.events_processing_task = None
 
@@ -99,10 +118,15 @@ class Exporter(ExporterClient.ExporterClient, object):
         """Read the state"""
         return self.execute("getState")
 
-    def read_property(self, *args, **kwargs):
+    def read_property(self, prop, *args, **kwargs):
         """Read a property"""
-        ret = ExporterClient.ExporterClient.read_property(self, *args, **kwargs)
-        return self._to_python_value(ret)
+        ret = ExporterClient.ExporterClient.read_property(self, prop, *args, **kwargs)
+        return self._to_python_value(ret, prop)
+
+    def read_properties(self, *args, **kwargs):
+        """Read several properties at once"""
+        ret = ExporterClient.ExporterClient.read_properties(self, *args, **kwargs)
+        return {prop: self._to_python_value(value, prop) for prop, value in ret.items()}
 
     def reconnect(self):
         """Reconnect"""
@@ -118,38 +142,113 @@ class Exporter(ExporterClient.ExporterClient, object):
         if not self.events_processing_task:
             self.events_processing_task = gevent.spawn(self.process_events_from_queue)
 
-    def _to_python_value(self, value):
-        """Convert exporter value to python one
+    def _to_python_value(self, value, name=None):
+        """Convert exporter value to python one. The type of the values of
+        a named property is remembered, so that the next values are
+        converted straight away, with the same result.
         Args:
             value (str): String from the exporter
+            name (str): Property (or event) name
         """
         if value is None:
             return value
 
+        if name is not None:
+            value_type = self._value_types.get(name)
+            if value_type is not None:
+                try:
+                    return self._decoders[value_type](self, value)
+                except (TypeError, ValueError):
+                    pass
+
+        value, value_type = self._decode(value)
+        if name is not None:
+            self._value_types[name] = value_type
+        return value
+
+    def _decode(self, value):
+        """Convert exporter value to python one, trying all the types
+        Args:
+            value (str): String from the exporter
+        Returns:
+            (tuple): value, value type
+        """
         if "\x1f" in value:
             value = self.parse_array(value)
             try:
-                value = list(map(int, value))
+                return list(map(int, value)), "int_array"
             except (TypeError, ValueError):
                 try:
-                    value = list(map(float, value))
-                except (TypeError, ValueError):
-                    pass
-        else:
-            if value == "false":
-                value = False
-            elif value == "true":
-                value = True
-            else:
-                try:
-                    value = int(value)
+                    return list(map(float, value)), "float_array"
                 except (TypeError, ValueError):
-                    try:
-                        value = float(value)
-                    except (TypeError, ValueError):
-                        pass
+                    return value, "str_array"
+
+        if value == "false":
+            return False, "bool"
+        if value == "true":
+            return True, "bool"
+        try:
+            return int(value), "int"
+        except (TypeError, ValueError):
+            try:
+                return float(value), "float"
+            except (TypeError, ValueError):
+                return value, "str"
+
+    # The decoders below raise ValueError when the value would not be
+    # converted to their type by _decode, which is then used instead.
+
+    def _decode_bool(self, value):
+        if value == "false":
+            return False
+        if value == "true":
+            return True
+        raise ValueError(value)
+
+    def _decode_int(self, value):
+        return int(value)
+
+    def _decode_float(self, value):
+        if "\x1f" in value or _NOT_INT_CHARS.isdisjoint(value):
+            raise ValueError(value)
+        return float(value)
+
+    def _decode_str(self, value):
+        if "\x1f" in value or value[:1] in _NUMERIC_START or value in ("true", "false"):
+            raise ValueError(value)
+        return value
+
+    def _decode_int_array(self, value):
+        if "\x1f" not in value:
+            raise ValueError(value)
+        return list(map(int, self.parse_array(value)))
+
+    def _decode_float_array(self, value):
+        if "\x1f" not in value:
+            raise ValueError(value)
+        value = self.parse_array(value)
+        if all(_NOT_INT_CHARS.isdisjoint(item) for item in value):
+            raise ValueError(value)
+        return list(map(float, value))
+
+    def _decode_str_array(self, value):
+        if "\x1f" not in value:
+            raise ValueError(value)
+        value = self.parse_array(value)
+        if all(item[:1] in _NUMERIC_START for item in value):
+            raise ValueError(value)
         return value
 
+    _decoders = {
+        "bool": _decode_bool,
+        "int": _decode_int,
+        "float": _decode_float,
+        "str": _decode_str,
+        "int_array": _decode_int_array,
+        "float_array": _decode_float_array,
+        "str_array": _decode_str_array,
+    }
+
     def on_event(self, name, value, timestamp):
         """Put the event in the queue
         Args:
@@ -167,9 +266,18 @@ class Exporter(ExporterClient.ExporterClient, object):
             except Exception:
                 return
 
-            for cb in self.callbacks.get(name, []):
+            callbacks = self.callbacks.get(name)
+            if not callbacks:
+                continue
+            try:
+                value = self._to_python_value(value, name)
+            except Exception:
+                logging.exception("Cannot convert value of event %s", name)
+                continue
+
+            for cb in callbacks:
                 try:
-                    cb(self._to_python_value(value))
+                    cb(value)
                 except Exception:
                     msg = "Exception while executing callback {} for event {}".format(
                         cb, name
@@ -182,11 +290,21 @@ class ExporterCommand(CommandObject):
     """Command implementation for Exporter"""
 
     def __init__(
-        self, name, command, username=None, address=None, port=None, timeout=3, **kwargs
+        self,
+        name,
+        command,
+        username=None,
+        address=None,
+        port=None,
+        timeout=3,
+        max_in_flight=1,
+        **kwargs
     ):
         CommandObject.__init__(self, name, username, **kwargs)
         self.command = command
-        self.__exporter = start_exporter(address, port, timeout)
+        self.__exporter = start_exporter(
+            address, port, timeout, max_in_flight=max_in_flight
+        )
         msg = "Attaching Exporter command: {} {}".format(address, name)
         logging.getLogger("HWR").debug(msg)
 
@@ -231,11 +349,14 @@ class ExporterChannel(ChannelObject):
         address=None,
         port=None,
         timeout=3,
+        max_in_flight=1,
         **kwargs
     ):
         ChannelObject.__init__(self, name, username, **kwargs)
 
-        self.__exporter = start_exporter(address, port, timeout)
+        self.__exporter = start_exporter(
+            address, port, timeout, max_in_flight=max_in_flight
+        )
         self.attribute_name = attribute_name
         self.value = None
 
@@ -263,6 +384,34 @@ class ExporterChannel(ChannelObject):
         value = self.__exporter.read_property(self.attribute_name)
         return value
 
+    @staticmethod
+    def get_values_bulk(channels):
+        """Read the values of several channels, with a single request per
+        exporter server, and emit update for the ones which changed.
+        Args:
+            channels (list): ExporterChannel objects
+        Returns:
+            (list): The values, in the order of the channels
+        """
+        by_exporter = {}
+        for channel in channels:
+            by_exporter.setdefault(id(channel.__exporter), []).append(channel)
+
+        values = {}
+        for exp_channels in by_exporter.values():
+            exporter = exp_channels[0].__exporter
+            ret = exporter.read_properties(
+                list({channel.attribute_name: None for channel in exp_channels})
+            )
+            for channel in exp_channels:
+                value = ret[channel.attribute_name]
+                values[id(channel)] = value
+                if value != channel.value:
+                    channel.value = value
+                    channel.emit("update", value)
+
+        return [values[id(channel)] for channel in channels]
+
     def set_value(self, value):
         """Set a value
         Args:
@@ -143,9 +143,101 @@ class E:
         self.event = event
 
 
+def _is_equal(value, other):
+    if isinstance(value, numpy.ndarray) or isinstance(other, numpy.ndarray):
+        return numpy.array_equal(value, other)
+    return value == other
+
+
+class TangoPollingGroup:
+    """Poll all the attributes of a Tango device sharing the same polling
+    period with a single read_attributes call, and dispatch the values to
+    the corresponding channels.
+    """
+
+    def __init__(self, device_name, polling_period):
+        self.device_name = device_name
+        self.polling_period = polling_period
+        self.raw_device = DeviceProxy(device_name)
+        # replaced (never modified in place), as it is read from the
+        # polling thread
+        self.channels = ()
+        self.last_values = {}
+        self.poller = None
+
+    def add_channel(self, channel):
+        """Add a channel to the group and start polling if needed.
+        Args:
+            channel (TangoChannel): The channel to poll.
+        """
+        self.channels = self.channels + (channel,)
+        if self.poller is None:
+            self.poller = Poller.poll(
+                self.poll,
+                polling_period=self.polling_period,
+                value_changed_callback=self.update,
+                error_callback=self.poll_failed,
+                compare=False,
+            )
+
+    def remove_channel(self, channel):
+        """Stop dispatching values to a channel.
+        Args:
+            channel (TangoChannel): The channel to remove.
+        """
+        self.channels = tuple(chan for chan in self.channels if chan is not channel)
+        self.last_values.pop(id(channel), None)
+
+    def poll(self):
+        channels = self.channels
+        attribute_names = [channel.attribute_name for channel in channels]
+        if not attribute_names:
+            return channels, []
+
+        while True:
+            try:  # in case of tango communication errors, retry reading the attributes
+                return channels, self.raw_device.read_attributes(attribute_names)
+            except PyTango.CommunicationFailed:
+                log.warning(
+                    f"error polling {self.raw_device} {attribute_names} attributes, retrying.",
+                    exc_info=True,
+                )
+
+    def update(self, result):
+        channels, attributes = result
+        for channel, attribute in zip(channels, attributes):
+            if attribute.has_failed:
+                self.remove_channel(channel)
+                channel.poll_failed(
+                    PyTango.DevFailed(*attribute.get_err_stack()),
+                    self.poller.get_id(),
+                )
+                continue
+
+            value = attribute.value
+            last_value = self.last_values.get(id(channel), Poller.NotInitializedValue)
+            if not _is_equal(value, last_value):
+                self.last_values[id(channel)] = value
+                channel.update(value)
+
+    def poll_failed(self, e, poller_id):
+        poller = Poller.get_poller(poller_id)
+        if poller is not None:
+            poller.stop()
+        self.poller = None
+
+        channels = self.channels
+        self.channels = ()
+        self.last_values.clear()
+        for channel in channels:
+            channel.poll_failed(e, poller_id)
+
+
 class TangoChannel(ChannelObject):
     _tangoEventsQueue = queue.Queue()
     _eventReceivers = {}
+    # (device name, polling period) -> TangoPollingGroup
+    _pollingGroups = {}
 
     _tangoEventsProcessingTimer = gevent.get_hub().loop.async_()
 
@@ -197,7 +289,15 @@ class TangoChannel(ChannelObject):
     def continue_init(self, _):
         # self.init_poller.stop()
 
-        if isinstance(self.polling, int):
+        if isinstance(self.polling, int) and not self.read_as_str:
+            key = (self.device_name, self.polling)
+            group = TangoChannel._pollingGroups.get(key)
+            if group is None:
+                group = TangoPollingGroup(self.device_name, self.polling)
+                TangoChannel._pollingGroups[key] = group
+            self.raw_device = group.raw_device
+            group.add_channel(self)
+        elif isinstance(self.polling, int):
             self.raw_device = DeviceProxy(self.device_name)
 
             Poller.poll(
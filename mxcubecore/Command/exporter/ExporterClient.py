@@ -190,6 +190,23 @@ class ExporterClient(StandardClient):
             pass
         return process_return
 
+    def read_properties(self, props, timeout=-1):
+        """Read several properties with a single request to the server.
+        Args:
+            props(list): property names
+        Returns:
+            (dict): {property name: reply from the process}
+        """
+        cmds = ["{} {}".format(CMD_PROPERTY_READ, prop) for prop in props]
+        values = {}
+        for prop, ret in zip(props, self.send_receive_many(cmds, timeout)):
+            values[prop] = None
+            try:
+                values[prop] = self.__process_return(ret)
+            except Exception:
+                pass
+        return values
+
     def read_property_as_string_array(self, prop):
         """Read a propery and convert the return value to list of strings.
         Args:
@@ -21,8 +21,10 @@
 """ ProtocolError and StandardClient implementation"""
 import socket
 import sys
+from collections import deque
 
 import gevent
+import gevent.event
 import gevent.lock
 
 __copyright__ = """ Copyright © 2019 by the MXCuBE collaboration """
@@ -66,6 +68,7 @@ else:
     encode = str
 
 MAX_SIZE_STREAM_MSG = 500000
+RECV_BUFFER_SIZE = 65536
 
 
 class PROTOCOL:
@@ -75,10 +78,76 @@ class PROTOCOL:
     STREAM = 2
 
 
+class StreamParser:
+    """Extract the STX ... ETX framed messages from a byte stream.
+
+    The data of a message is accumulated in a bytearray, using find to
+    locate the delimiters, rather than byte by byte.
+    """
+
+    def __init__(self, max_size=MAX_SIZE_STREAM_MSG):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self.receiving = False
+
+    def feed(self, data, size=None):
+        """Parse received data.
+        Args:
+            data(bytearray): Received data
+            size(int): Number of valid bytes in data, all of them if None
+        Returns:
+            (list): The complete messages (bytes)
+        """
+        if size is None:
+            size = len(data)
+        view = memoryview(data)
+        messages = []
+        start = 0
+        while start < size:
+            if not self.receiving:
+                stx = data.find(STX, start, size)
+                if stx < 0:
+                    break
+                self.receiving = True
+                del self.buffer[:]
+                start = stx + 1
+                continue
+
+            etx = data.find(ETX, start, size)
+            stop = size if etx < 0 else etx
+            stx = data.find(STX, start, stop)
+            if stx >= 0:
+                # a new message starts before the end of the current one
+                del self.buffer[:]
+                start = stx + 1
+                continue
+
+            self.buffer += view[start:stop]
+            if etx < 0:
+                break
+            messages.append(bytes(self.buffer))
+            del self.buffer[:]
+            self.receiving = False
+            start = etx + 1
+
+        view.release()
+        if len(self.buffer) > self.max_size:
+            self.receiving = False
+            del self.buffer[:]
+        return messages
+
+
 class StandardClient:
-    """Standard JLib client"""
+    """Standard JLib client.
+
+    With max_in_flight > 1, stream clients pipeline the requests: up to
+    max_in_flight requests are sent without waiting for the previous
+    replies, which the server sends back in the same order.
+    """
 
-    def __init__(self, server_ip, server_port, protocol, timeout, retries):
+    def __init__(
+        self, server_ip, server_port, protocol, timeout, retries, max_in_flight=1
+    ):
         self.server_ip = server_ip
         self.server_port = server_port
         self.timeout = timeout
@@ -90,6 +159,10 @@ class StandardClient:
         self.receiving_greenlet = None
         self.msg_received_event = gevent.event.Event()
         self._lock = gevent.lock.Semaphore()
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self._send_lock = gevent.lock.Semaphore()
+        self._in_flight = gevent.lock.Semaphore(self.max_in_flight)
+        self._pending_replies = deque()
         self.__msg_index__ = -1
         self.__sock = None
         self.__constant_local_port = True
@@ -112,6 +185,14 @@ class StandardClient:
         self._is_connected = False
         self.__sock = None
         self.received_msg = None
+        self.__fail_pending_replies()
+
+    def __fail_pending_replies(self):
+        """Wake up the greenlets waiting for a pipelined reply"""
+        while self._pending_replies:
+            self._pending_replies.popleft().set_exception(
+                SocketError("Socket error:" + str(self.error or "Disconnected"))
+            )
 
     def connect(self):
         """Socket connect"""
@@ -235,11 +316,31 @@ class StandardClient:
         else:
             self.disconnect()
 
+    def set_max_in_flight(self, max_in_flight):
+        """Increase the number of requests sent without waiting for the
+        replies. Lower values are ignored. Waits for the end of the request
+        in progress when switching from one request at a time to pipelined
+        requests.
+        Args:
+            max_in_flight(int): Maximum number of pending requests
+        """
+        with self._lock:
+            for _ in range(int(max_in_flight) - self.max_in_flight):
+                self.max_in_flight += 1
+                self._in_flight.release()
+
+    def __is_pipelined(self):
+        return self.protocol == PROTOCOL.STREAM and self.max_in_flight > 1
+
     def on_message_received(self, msg):
         """Actions
         Args:
             msg(str): Message
         """
+        if self._pending_replies:
+            # replies arrive in the same order as the requests were sent
+            self._pending_replies.popleft().set(msg)
+            return
         self.received_msg = msg
         self.msg_received_event.set()
 
@@ -249,41 +350,23 @@ class StandardClient:
             self.on_connected()
         except Exception:
             pass
-        buffer = empty_buffer()
-        mReceivedSTX = False
+        parser = StreamParser()
+        recv_buffer = bytearray(RECV_BUFFER_SIZE)
         while True:
-            ret = self.__sock.recv(4096)
-            if not ret:
+            size = self.__sock.recv_into(recv_buffer)
+            if not size:
                 # connection reset by peer
                 self.error = "Disconnected"
                 self.__close_socket()
                 break
-            for b in ret:
-                if b == STX:
-                    buffer = empty_buffer()
-                    mReceivedSTX = True
-                elif b == ETX:
-                    if mReceivedSTX:
-                        try:
-                            # Unicode decoding exception catching,
-                            # consider errors='ignore'
-                            buffer_utf8 = buffer.decode()
-                        except UnicodeDecodeError as e:
-                            # Syntax not allowed in Python 2
-                            # raise ProtocolError from e
-                            raise ProtocolError(
-                                "UnicodeDecodeError: %s" % (sys.exc_info(),)
-                            )
-                        self.on_message_received(buffer_utf8)
-                        mReceivedSTX = False
-                        buffer = empty_buffer()
-                else:
-                    if mReceivedSTX:
-                        buffer += _bytes([b])
-
-            if len(buffer) > MAX_SIZE_STREAM_MSG:
-                mReceivedSTX = False
-                buffer = empty_buffer()
+            for msg in parser.feed(recv_buffer, size):
+                try:
+                    # Unicode decoding exception catching,
+                    # consider errors='ignore'
+                    msg_utf8 = msg.decode()
+                except UnicodeDecodeError as e:
+                    raise ProtocolError("UnicodeDecodeError: %s" % (e,)) from e
+                self.on_message_received(msg_utf8)
         try:
             self.on_disconnected()
         except Exception:
@@ -298,7 +381,7 @@ class StandardClient:
             self.connect()
         try:
             pack = _bytes([STX]) + encode(cmd) + _bytes([ETX])
-            self.__sock.send(pack)
+            self.__sock.sendall(pack)
         except SocketError:
             self.disconnect()
 
@@ -323,6 +406,59 @@ class StandardClient:
                 self.msg_received_event.wait()
             return self.received_msg
 
+    def __send_receive_stream_many(self, cmds, timeout):
+        """Send several commands in a single write and wait for all the
+        replies.
+        Args:
+            cmds(list): commands
+            timeout(float): Timeout [s], None for no timeout
+        Returns:
+            (list): replies form the socket, in the order of the commands
+        """
+        replies = [gevent.event.AsyncResult() for _ in cmds]
+        with self._send_lock:
+            if not self.is_connected():
+                self.error = None
+                self.connect()
+            self._pending_replies.extend(replies)
+            pack = b"".join(_bytes([STX]) + encode(cmd) + _bytes([ETX]) for cmd in cmds)
+            try:
+                self.__sock.sendall(pack)
+            except Exception:
+                for reply in replies:
+                    self._pending_replies.remove(reply)
+                raise
+
+        with gevent.Timeout(timeout, TimeoutError):
+            return [reply.get() for reply in replies]
+
+    def __send_receive_pipelined(self, cmd, timeout):
+        """Send a command without waiting for the replies of the previous
+        ones, then wait for its own reply.
+        Args:
+            cmd(str): command
+            timeout(float): Timeout [s], None for no timeout
+        Returns:
+            (str): reply form the socket
+        """
+        with self._in_flight:
+            reply = gevent.event.AsyncResult()
+            with self._send_lock:
+                if not self.is_connected():
+                    self.error = None
+                    self.connect()
+                self._pending_replies.append(reply)
+                try:
+                    self.__send_stream(cmd)
+                except Exception:
+                    self._pending_replies.remove(reply)
+                    raise
+
+            # on timeout the reply stays queued, to be discarded when it
+            # eventually arrives and keep the next replies in order
+            with gevent.Timeout(timeout, TimeoutError):
+                return reply.get()
+
     def send_receive(self, cmd, timeout=-1):
         """Send/receive command, locking the socket.
         Args:
@@ -330,20 +466,49 @@ class StandardClient:
         Returns:
             (str): reply form the socket
         """
-        self._lock.acquire()
-        try:
-            if (timeout is None) or (timeout >= 0):
-                self.set_timeout(timeout)
-            if self.protocol == PROTOCOL.DATAGRAM:
-                return self.__send_receive_datagram(cmd)
-            return self.__send_receive_stream(cmd)
-        finally:
+        if not self.__is_pipelined():
+            self._lock.acquire()
             try:
-                if (timeout is None) or (timeout >= 0):
-                    self.restore_timeout()
+                # set_max_in_flight may have switched to pipelined requests
+                # while waiting for the lock
+                if not self.__is_pipelined():
+                    if (timeout is None) or (timeout >= 0):
+                        self.set_timeout(timeout)
+                    try:
+                        if self.protocol == PROTOCOL.DATAGRAM:
+                            return self.__send_receive_datagram(cmd)
+                        return self.__send_receive_stream(cmd)
+                    finally:
+                        if (timeout is None) or (timeout >= 0):
+                            self.restore_timeout()
             finally:
                 self._lock.release()
 
+        if timeout is not None and timeout < 0:
+            timeout = self.timeout
+        return self.__send_receive_pipelined(cmd, timeout)
+
+    def send_receive_many(self, cmds, timeout=-1):
+        """Send/receive several commands. Stream clients send all the
+        commands in one write, without waiting for the replies in between.
+        Args:
+            cmds(list): commands
+            timeout(float): Timeout [s] for the whole batch
+        Returns:
+            (list): replies form the socket, in the order of the commands
+        """
+        if self.protocol == PROTOCOL.DATAGRAM:
+            return [self.send_receive(cmd, timeout) for cmd in cmds]
+
+        if timeout is not None and timeout < 0:
+            timeout = self.timeout
+        if not self.__is_pipelined():
+            with self._lock:
+                if not self.__is_pipelined():
+                    return self.__send_receive_stream_many(cmds, timeout)
+        with self._in_flight:
+            return self.__send_receive_stream_many(cmds, timeout)
+
     def send(self, cmd):
         """Send command.
         Args:
@@ -26,8 +26,10 @@ import enum
 import json
 import logging
 import math
+import numbers
 import os
 import time
+from collections import namedtuple
 from typing import (
     Dict,
     List,
@@ -56,6 +58,153 @@ except Exception:
     unicode = str
 
 
+# Centring motor positions of the centred positions given to
+# GenericDiffractometer.motor_positions_to_screen_array
+CENTRED_POSITION_DTYPE = numpy.dtype(
+    [("sampx", float), ("sampy", float), ("phiy", float), ("phiz", float)]
+)
+
+
+def centred_positions_to_array(centred_positions):
+    """
+    :param centred_positions: Structured array, returned as is, or sequence
+                              of motor position dictionaries. Missing or
+                              None positions are NaN.
+
+    :returns: The centring motor positions of <centred_positions>
+    :rtype: numpy.ndarray with dtype CENTRED_POSITION_DTYPE
+    """
+    if isinstance(centred_positions, numpy.ndarray):
+        return centred_positions
+
+    array = numpy.empty(len(centred_positions), dtype=CENTRED_POSITION_DTYPE)
+    for name in CENTRED_POSITION_DTYPE.names:
+        array[name] = [
+            numpy.nan if pos.get(name) is None else pos[name]
+            for pos in centred_positions
+        ]
+    return array
+
+
+# Positions of motors, returned by MotorPositionCache.get_snapshot
+#   positions: position by motor name
+#   timestamp: time of the oldest position, seconds since the epoch
+MotorSnapshot = namedtuple("MotorSnapshot", ("positions", "timestamp"))
+
+
+class _CachedMotor(object):
+    def __init__(self, motor):
+        self.motor = motor
+        self.value = None
+        self.timestamp = 0
+        # True once the motor has sent a valueChanged signal
+        self.signalled = False
+
+    def value_changed(self, value):
+        self.value = value
+        self.timestamp = time.time()
+        self.signalled = True
+
+    def read(self):
+        self.value = self.motor.get_value()
+        self.timestamp = time.time()
+        return self.value
+
+
+class MotorPositionCache(object):
+    """
+    Positions of motors, updated from the valueChanged signals of the
+    motors, so that they can be read without accessing the hardware.
+
+    Positions older than <max_age> seconds are read again from the motors,
+    so a motor whose signals stop is still read. Callers that need other
+    ages pass max_age, or refresh=True to read all the positions from the
+    motors. Callers that accept the positions of the last signals, however
+    old, pass signal_only=True: the positions of the motors that sent
+    valueChanged signals are then used until the next signal.
+    """
+
+    def __init__(self, max_age=0.1):
+        self.max_age = max_age
+        self._motors = {}
+
+    def add_motor(self, name, motor):
+        """
+        Adds the motor <motor> with the name <name>.
+        """
+        cached_motor = _CachedMotor(motor)
+        self._motors[name] = cached_motor
+        motor.connect("valueChanged", cached_motor.value_changed)
+
+    def get_motor_names(self):
+        return list(self._motors)
+
+    def invalidate(self, name=None):
+        """
+        Forgets the position of the motor <name>, of all motors by default,
+        so that it is read at the next access.
+        """
+        for cached_motor in (
+            self._motors.values() if name is None else [self._motors[name]]
+        ):
+            cached_motor.value = None
+            cached_motor.signalled = False
+
+    def get_value(self, name, max_age=None, refresh=False, signal_only=False):
+        """
+        :param name: Name of the motor.
+        :type name: str
+        :param max_age: Maximum age of the position in seconds, the
+                        max_age of the cache by default.
+        :type max_age: float
+        :param refresh: True to read the position from the motor.
+        :type refresh: bool
+        :param signal_only: True to use the position of the last signal of
+                            the motor, without max_age by default.
+        :type signal_only: bool
+
+        :returns: The position of the motor <name>
+        """
+        cached_motor = self._motors[name]
+        if max_age is None and not (signal_only and cached_motor.signalled):
+            max_age = self.max_age
+
+        if (
+            refresh
+            or cached_motor.value is None
+            or (
+                max_age is not None
+                and time.time() - cached_motor.timestamp > max_age
+            )
+        ):
+            return cached_motor.read()
+        return cached_motor.value
+
+    def get_snapshot(self, names=None, max_age=None, refresh=False, signal_only=False):
+        """
+        :param names: Names of the motors, all the motors by default.
+        :type names: list
+        :param max_age: Maximum age of the positions in seconds.
+        :type max_age: float
+        :param refresh: True to read the positions from the motors.
+        :type refresh: bool
+        :param signal_only: True to use the positions of the last signals.
+        :type signal_only: bool
+
+        :returns: The positions of the motors
+        :rtype: MotorSnapshot
+        """
+        if names is None:
+            names = self._motors
+
+        positions = {}
+        timestamp = time.time()
+        for name in names:
+            positions[name] = self.get_value(name, max_age, refresh, signal_only)
+            timestamp = min(timestamp, self._motors[name].timestamp)
+        return MotorSnapshot(positions, timestamp)
+
+
 __credits__ = ["MXCuBE collaboration"]
 
 __version__ = "2.2."
@@ -242,6 +391,10 @@ class GenericDiffractometer(HardwareObject):
     MANUAL3CLICK_MODE = CENTRING_METHOD_MANUAL
     C3D_MODE = CENTRING_METHOD_AUTO
 
+    # Controller command moving several motors at once, see
+    # start_simultaneous_move
+    SIMULTANEOUS_MOVE_COMMAND = "startSimultaneousMoveMotors"
+
     PHASE_TRANSFER = "Transfer"
     PHASE_CENTRING = "Centring"
     PHASE_COLLECTION = "DataCollection"
@@ -299,6 +452,10 @@ class GenericDiffractometer(HardwareObject):
         self.current_centring_method = None
         self.current_motor_positions = {}
         self.current_motor_states = {}
+        # Positions of the motors of motor_hwobj_dict
+        self.motor_positions = MotorPositionCache()
+        # Set on the stateChanged signals of the motors, see wait_motors_ready
+        self.motors_state_event = gevent.event.Event()
 
         self.fast_shutter_is_open = None
         self.centring_status = {"valid": False}
@@ -405,6 +562,9 @@ class GenericDiffractometer(HardwareObject):
         queue_model_objects.CentredPosition.set_diffractometer_motor_names(
             *self.centring_motors_list
         )
+        self.motor_positions.max_age = self.get_property(
+            "motor_positions_max_age", self.motor_positions.max_age
+        )
 
         for motor_name in self.centring_motors_list:
             # NBNB TODO refactor configuration, and set properties directly (see below)
@@ -416,7 +576,11 @@ class GenericDiffractometer(HardwareObject):
                 #)
 
                 self.motor_hwobj_dict[motor_name] = temp_motor_hwobj
+                self.motor_positions.add_motor(motor_name, temp_motor_hwobj)
                 self.connect(temp_motor_hwobj, "stateChanged", self.motor_state_changed)
+                self.connect(
+                    temp_motor_hwobj, "stateChanged", self._motor_state_signalled
+                )
                 self.connect(
                     temp_motor_hwobj, "valueChanged", self.centring_motor_moved
                 )
@@ -473,6 +637,12 @@ class GenericDiffractometer(HardwareObject):
                 self.centring_sampy = sample_centring.CentringMotor(
                     self.motor_hwobj_dict["sampy"]
                 )
+                sample_centring.PIPELINED_CENTRING = self.get_property(
+                    "pipelined_centring", False
+                )
+                loop_detector = self.get_property("loop_detector")
+                if loop_detector:
+                    sample_centring.set_loop_detector(loop_detector)
         except Exception:
             pass  # used the default value
 
@@ -771,7 +941,9 @@ class GenericDiffractometer(HardwareObject):
         """
         Descript. :
         """
-
+        self.current_motor_positions.update(
+            self.get_motor_positions_snapshot().positions
+        )
         self.current_motor_positions["beam_x"] = (
             self.beam_position[0] - self.zoom_centre["x"]
         ) / self.pixels_per_mm_y
@@ -785,6 +957,49 @@ class GenericDiffractometer(HardwareObject):
         """Get motor_name:Motor dictionary"""
         return self.motor_hwobj_dict.copy()
 
+    def get_motor_positions_snapshot(
+        self, names=None, max_age=None, refresh=False, signal_only=False
+    ):
+        """
+        Positions of the motors, without accessing the hardware when the
+        positions are known, see MotorPositionCache.
+
+        :param names: Names of the motors, all the motors by default.
+        :type names: list
+        :param max_age: Maximum age of the positions in seconds.
+        :type max_age: float
+        :param refresh: True to read the positions from the motors.
+        :type refresh: bool
+        :param signal_only: True to use the positions of the last signals.
+        :type signal_only: bool
+
+        :returns: The positions of the motors and their timestamp
+        :rtype: MotorSnapshot
+        """
+        # motors added to motor_hwobj_dict by subclasses
+        cached_names = self.motor_positions.get_motor_names()
+        for name, motor in self.motor_hwobj_dict.items():
+            if name not in cached_names and motor is not None:
+                self.motor_positions.add_motor(name, motor)
+
+        return self.motor_positions.get_snapshot(names, max_age, refresh, signal_only)
+
+    def _get_centring_motor_positions(self):
+        """
+        :returns: The positions of the sample centring motors, by name, as
+                  last signalled (used to draw the shapes)
+        :rtype: dict
+        """
+        names = ("phi", "sampx", "sampy", "phiy", "phiz")
+        positions = self.get_motor_positions_snapshot(
+            [name for name in names if self.motor_hwobj_dict.get(name) is not None],
+            signal_only=True,
+        ).positions
+        for name in names:
+            if name not in positions:
+                positions[name] = getattr(self, "centring_" + name).get_value()
+        return positions
+
     # def get_omega_position(self):
     #     """
     #     Descript. :
@@ -1044,47 +1259,59 @@ class GenericDiffractometer(HardwareObject):
 
     def motor_positions_to_screen(self, centred_positions_dict):
         """ """
-        if self.use_sample_centring:
-            self.update_zoom_calibration()
-            if None in (self.pixels_per_mm_x, self.pixels_per_mm_y):
-                return 0, 0
-            phi_angle = math.radians(
-                self.centring_phi.direction * self.centring_phi.get_value()
-            )
-            sampx = self.centring_sampx.direction * (
-                centred_positions_dict["sampx"] - self.centring_sampx.get_value()
-            )
-            sampy = self.centring_sampy.direction * (
-                centred_positions_dict["sampy"] - self.centring_sampy.get_value()
-            )
-            phiy = self.centring_phiy.direction * (
-                centred_positions_dict["phiy"] - self.centring_phiy.get_value()
-            )
-            phiz = self.centring_phiz.direction * (
-                centred_positions_dict["phiz"] - self.centring_phiz.get_value()
-            )
-            rot_matrix = numpy.matrix(
-                [
-                    math.cos(phi_angle),
-                    -math.sin(phi_angle),
-                    math.sin(phi_angle),
-                    math.cos(phi_angle),
-                ]
-            )
-            rot_matrix.shape = (2, 2)
-            inv_rot_matrix = numpy.array(rot_matrix.I)
-            dx, dy = (
-                numpy.dot(numpy.array([sampx, sampy]), inv_rot_matrix)
-                * self.pixels_per_mm_x
-            )
+        x, y = self.motor_positions_to_screen_array([centred_positions_dict])[0]
+        return x, y
 
-            x = (phiy * self.pixels_per_mm_x) + self.beam_position[0]
-            y = dy + (phiz * self.pixels_per_mm_y) + self.beam_position[1]
+    def motor_positions_to_screen_array(self, centred_positions):
+        """
+        Projects centred positions to screen coordinates, reading the
+        centring motor positions once for all the centred positions.
 
-            return x, y
-        else:
+        :param centred_positions: Centred positions, as a structured array
+                                  (see CENTRED_POSITION_DTYPE) or a sequence
+                                  of motor position dictionaries.
+
+        :returns: Array of shape (N, 2) with the x and y pixel coordinates
+        :rtype: numpy.ndarray
+        """
+        if (
+            type(self).motor_positions_to_screen
+            is not GenericDiffractometer.motor_positions_to_screen
+        ):
+            # Projection defined by a subclass, one position at a time
+            if isinstance(centred_positions, numpy.ndarray):
+                names = centred_positions.dtype.names
+                centred_positions = [
+                    dict(zip(names, row.tolist())) for row in centred_positions
+                ]
+            result = [self.motor_positions_to_screen(pos) for pos in centred_positions]
+            return numpy.array(result, dtype=float).reshape(-1, 2)
+
+        if not self.use_sample_centring:
             raise NotImplementedError
 
+        positions = centred_positions_to_array(centred_positions)
+        self.update_zoom_calibration()
+        if None in (self.pixels_per_mm_x, self.pixels_per_mm_y):
+            return numpy.zeros((len(positions), 2))
+
+        motors = self._get_centring_motor_positions()
+        phi_angle = math.radians(self.centring_phi.direction * motors["phi"])
+        sampx = self.centring_sampx.direction * (positions["sampx"] - motors["sampx"])
+        sampy = self.centring_sampy.direction * (positions["sampy"] - motors["sampy"])
+        phiy = self.centring_phiy.direction * (positions["phiy"] - motors["phiy"])
+        phiz = self.centring_phiz.direction * (positions["phiz"] - motors["phiz"])
+
+        # (sampx, sampy) rotated by -phi, only the vertical component is used
+        dy = (
+            sampx * math.sin(phi_angle) + sampy * math.cos(phi_angle)
+        ) * self.pixels_per_mm_x
+
+        result = numpy.empty((len(positions), 2))
+        result[:, 0] = (phiy * self.pixels_per_mm_x) + self.beam_position[0]
+        result[:, 1] = dy + (phiz * self.pixels_per_mm_y) + self.beam_position[1]
+        return result
+
     def move_to_centred_position(self, centred_position):
         """ """
         self.move_motors(centred_position)
@@ -1101,7 +1328,8 @@ class GenericDiffractometer(HardwareObject):
 
     def move_motors(self, motor_positions, timeout=15):
         """
-        Moves diffractometer motors to the requested positions
+        Moves diffractometer motors to the requested positions, starting
+        all the moves at once and waiting until all the motors are ready.
 
         :param motors_dict: dictionary with motor names or hwobj
                             and target values.
@@ -1112,34 +1340,95 @@ class GenericDiffractometer(HardwareObject):
 
         self.wait_device_ready(timeout)
 
-        for motor in motor_positions.keys():
-            position = motor_positions[motor]
+        moves = []
+        for motor, position in motor_positions.items():
             self.log.debug(f"moving motor {motor} to position {position}")
-            """
-            if isinstance(motor, (str, unicode)):
-                logging.getLogger("HWR").debug(" Moving %s to %s" % (motor, position))
-            else:
-                logging.getLogger("HWR").debug(
-                    " Moving %s to %s" % (str(motor.name()), position)
-                )
-            """
             if isinstance(motor, (str, unicode)):
-                motor_role = motor
-                motor = self.motor_hwobj_dict.get(motor_role)
-                # del motor_positions[motor_role]
-                if None in (motor, position):
-                    continue
-                # motor_positions[motor] = position
-            motor.set_value(position)
-        self.wait_device_ready(timeout)
+                motor = self.motor_hwobj_dict.get(motor)
+            if None in (motor, position):
+                continue
+            moves.append((motor, position))
 
-        if self.delay_state_polling is not None and self.delay_state_polling > 0:
-            # delay polling for state in the
-            # case of controller not reporting MOVING inmediately after cmd
-            gevent.sleep(self.delay_state_polling)
+        if not self.start_simultaneous_move(moves):
+            for motor, position in moves:
+                motor.set_value(position)
 
+        self.wait_motors_ready(moves, timeout)
         self.wait_device_ready(timeout)
 
+    def start_simultaneous_move(self, moves):
+        """
+        Starts the moves <moves> with the simultaneous move command of the
+        controller, the used command SIMULTANEOUS_MOVE_COMMAND, if
+        configured and if all the motors have an actuator name.
+
+        :param moves: List of (motor, position).
+        :type moves: list
+
+        :returns: True if the moves were started
+        :rtype: bool
+        """
+        command = self.command_dict.get(self.SIMULTANEOUS_MOVE_COMMAND)
+        if command is None or not moves:
+            return False
+
+        argin = ""
+        for motor, position in moves:
+            name = getattr(motor, "actuator_name", None)
+            if not name:
+                return False
+            argin += "%s=%s;" % (name, float(position))
+
+        command(argin)
+        return True
+
+    def wait_motors_ready(self, moves, timeout=15):
+        """
+        Waits until the motors of <moves> are ready after moving to their
+        position. Driven by the stateChanged signals of the motors of
+        motor_hwobj_dict, connected at init, the states are also checked
+        every 0.5 s for the other motors.
+
+        A ready motor that was not seen moving is considered done when at
+        its position, or delay_state_polling seconds (0.1 s by default)
+        after the call, for controllers that do not report the move
+        immediately. Only the delay applies to non-numeric positions, of
+        enumerated actuators for instance.
+
+        :param moves: List of (motor, position).
+        :type moves: list
+        :param timeout: Timeout in seconds.
+        :type timeout: float
+        """
+        start = time.time()
+        grace_time = self.delay_state_polling or 0.1
+        moved = set()
+
+        def is_done(motor, position):
+            if not motor.is_ready():
+                moved.add(motor)
+                return False
+            if motor in moved or time.time() - start >= grace_time:
+                return True
+            if not isinstance(position, numbers.Real):
+                return False
+            value = motor.get_value()
+            if not isinstance(value, numbers.Real):
+                return False
+            tolerance = getattr(motor, "_tolerance", None) or 1e-3
+            return abs(value - position) <= tolerance
+
+        with gevent.Timeout(timeout, Exception("Timeout waiting for motors")):
+            while True:
+                # cleared before the check, not to miss the signals
+                self.motors_state_event.clear()
+                if all(is_done(motor, position) for motor, position in moves):
+                    return
+                remaining_grace = grace_time - (time.time() - start)
+                self.motors_state_event.wait(
+                    remaining_grace if 0 < remaining_grace < 0.5 else 0.5
+                )
+
     def move_motors_done(self, move_motors_procedure):
         """
         Descript. :
@@ -1288,7 +1577,11 @@ class GenericDiffractometer(HardwareObject):
             try:
                 motors[motor_role] = motor_pos[motor_obj]
             except KeyError:
-                if motor_obj:
+                if self.motor_hwobj_dict.get(motor_role) is not None:
+                    motors[motor_role] = self.get_motor_positions_snapshot(
+                        [motor_role]
+                    ).positions[motor_role]
+                elif motor_obj:
                     motors[motor_role] = motor_obj.get_value()
         motors["beam_x"] = (
             self.beam_position[0] - self.zoom_centre["x"]
@@ -1384,6 +1677,9 @@ class GenericDiffractometer(HardwareObject):
         """
         self.emit("minidiffStateChanged", (state,))
 
+    def _motor_state_signalled(self, *args):
+        self.motors_state_event.set()
+
     def current_phase_changed(self, current_phase):
         """
         Descript. :
@@ -21,6 +21,7 @@ GNU Lesser General Public License for more details.
 You should have received a copy of the GNU Lesser General Public License
 along with MXCuBE. If not, see <https://www.gnu.org/licenses/>.
 """
+
 from __future__ import (
     absolute_import,
     division,
@@ -1952,10 +1953,7 @@ class GphlWorkflow(HardwareObjectYaml):
             # Edna also sets osc_end
 
             # Path_template
-            path_template = HWR.beamline.get_default_path_template()
-            # Naughty, but we want a clone, right?
-            # NBNB this ONLY works because all the attributes are immutable values
-            path_template.__dict__.update(master_path_template.__dict__)
+            path_template = master_path_template.copy()
             if relative_image_dir:
                 path_template.directory = os.path.join(
                     HWR.beamline.session.get_base_image_directory(), relative_image_dir
@@ -88,6 +88,12 @@ class MiniDiff(HardwareObject):
         sample_centring.NUM_CENTRING_ROUNDS = self.get_property(
             "num_centering_rounds", 1
         )
+        sample_centring.PIPELINED_CENTRING = self.get_property(
+            "pipelined_centring", False
+        )
+        loop_detector = self.get_property("loop_detector")
+        if loop_detector:
+            sample_centring.set_loop_detector(loop_detector)
 
         self.cancel_centring_methods = {}
 
@@ -13,15 +13,65 @@ import traceback
 
 import gevent
 
+from mxcubecore import HardwareRepository as HWR
 from mxcubecore import queue_entry
 from mxcubecore.BaseHardwareObjects import HardwareObject
 from mxcubecore.model.queue_model_enumerables import CENTRING_METHOD
 from mxcubecore.queue_entry import base_queue_entry
 from mxcubecore.queue_entry.base_queue_entry import QUEUE_ENTRY_STATUS
+from mxcubecore.utils.queue_profiler import QueueProfiler
 
 QueueEntryContainer = base_queue_entry.QueueEntryContainer
 
 
+class QueueExecutionPlan(object):
+    """
+    The queue entries of a queue in execution order (depth first), with
+    their containers, built once and used until the queue changes.
+    """
+
+    def __init__(self, root_container, version):
+        self.version = version
+        self.entries = []
+        self.containers = []
+        # index following the last descendant of each entry
+        self.subtree_ends = []
+        self._positions = {}
+        self._add_entries(root_container)
+
+    def _add_entries(self, container):
+        for entry in container._queue_entry_list:
+            index = len(self.entries)
+            self._positions[id(entry)] = index
+            self.entries.append(entry)
+            self.containers.append(container)
+            self.subtree_ends.append(index + 1)
+            self._add_entries(entry)
+            self.subtree_ends[index] = len(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def index(self, entry):
+        """
+        :returns: The position of <entry> in the plan, None if it is
+                  not part of the plan
+        :rtype: int
+        """
+        index = self._positions.get(id(entry))
+        if index is not None and self.entries[index] is entry:
+            return index
+        return None
+
+    def get_container(self, entry):
+        """
+        :returns: The container of <entry>, None if it is not part of the plan
+        :rtype: QueueEntryContainer
+        """
+        index = self.index(entry)
+        return None if index is None else self.containers[index]
+
+
 class QueueManager(HardwareObject, QueueEntryContainer):
     def __init__(self, name):
         HardwareObject.__init__(self, name)
@@ -35,8 +85,26 @@ class QueueManager(HardwareObject, QueueEntryContainer):
         self._running = False
         self._disable_collect = False
         self._is_stopped = False
+        # Queue entries by id of their data model, see get_entry_with_model
+        self._entries_by_model = {}
+        self._execution_plan = None
+        # Number of executing entries by data model node id
+        self._executing_node_ids = {}
+        self._plan_position = 0
+        self._skip_to_entry = None
+        # Prepare the next sample while a sample is collected,
+        # see SampleQueueEntry
+        self.prefetch_next_sample = False
+        # Timing of the queue execution, the spans are emitted with the
+        # queue_profile_span signal
+        self.profiler = QueueProfiler()
+        self.profiler.add_listener(self._profile_span_recorded)
 
     def init(self):
+        self.prefetch_next_sample = self.get_property("prefetch_next_sample", False)
+        profile_file = self.get_property("profile_file")
+        if profile_file:
+            self.profiler.set_output_file(profile_file)
         site_entry_path = self.get_property("site_entry_path")
         if site_entry_path:
             queue_entry.import_queue_entries(site_entry_path.split(","))
@@ -47,11 +115,18 @@ class QueueManager(HardwareObject, QueueEntryContainer):
         d = dict(self.__dict__)
         d["_root_task"] = None
         d["_paused_event"] = None
+        d["_execution_plan"] = None
+        d["profiler"] = None
         return d
 
     def __setstate__(self, d):
         self.__dict__.update(d)
         self._paused_event = gevent.event.Event()
+        self.profiler = QueueProfiler()
+        self.profiler.add_listener(self._profile_span_recorded)
+
+    def _profile_span_recorded(self, span):
+        self.emit("queue_profile_span", (span,))
 
     @property
     def current_queue_entries(self):
@@ -93,6 +168,7 @@ class QueueManager(HardwareObject, QueueEntryContainer):
             self.emit("statusMessage", ("status", "Queue running", "running"))
             self._is_stopped = False
             self._running = True
+            self._plan_position = 0
 
             if not entry:
                 self._current_queue_entries = []
@@ -102,30 +178,58 @@ class QueueManager(HardwareObject, QueueEntryContainer):
                 task = gevent.spawn(self.__execute_entry, entry)
                 task.link((lambda _t: self._queue_end()))
 
+    def get_execution_plan(self):
+        """
+        :returns: The queue entries in execution order, rebuilt only when
+                  entries were enqueued, dequeued or swapped since the
+                  last call.
+        :rtype: QueueExecutionPlan
+        """
+        version = QueueEntryContainer.queue_version
+        if self._execution_plan is None or self._execution_plan.version != version:
+            self._execution_plan = QueueExecutionPlan(self, version)
+        return self._execution_plan
+
+    def get_progress(self):
+        """
+        :returns: The number of entries of the execution plan started or
+                  skipped in the current run, and the number of entries
+                  of the plan.
+        :rtype: tuple
+        """
+        return self._plan_position, len(self.get_execution_plan())
+
+    def skip_to_entry(self, entry):
+        """
+        Skips the entries preceding <entry> in execution order, in the
+        current run or in the next one if the queue is not running. The
+        entries containing <entry> are executed.
+
+        :param entry: The entry to skip to, None to cancel.
+        :type entry: QueueEntry
+
+        :raises: ValueError if the entry is not in the queue
+        """
+        if entry is not None and self.get_execution_plan().index(entry) is None:
+            raise ValueError("%s is not in the queue" % entry)
+        self._skip_to_entry = entry
+
     def _set_in_queue_flag(self):
         """
         Methods iterates over all queue entries and sets in_queue flag for
         DataCollectionQueue entries
         """
-        self.entry_list = []
-
-        def get_data_collection_list(entry):
-            for child in entry._queue_entry_list:
-                if (
-                    (
-                        isinstance(child, queue_entry.DataCollectionQueueEntry)
-                        or isinstance(
-                            child, queue_entry.CharacterisationGroupQueueEntry
-                        )
-                    )
-                    and not child.get_data_model().is_executed()
-                    and child.is_enabled()
-                ):
-                    self.entry_list.append(child)
-                get_data_collection_list(child)
-
-        for qe in self._queue_entry_list:
-            get_data_collection_list(qe)
+        collection_types = (
+            queue_entry.DataCollectionQueueEntry,
+            queue_entry.CharacterisationGroupQueueEntry,
+        )
+        self.entry_list = [
+            entry
+            for entry in self.get_execution_plan().entries
+            if isinstance(entry, collection_types)
+            and not entry.get_data_model().is_executed()
+            and entry.is_enabled()
+        ]
 
         if len(self.entry_list) > 1:
             for index, entry in enumerate(self.entry_list[:-1]):
@@ -141,20 +245,10 @@ class QueueManager(HardwareObject, QueueEntryContainer):
         :returns: True if the queue is executing otherwise False
         :rtype: bool
         """
-        status = self._running
-
         if node_id:
-            if self._current_queue_entries:
-                for qe in self._current_queue_entries:
-                    if qe.get_data_model()._node_id == node_id:
-                        status = True
-                        break
-                    else:
-                        status = False
-            else:
-                status = False
+            return node_id in self._executing_node_ids
 
-        return status
+        return self._running
 
     def __execute_task(self):
         self._running = True
@@ -182,84 +276,144 @@ class QueueManager(HardwareObject, QueueEntryContainer):
                     raise ex
         finally:
             self._running = False
+            self._skip_to_entry = None
             self.emit("queue_execution_finished", (None,))
 
+    def _skip_entry(self, entry):
+        """
+        :returns: True if <entry> precedes the entry given to skip_to_entry
+        :rtype: bool
+        """
+        plan = self.get_execution_plan()
+        index = plan.index(entry)
+        if index is not None:
+            self._plan_position = max(self._plan_position, index + 1)
+
+        if self._skip_to_entry is None or index is None:
+            return False
+
+        target = plan.index(self._skip_to_entry)
+        if target is None or target <= index:
+            # reached, or no longer in the queue
+            self._skip_to_entry = None
+            return False
+        if plan.subtree_ends[index] <= target:
+            self._plan_position = max(self._plan_position, plan.subtree_ends[index])
+            return True
+        return False
+
+    def _entry_changed(self, entry):
+        """
+        Records the execution status of <entry> in the change feed of the
+        queue model.
+        """
+        queue_model = getattr(HWR.beamline, "queue_model", None)
+        if queue_model is not None:
+            queue_model.node_changed(
+                entry.get_data_model(), base_queue_entry.status_list[entry.status]
+            )
+
     def __execute_entry(self, entry):
         if not entry.is_enabled() or self._is_stopped:
             return
+        if self._skip_entry(entry):
+            return
 
         self.emit("queue_entry_execute_started", (entry,))
         self.set_current_entry(entry)
         self._current_queue_entries.append(entry)
+        node_id = entry.get_data_model()._node_id
+        self._executing_node_ids[node_id] = self._executing_node_ids.get(node_id, 0) + 1
 
-        logging.getLogger("queue_exec").info("Executing: " + str(entry))
+        # formatted only if logged, str(entry) includes all the children
+        logging.getLogger("queue_exec").info("Executing: %s", entry)
 
         if self.is_paused():
             logging.getLogger("user_level_log").info("Queue paused, waiting ...")
-            entry.get_view().setText(1, "Queue paused, waiting")
+            view = entry.get_view()
+            if view:
+                view.setText(1, "Queue paused, waiting")
 
         self.wait_for_pause_event()
 
-        try:
-            # Procedure to be done before main implementation
-            # of task.
-            entry.status = QUEUE_ENTRY_STATUS.RUNNING
-            entry.pre_execute()
-            entry.execute()
-
-            for child in entry._queue_entry_list:
-                self.__execute_entry(child)
-            # This part should not be here
-            # But somehow exception from collect_failed is not catched here
-            if entry.is_failed():
+        with self.profiler.entry_span(entry):
+            try:
+                # Procedure to be done before main implementation
+                # of task.
+                entry.status = QUEUE_ENTRY_STATUS.RUNNING
+                with self.profiler.span("pre_execute", entry):
+                    entry.pre_execute()
+                self._entry_changed(entry)
+                with self.profiler.span("execute", entry):
+                    entry.execute()
+
+                for child in entry._queue_entry_list:
+                    self.__execute_entry(child)
+                # This part should not be here
+                # But somehow exception from collect_failed is not catched here
+                if entry.is_failed():
+                    entry.status = QUEUE_ENTRY_STATUS.FAILED
+                    self.emit("queue_entry_execute_finished", (entry, "Failed"))
+                    self.emit(
+                        "statusMessage", ("status", "Queue execution failed", "error")
+                    )
+                else:
+                    entry.status = QUEUE_ENTRY_STATUS.SUCCESS
+                    self.emit("queue_entry_execute_finished", (entry, "Successful"))
+                    self.emit("statusMessage", ("status", "", "ready"))
+            except base_queue_entry.QueueSkipEntryException as ex:
+                logging.getLogger("HWR").warning(
+                    "encountered Exception (continuing):\n%s" % ex.stack_trace
+                    or ex.message
+                )
+                # Queue entry, failed, skipp.
+                entry.status = QUEUE_ENTRY_STATUS.SKIPPED
+                self.emit("queue_entry_execute_finished", (entry, "Skipped"))
+            except base_queue_entry.QueueAbortedException as ex:
+                # Queue entry was aborted in a controlled, way.
+                # or in the exception case:
+                # Definitely not good state, but call post_execute
+                # anyway, there might be code that cleans up things
+                # done in _pre_execute or before the exception in _execute.
+                logging.getLogger("HWR").warning(
+                    "encountered Exception (continuing):\n%s" % ex.stack_trace
+                    or ex.message
+                )
+                entry.status = QUEUE_ENTRY_STATUS.FAILED
+                self.emit("queue_entry_execute_finished", (entry, "Aborted"))
+                with self.profiler.span("post_execute", entry):
+                    entry.post_execute()
+                entry.handle_exception(ex)
+                raise ex
+            except base_queue_entry.QueueExecutionException as ex:
+                logging.getLogger("HWR").warning(
+                    "encountered Exception (continuing):\n%s" % ex.stack_trace
+                    or ex.message
+                )
                 entry.status = QUEUE_ENTRY_STATUS.FAILED
                 self.emit("queue_entry_execute_finished", (entry, "Failed"))
                 self.emit(
                     "statusMessage", ("status", "Queue execution failed", "error")
                 )
+            except:
+                logging.getLogger("HWR").warning(
+                    "encountered Exception:\n%s" % traceback.format_exc()
+                )
+                raise
             else:
-                entry.status = QUEUE_ENTRY_STATUS.SUCCESS
-                self.emit("queue_entry_execute_finished", (entry, "Successful"))
-                self.emit("statusMessage", ("status", "", "ready"))
-        except base_queue_entry.QueueSkipEntryException as ex:
-            logging.getLogger("HWR").warning(
-                "encountered Exception (continuing):\n%s" % ex.stack_trace or ex.message
-            )
-            # Queue entry, failed, skipp.
-            entry.status = QUEUE_ENTRY_STATUS.SKIPPED
-            self.emit("queue_entry_execute_finished", (entry, "Skipped"))
-        except base_queue_entry.QueueAbortedException as ex:
-            # Queue entry was aborted in a controlled, way.
-            # or in the exception case:
-            # Definitely not good state, but call post_execute
-            # anyway, there might be code that cleans up things
-            # done in _pre_execute or before the exception in _execute.
-            logging.getLogger("HWR").warning(
-                "encountered Exception (continuing):\n%s" % ex.stack_trace or ex.message
-            )
-            entry.status = QUEUE_ENTRY_STATUS.FAILED
-            self.emit("queue_entry_execute_finished", (entry, "Aborted"))
-            entry.post_execute()
-            entry.handle_exception(ex)
-            raise ex
-        except base_queue_entry.QueueExecutionException as ex:
-            logging.getLogger("HWR").warning(
-                "encountered Exception (continuing):\n%s" % ex.stack_trace or ex.message
-            )
-            entry.status = QUEUE_ENTRY_STATUS.FAILED
-            self.emit("queue_entry_execute_finished", (entry, "Failed"))
-            self.emit("statusMessage", ("status", "Queue execution failed", "error"))
-        except:
-            logging.getLogger("HWR").warning(
-                "encountered Exception:\n%s" % traceback.format_exc()
-            )
-            raise
-        else:
-            entry.post_execute()
-        finally:
-            # self.emit('queue_entry_execute_finished', (entry, ))
-            self.set_current_entry(None)
-            self._current_queue_entries.pop(self._current_queue_entries.index(entry))
+                with self.profiler.span("post_execute", entry):
+                    entry.post_execute()
+            finally:
+                # self.emit('queue_entry_execute_finished', (entry, ))
+                self._entry_changed(entry)
+                self.set_current_entry(None)
+                self._current_queue_entries.pop(
+                    self._current_queue_entries.index(entry)
+                )
+                if self._executing_node_ids[node_id] > 1:
+                    self._executing_node_ids[node_id] -= 1
+                else:
+                    del self._executing_node_ids[node_id]
 
     def stop(self):
         """
@@ -399,7 +553,21 @@ class QueueManager(HardwareObject, QueueEntryContainer):
         :rtype: QueueEntry
         """
         if not root_queue_entry:
-            root_queue_entry = self
+            entry = self._entries_by_model.get(id(model))
+            if entry is not None and entry.get_data_model() is model:
+                container = entry.get_container()
+                while container is not None and container is not self:
+                    container = container.get_container()
+                if container is self:
+                    return entry
+
+            # Rebuild the index, keeping the first entry found for each model
+            self._entries_by_model = {}
+            self._index_entries(self)
+            entry = self._entries_by_model.get(id(model))
+            if entry is not None and entry.get_data_model() is model:
+                return entry
+            return None
 
         for queue_entry in root_queue_entry._queue_entry_list:
             if queue_entry.get_data_model() is model:
@@ -410,6 +578,16 @@ class QueueManager(HardwareObject, QueueEntryContainer):
                 if result:
                     return result
 
+    def _index_entries(self, root_queue_entry):
+        """
+        Adds the entries of <root_queue_entry> to the model to entry index.
+        """
+        for queue_entry in root_queue_entry._queue_entry_list:
+            self._entries_by_model.setdefault(
+                id(queue_entry.get_data_model()), queue_entry
+            )
+            self._index_entries(queue_entry)
+
     def execute_entry(self, entry, use_async=False):
         """
         Executes the queue entry once the queue has been started <entry>.
@@ -439,6 +617,8 @@ class QueueManager(HardwareObject, QueueEntryContainer):
         :rtype: NoneType
         """
         self._queue_entry_list = []
+        self._entries_by_model = {}
+        QueueEntryContainer.queue_version += 1
 
     def show_workflow_tab(self):
         self.emit("show_workflow_tab")
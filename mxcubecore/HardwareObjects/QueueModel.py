@@ -26,6 +26,7 @@ retreiving nodes are all done via this object. It is possbile to
 handle several models by using register_model and select_model.
 """
 
+import ast
 import json
 import logging
 import os
@@ -35,7 +36,11 @@ import jsonpickle
 from mxcubecore import HardwareRepository as HWR
 from mxcubecore import queue_entry
 from mxcubecore.BaseHardwareObjects import HardwareObject
-from mxcubecore.model import queue_model_objects
+from mxcubecore.model import (
+    queue_model_objects,
+    queue_serializer,
+)
+from mxcubecore.model.queue_change_feed import QueueChangeFeed
 
 
 class Serializer(object):
@@ -63,6 +68,10 @@ class QueueModel(HardwareObject):
 
         self._selected_model = self._ispyb_model
 
+        # Changes of the selected model, see get_queue_changes
+        self._change_feed = QueueChangeFeed()
+        self._change_feed.add_listener(self._queue_change_recorded)
+
     def __getstate__(self):
         d = dict(self.__dict__)
         return d
@@ -70,6 +79,14 @@ class QueueModel(HardwareObject):
     def __setstate__(self, d):
         self.__dict__.update(d)
 
+        # Rebuild the path template indexes, which are not copied
+        for root in self._models.values():
+            root._path_templates = queue_model_objects.PathTemplateIndex()
+            for node in list(root._nodes_by_id.values()):
+                path_template = node.get_path_template()
+                if path_template is not None:
+                    root._path_templates.add(node, path_template)
+
     # Framework-2 method, inherited from HardwareObject and called
     # by the framework after the object has been initialized.
     def init(self):
@@ -93,6 +110,7 @@ class QueueModel(HardwareObject):
         """
         self._selected_model = self._models[name]
         HWR.beamline.queue_manager.clear()
+        self._change_feed.reset(self._selected_model)
         self._re_emit(self._selected_model)
 
     def get_model_root(self):
@@ -112,12 +130,23 @@ class QueueModel(HardwareObject):
         :returns: None
         :rtype: NoneType
         """
-        self._models[name] = queue_model_objects.RootNode()
+        if name:
+            names = [name]
+        else:
+            names = list(self._models.keys())
 
-        if not name:
-            for name in self._models.keys():
+        for name in names:
+            if name in self._models:
+                self._models[name]._path_templates.clear()
+
+            if self._selected_model is self._models.get(name):
+                self._selected_model = self._models[name] = (
+                    queue_model_objects.RootNode()
+                )
+            else:
                 self._models[name] = queue_model_objects.RootNode()
 
+        self._change_feed.reset(self._selected_model)
         HWR.beamline.queue_manager.clear()
 
     def register_model(self, name, root_node):
@@ -161,12 +190,24 @@ class QueueModel(HardwareObject):
         """
         if True:
             # if isinstance(child, queue_model_objects.TaskNode):
-            self._selected_model._total_node_count += 1
+            old_root = self._get_root(child)
+            if old_root is not None:
+                self._unindex_nodes(old_root, child)
+                if old_root is self._selected_model:
+                    self._change_feed.node_removed(child)
+
+            root = self._get_root(parent)
+            counter_root = self._selected_model if root is None else root
+            counter_root._total_node_count += 1
             child._parent = parent
-            child._node_id = self._selected_model._total_node_count
+            child._node_id = counter_root._total_node_count
             parent._children.append(child)
+            if root is not None:
+                self._index_nodes(root, child)
             child._set_name(child._name)
             self.emit("child_added", (parent, child))
+            if root is self._selected_model:
+                self._change_feed.node_added(child)
         else:
             raise TypeError("Expected type TaskNode, got %s " % str(type(child)))
 
@@ -202,6 +243,10 @@ class QueueModel(HardwareObject):
         """
         if parent is None:
             parent = self._selected_model
+            node = parent._nodes_by_id.get(_id)
+            if node is not None and node._node_id == _id:
+                if self._get_root(node) is parent:
+                    return node
 
         for node in parent._children:
             if node._node_id == _id:
@@ -224,7 +269,110 @@ class QueueModel(HardwareObject):
         """
         if child in parent._children:
             parent._children.remove(child)
+            root = self._get_root(parent)
+            if root is not None:
+                self._unindex_nodes(root, child)
             self.emit("child_removed", (parent, child))
+            if root is self._selected_model:
+                self._change_feed.node_removed(child)
+
+    def node_changed(self, node, status=None):
+        """
+        Records the changes of the status and parameters of the node
+        <node> in the change feed of the model.
+
+        :param node: The node that changed.
+        :type node: TaskNode
+        :param status: Execution status of the queue entry of the node,
+                       for instance "RUNNING" or "FAILED".
+        :type status: str
+        """
+        self._change_feed.node_changed(node, status)
+
+    def refresh_queue_changes(self):
+        """
+        Records the changes of all the nodes of the selected model, for
+        changes made to the nodes directly.
+        """
+        self._change_feed.refresh(self._selected_model)
+
+    def get_queue_snapshot(self):
+        """
+        :returns: The version of the change feed and the JSON state of the
+                  nodes of the selected model, parents first.
+        :rtype: dict
+        """
+        return self._change_feed.get_snapshot()
+
+    def get_queue_changes(self, since):
+        """
+        Returns the changes of the selected model since the version <since>
+        of the change feed, as a list of patches under "patches". A full
+        snapshot is returned under "nodes" instead when the patches are no
+        longer available, after selecting another model for instance.
+
+        :param since: Version of the change feed the client has.
+        :type since: int
+
+        :returns: The version of the change feed and the patches or nodes.
+        :rtype: dict
+        """
+        patches = self._change_feed.get_changes(since)
+        if patches is None:
+            return self._change_feed.get_snapshot()
+        return {"version": self._change_feed.get_version(), "patches": patches}
+
+    def _queue_change_recorded(self, patch):
+        self.emit("queue_changed", (patch,))
+
+    def _get_root(self, node):
+        """
+        :returns: The root of the model that <node> is part of, None if
+                  <node> is not (yet) part of a model.
+        :rtype: RootNode
+        """
+        while node._parent is not None:
+            node = node._parent
+
+        if isinstance(node, queue_model_objects.RootNode):
+            return node
+
+    def _index_nodes(self, root, node):
+        """
+        Adds <node> and its descendants to the node id and path template
+        indexes of <root>.
+        Descendants whose node id is missing or already used in the model
+        (copied or reloaded nodes) are given a new node id.
+        """
+        index = root._nodes_by_id
+        if index.get(node._node_id) is not node:
+            index[node._node_id] = node
+            path_template = node.get_path_template()
+            if path_template is not None:
+                root._path_templates.add(node, path_template)
+
+        for child in node._children:
+            _id = child._node_id
+            if (
+                _id is None
+                or _id > root._total_node_count
+                or index.get(_id, child) is not child
+            ):
+                root._total_node_count += 1
+                child._node_id = root._total_node_count
+            self._index_nodes(root, child)
+
+    def _unindex_nodes(self, root, node):
+        """
+        Removes <node> and its descendants from the indexes of <root>.
+        """
+        index = root._nodes_by_id
+        if index.get(node._node_id) is node:
+            del index[node._node_id]
+            root._path_templates.remove(node)
+
+        for child in node._children:
+            self._unindex_nodes(root, child)
 
     def _detach_child(self, parent, child):
         """
@@ -291,9 +439,9 @@ class QueueModel(HardwareObject):
 
     def get_next_run_number(self, new_path_template, exclude_current=True):
         """
-        Iterates through all the path templates of the tasks
-        in the model and returns the next available run number
-        for the path template <new_path_template>.
+        Looks up the path templates of the tasks in the model
+        and returns the next available run number for the
+        path template <new_path_template>.
 
         :param new_path_template: PathTempalte to match with.
         :type new_path_template: PathTemplate
@@ -304,19 +452,9 @@ class QueueModel(HardwareObject):
         :returns: The next available run number for the given path_template.
         :rtype: int
         """
-        all_path_templates = self.get_path_templates()
-        conflicting_path_templates = [0]
-
-        for pt in all_path_templates:
-            if exclude_current:
-                if pt[1] is not new_path_template:
-                    if pt[1] == new_path_template:
-                        conflicting_path_templates.append(pt[1].run_number)
-            else:
-                if pt[1] == new_path_template:
-                    conflicting_path_templates.append(pt[1].run_number)
-
-        return max(conflicting_path_templates) + 1
+        return self._selected_model._path_templates.get_next_run_number(
+            new_path_template, exclude_current
+        )
 
     def get_path_templates(self):
         """
@@ -348,17 +486,29 @@ class QueueModel(HardwareObject):
         Returns True if there is a path template (task) in the model,
         that produces the same files as this one.
 
+        Changes of the path template attributes update the model index,
+        replacing the path template object of a task requires calling
+        update_path_template.
+
         :returns: True if there is a potential path collision.
         """
-        result = False
-        path_template_list = self.get_path_templates()
+        return self._selected_model._path_templates.has_collision(new_path_template)
 
-        for pt in path_template_list:
-            if pt[1] is not new_path_template:
-                if new_path_template.intersection(pt[1]):
-                    result = True
+    def update_path_template(self, node):
+        """
+        Updates the path template index of the model after the path
+        template object of <node> has been replaced.
 
-        return result
+        :param node: The node.
+        :type node: TaskNode
+        """
+        root = self._get_root(node)
+        if root is not None and root._nodes_by_id.get(node._node_id) is node:
+            path_template = node.get_path_template()
+            if path_template is None:
+                root._path_templates.remove(node)
+            else:
+                root._path_templates.add(node, path_template)
 
     def copy_node(self, node):
         """
@@ -421,14 +571,15 @@ class QueueModel(HardwareObject):
 
         return result
 
-    def save_queue(self, filename=None):
-        """Saves queue in the file. Current selected model is saved as a list
-        of dictionaries. Information about samples and baskets is not saved
+    def get_queue_items(self):
         """
-        if not filename:
-            filename = os.path.join(self.user_file_directory, "queue_active.dat")
+        Returns the name of the selected model and the task groups of
+        the queue, with the location of their sample.
 
-        items_to_save = []
+        :returns: Model name and list of (sample location, task group)
+        :rtype: tuple
+        """
+        items = []
 
         selected_model = ""
         for key in self._models:
@@ -440,24 +591,54 @@ class QueueModel(HardwareObject):
             # On the top level is Sample or Basket
             if isinstance(item, queue_entry.SampleQueueEntry):
                 for task_item in item.get_queue_entry_list():
-                    task_item_dict = {
-                        "sample_location": item.get_data_model().location,
-                        "task_group_entry": jsonpickle.encode(
-                            task_item.get_data_model()
-                        ),
-                    }
-                    items_to_save.append(task_item_dict)
+                    items.append(
+                        (item.get_data_model().location, task_item.get_data_model())
+                    )
+
+        return selected_model, items
+
+    def load_queue_items(self, items, snapshot=None):
+        """
+        Adds the task groups <items>, returned by get_queue_items, to the
+        samples of the queue.
+
+        :param items: List of (sample location, task group)
+        :type items: list
+
+        :param snapshot: Snapshot set to the loaded tasks.
+        """
+        # Prepare list of samples
+        sample_dict = {}
+        for item in HWR.beamline.queue_manager.get_queue_entry_list():
+            if isinstance(item, queue_entry.SampleQueueEntry):
+                sample_data_model = item.get_data_model()
+                sample_dict[sample_data_model.location] = sample_data_model
+            elif isinstance(item, queue_entry.BasketQueueEntry):
+                for sample_item in item.get_queue_entry_list():
+                    sample_data_model = sample_item.get_data_model()
+                    sample_dict[sample_data_model.location] = sample_data_model
+
+        for sample_location, task_group_entry in items:
+            self.add_child(sample_dict[sample_location], task_group_entry)
+            for child in task_group_entry.get_children():
+                child.set_snapshot(snapshot)
+
+    def save_queue(self, filename=None):
+        """Saves queue in the file, with queue_serializer. Current selected
+        model is saved with the task groups of the samples. Information about
+        samples and baskets is not saved
+        """
+        if not filename:
+            filename = os.path.join(self.user_file_directory, "queue_active.dat")
 
-        save_file = None
         try:
-            save_file = open(filename, "w")
-            save_file.write(repr((selected_model, items_to_save)))
+            data = queue_serializer.dumps(self.get_queue_items())
+            with open(filename, "wb") as save_file:
+                save_file.write(data)
         except Exception:
             logging.getLogger().exception(
                 "Unable to save queue " + "in file %s", filename
             )
-            if save_file:
-                save_file.close()
 
     def get_queue_as_json_list(self):
         items_to_save = []
@@ -516,42 +697,32 @@ class QueueModel(HardwareObject):
         """
 
         logging.getLogger("HWR").info("Loading queue from file %s" % filename)
-        load_file = None
         try:
             # Read file and clear the model
-            load_file = open(filename, "r")
-            decoded_file = eval(load_file.read())
-            self.select_model(decoded_file[0])
-
-            # Prepare list of samples
-            sample_dict = {}
-            for item in HWR.beamline.queue_manager.get_queue_entry_list():
-                if isinstance(item, queue_entry.SampleQueueEntry):
-                    sample_data_model = item.get_data_model()
-                    sample_dict[sample_data_model.location] = sample_data_model
-                elif isinstance(item, queue_entry.BasketQueueEntry):
-                    for sample_item in item.get_queue_entry_list():
-                        sample_data_model = sample_item.get_data_model()
-                        sample_dict[sample_data_model.location] = sample_data_model
-
-            if len(decoded_file[1]) > 0:
-                for task_group_item in decoded_file[1]:
-                    task_group_entry = jsonpickle.decode(
-                        task_group_item["task_group_entry"]
-                    )
-                    self.add_child(
-                        sample_dict[task_group_item["sample_location"]],
-                        task_group_entry,
+            with open(filename, "rb") as load_file:
+                data = load_file.read()
+
+            if queue_serializer.is_serialized(data):
+                selected_model, items = queue_serializer.loads(data)
+            else:
+                # Files saved with jsonpickle by earlier versions
+                selected_model, saved_items = ast.literal_eval(data.decode())
+                items = [
+                    (
+                        item["sample_location"],
+                        jsonpickle.decode(item["task_group_entry"], safe=True),
                     )
-                    for child in task_group_entry.get_children():
-                        child.set_snapshot(snapshot)
+                    for item in saved_items
+                ]
+            self.select_model(selected_model)
+
+            if len(items) > 0:
+                self.load_queue_items(items, snapshot)
                 logging.getLogger("HWR").info("Queue loading done")
             else:
                 logging.getLogger("HWR").info("No queue content available in file")
-            return decoded_file[0]
+            return selected_model
         except Exception:
             logging.getLogger("HWR").exception(
                 "Unable to load queue " + "from file %s", filename
             )
-            if load_file:
-                load_file.close()
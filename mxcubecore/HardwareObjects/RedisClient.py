@@ -41,6 +41,7 @@ import redis
 
 from mxcubecore import HardwareRepository as HWR
 from mxcubecore.BaseHardwareObjects import HardwareObject
+from mxcubecore.model import queue_serializer
 
 __version__ = "2.3."
 __category__ = "General"
@@ -56,6 +57,10 @@ class RedisClient(HardwareObject):
         self.proposal_id = None
         self.beamline_name = None
         self.redis_client = None
+        # Only the changed task groups of the queue are saved
+        self.queue_dumper = queue_serializer.IncrementalDumper()
+        # Keys of the saved task groups, by node id of their nodes
+        self.queue_item_keys = {}
 
     def init(self):
         self.host = self.get_property("host")
@@ -90,6 +95,11 @@ class RedisClient(HardwareObject):
         except Exception:
             pass
 
+        try:
+            self.connect(HWR.beamline.queue_model, "queue_changed", self.queue_changed)
+        except Exception:
+            pass
+
         self.proposal_id = HWR.beamline.session.get_proposal()
         self.beamline_name = HWR.beamline.session.beamline_name
 
@@ -101,18 +111,65 @@ class RedisClient(HardwareObject):
         if self.active:
             gevent.spawn(self.save_queue_task)
 
+    def queue_changed(self, patch):
+        """Marks the task group of the node changed by <patch> (a patch of
+        the change feed of the queue model) to be saved"""
+        if patch["op"] == "reset":
+            self.queue_dumper.reset()
+            return
+
+        node_id = patch["parent"] if patch["op"] == "add" else patch["id"]
+        key = self.queue_item_keys.get(node_id)
+        if key is not None:
+            self.queue_dumper.mark_dirty(key)
+
     def save_queue_task(self):
-        """Queue saving tasks"""
-        selected_model, queue_list = HWR.beamline.queue_model.get_queue_as_json_list()
-        self.redis_client.set(
-            "mxcube:%s:%s:queue_model" % (self.proposal_id, self.beamline_name),
-            selected_model,
-        )
-        self.redis_client.set(
-            "mxcube:%s:%s:queue_current" % (self.proposal_id, self.beamline_name),
-            queue_list,
+        """Queue saving tasks. The task groups are saved in a hash, keyed
+        by node id, with the list of keys giving their order. Only the new
+        task groups and the ones changed in the change feed of the queue
+        model since the previous save are serialized: changes made to the
+        nodes directly need to be notified with queue_model.node_changed"""
+        queue_model = HWR.beamline.queue_model
+        selected_model, items = queue_model.get_queue_items()
+        items = {str(item[1]._node_id): item for item in items}
+
+        self.queue_item_keys = {}
+        for key, (_, task_group) in items.items():
+            self._add_item_keys(task_group, key)
+
+        full_save = self.queue_dumper.is_reset()
+        queue_key = "mxcube:%s:%s:queue_items" % (self.proposal_id, self.beamline_name)
+        try:
+            changed, removed = self.queue_dumper.dump(items)
+            pipe = self.redis_client.pipeline()
+            pipe.set(
+                "mxcube:%s:%s:queue_model" % (self.proposal_id, self.beamline_name),
+                selected_model,
+            )
+            pipe.set(
+                "mxcube:%s:%s:queue_current" % (self.proposal_id, self.beamline_name),
+                queue_serializer.dumps(list(items)),
+            )
+            if full_save:
+                pipe.delete(queue_key)
+            if changed:
+                pipe.hset(queue_key, mapping=changed)
+            if removed:
+                pipe.hdel(queue_key, *removed)
+            pipe.execute()
+        except Exception:
+            # Save everything next time
+            self.queue_dumper.reset()
+            logging.getLogger("HWR").exception("RedisClient: Could not save queue")
+            return
+        logging.getLogger("HWR").debug(
+            "RedisClient: Current queue saved (%d changed task groups)", len(changed)
         )
-        logging.getLogger("HWR").debug("RedisClient: Current queue saved")
+
+    def _add_item_keys(self, node, key):
+        self.queue_item_keys[node._node_id] = key
+        for child in node.get_children():
+            self._add_item_keys(child, key)
 
     def load_queue(self):
         """Loads queue from redis DB"""
@@ -127,11 +184,34 @@ class RedisClient(HardwareObject):
                 "mxcube:%s:%s:queue_current" % (self.proposal_id, self.beamline_name)
             )
             if selected_model is not None:
+                if isinstance(selected_model, bytes):
+                    selected_model = selected_model.decode()
                 HWR.beamline.queue_model.select_model(selected_model)
-                HWR.beamline.queue_model.load_queue_from_json_list(
-                    eval(serialized_queue),
-                    snapshot=HWR.beamline.sample_view.get_scene_snapshot(),
-                )
+                keys = []
+                if serialized_queue and queue_serializer.is_serialized(
+                    serialized_queue
+                ):
+                    keys = queue_serializer.loads(serialized_queue)
+                if keys:
+                    saved_items = self.redis_client.hmget(
+                        "mxcube:%s:%s:queue_items"
+                        % (self.proposal_id, self.beamline_name),
+                        keys,
+                    )
+                    items = []
+                    for key, item in zip(keys, saved_items):
+                        if item is None:
+                            logging.getLogger("HWR").warning(
+                                "RedisClient: Queue item %s is missing", key
+                            )
+                        else:
+                            items.append(queue_serializer.loads(item))
+                    HWR.beamline.queue_model.load_queue_items(
+                        items,
+                        snapshot=HWR.beamline.sample_view.get_scene_snapshot(),
+                    )
+                # The loaded task groups get new node ids
+                self.queue_dumper.reset()
 
             self.active = True
             logging.getLogger("HWR").debug("RedisClient: Queue loaded")
@@ -147,7 +227,7 @@ class RedisClient(HardwareObject):
             graphic_objects = HWR.beamline.sample_view.dump_shapes()
             self.redis_client.set(
                 "mxcube:%s:%s:graphics" % (self.proposal_id, self.beamline_name),
-                jsonpickle.encode(graphic_objects),
+                queue_serializer.dumps(graphic_objects),
             )
 
     def load_graphics(self):
@@ -157,9 +237,11 @@ class RedisClient(HardwareObject):
                 graphics_objects = self.redis_client.get(
                     "mxcube:%s:%s:graphics" % (self.proposal_id, self.beamline_name)
                 )
-                HWR.beamline.sample_view.load_shapes(
-                    jsonpickle.decode(graphics_objects)
-                )
+                if queue_serializer.is_serialized(graphics_objects):
+                    graphics_objects = queue_serializer.loads(graphics_objects)
+                else:
+                    graphics_objects = jsonpickle.decode(graphics_objects, safe=True)
+                HWR.beamline.sample_view.load_shapes(graphics_objects)
                 logging.getLogger("HWR").debug("RedisClient: Graphics loaded")
             except Exception:
                 pass
@@ -76,9 +76,27 @@ class SampleView(AbstractSampleView):
                 motor_ho.connect("stateChanged", self._update_shape_positions)
 
     def _update_shape_positions(self, *args, **kwargs):
+        diffractometer = HWR.beamline.diffractometer
+        shapes = self.get_shapes()
+        to_screen_array = getattr(
+            diffractometer, "motor_positions_to_screen_array", None
+        )
 
-        for shape in self.get_shapes():
-            shape.update_position(HWR.beamline.diffractometer.motor_positions_to_screen)
+        if to_screen_array is None:
+            for shape in shapes:
+                shape.update_position(diffractometer.motor_positions_to_screen)
+        else:
+            # all the centred positions projected at once
+            screen_positions = to_screen_array(
+                [cp.as_dict() for shape in shapes for cp in shape.cp_list]
+            ).tolist()
+            start = 0
+            for shape in shapes:
+                shape_positions = iter(
+                    screen_positions[start : start + len(shape.cp_list)]
+                )
+                start += len(shape.cp_list)
+                shape.update_position(lambda _, pos=shape_positions: next(pos))
 
         self.emit("shapesChanged")
 
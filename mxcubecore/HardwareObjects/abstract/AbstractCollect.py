@@ -36,6 +36,7 @@ import gevent.event
 from mxcubecore import HardwareRepository as HWR
 from mxcubecore.BaseHardwareObjects import HardwareObject
 from mxcubecore.TaskUtils import task
+from mxcubecore.utils import queue_profiler
 
 __credits__ = ["MXCuBE collaboration"]
 
@@ -242,7 +243,8 @@ class AbstractCollect(HardwareObject, object):
                 )
                 wavelength = HWR.beamline.energy.calculate_wavelength(energy)
             if energy:
-                self.set_energy(energy)
+                with queue_profiler.span("energy"):
+                    self.set_energy(energy)
 
             if detector_distance:
                 # detector_distance (not having a default) overrides resolution
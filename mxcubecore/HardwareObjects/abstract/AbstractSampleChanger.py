@@ -624,6 +624,20 @@ class SampleChanger(Container, HardwareObject):
         self.wait_ready(timeout=10)
         return self.load(sample_to_load)
 
+    def prestage(self, sample):
+        """
+        Prepare the load of a sample while another sample is mounted, for
+        instance by moving the dewar to the puck of the sample. Does nothing
+        by default, sample changers supporting it override this method.
+
+        Args:
+            sample (str): sample location, as passed to load
+
+        Returns:
+            (boolean): True if the load was prepared, False otherwise
+        """
+        return False
+
     def load(self, sample=None, wait=True):
         """
         Load a sample.
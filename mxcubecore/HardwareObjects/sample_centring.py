@@ -6,7 +6,7 @@ import time
 
 import gevent.event
 import numpy
-from scipy import optimize
+from PIL import Image
 
 try:
     import lucid3 as lucid
@@ -14,21 +14,62 @@ except ImportError:
     try:
         import lucid
     except ImportError:
+        lucid = None
         logging.warning(
             "Could not find autocentring library, automatic centring is disabled"
         )
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 
-def multiPointCentre(z, phis):
-    def fitfunc(p, x):
-        return p[0] * numpy.sin(x + p[1]) + p[2]
 
-    def errfunc(p, x, y):
-        return fitfunc(p, x) - y
+class SinusoidFit:
+    """
+    Least squares fit of z = r * sin(phi + a) + offset, updated as the
+    points arrive.
 
-    # The function call returns tuples of varying length
-    result = optimize.leastsq(errfunc, [1.0, 0.0, 0.0], args=(phis, z))
-    return result[0]
+    As r * sin(phi + a) = r * cos(a) * sin(phi) + r * sin(a) * cos(phi),
+    the fit is linear in (r * cos(a), r * sin(a), offset), so it only keeps
+    the sums of its normal equations.
+    """
+
+    def __init__(self):
+        self._matrix = numpy.zeros((3, 3))
+        self._vector = numpy.zeros(3)
+        self.count = 0
+
+    def add_point(self, z, phi):
+        """
+        Adds the point (phi, z) to the fit.
+
+        :param z: Position.
+        :type z: float
+        :param phi: Angle in radians.
+        :type phi: float
+        """
+        row = numpy.array([math.sin(phi), math.cos(phi), 1.0])
+        self._matrix += numpy.outer(row, row)
+        self._vector += row * z
+        self.count += 1
+
+    def get_result(self):
+        """
+        :returns: r, a and offset fitted to the points so far
+        :rtype: numpy.ndarray
+        """
+        (a_cos, a_sin, offset), _, _, _ = numpy.linalg.lstsq(
+            self._matrix, self._vector, rcond=None
+        )
+        return numpy.array([math.hypot(a_cos, a_sin), math.atan2(a_sin, a_cos), offset])
+
+
+def multiPointCentre(z, phis):
+    fit = SinusoidFit()
+    for z_value, phi in zip(z, phis):
+        fit.add_point(z_value, phi)
+    return fit.get_result()
 
 
 USER_CLICKED_EVENT = None
@@ -36,6 +77,8 @@ CURRENT_CENTRING = None
 SAVED_INITIAL_POSITIONS = {}
 READY_FOR_NEXT_POINT = gevent.event.Event()
 NUM_CENTRING_ROUNDS = 1
+# Analyse the images of automatic centring while phi rotates to the next angle
+PIPELINED_CENTRING = False
 
 
 class CentringMotor:
@@ -455,6 +498,60 @@ def center(
         raise RuntimeError("Exception while centring")
 
     # logging.info("X=%s,Y=%s", X, Y)
+    Z = rotate_chi(math.radians(chi_angle), numpy.array(X), numpy.array(Y))
+    z = Z[1]
+    avg_pos = Z[0].mean()
+
+    return get_centred_position(
+        phi,
+        phiy,
+        phiz,
+        sampx,
+        sampy,
+        pixelsPerMm_Hor,
+        pixelsPerMm_Ver,
+        beam_xc,
+        beam_yc,
+        chi_angle,
+        avg_pos,
+        multiPointCentre(z, phi_positions),
+    )
+
+
+def rotate_chi(chi_angle, x, y):
+    """
+    :returns: The coordinates <x>, <y> rotated by <chi_angle> radians
+    :rtype: tuple
+    """
+    return (
+        math.cos(chi_angle) * x - math.sin(chi_angle) * y,
+        math.sin(chi_angle) * x + math.cos(chi_angle) * y,
+    )
+
+
+def get_centred_position(
+    phi,
+    phiy,
+    phiz,
+    sampx,
+    sampy,
+    pixelsPerMm_Hor,
+    pixelsPerMm_Ver,
+    beam_xc,
+    beam_yc,
+    chi_angle,
+    avg_pos,
+    fit_result,
+):
+    """
+    :param avg_pos: Mean position along the pin axis, in mm in the chi
+                    rotated frame.
+    :param fit_result: r, a and offset of the sinusoid fitted to the
+                       positions across the pin axis.
+
+    :returns: The motor positions of the centred sample
+    :rtype: dict
+    """
     chi_angle = math.radians(chi_angle)
     chiRotMatrix = numpy.matrix(
         [
@@ -462,11 +559,8 @@ def center(
             [math.sin(chi_angle), math.cos(chi_angle)],
         ]
     )
-    Z = chiRotMatrix * numpy.matrix([X, Y])
-    z = Z[1]
-    avg_pos = Z[0].mean()
 
-    r, a, offset = multiPointCentre(numpy.array(z).flatten(), phi_positions)
+    r, a, offset = fit_result
     dy = r * numpy.sin(a)
     dx = r * numpy.cos(a)
 
@@ -520,13 +614,23 @@ def start_auto(
     n_points=3,
     msg_cb=None,
     new_point_cb=None,
+    pipelined=None,
 ):
     global CURRENT_CENTRING
 
+    if get_loop_detector() is None:
+        raise RuntimeError(
+            "Automatic centring is disabled, lucid is not installed "
+            "and no loop detector is set"
+        )
+
     phi, phiy, phiz, sampx, sampy = prepare(centring_motors_dict)
 
+    if pipelined is None:
+        pipelined = PIPELINED_CENTRING
+
     CURRENT_CENTRING = gevent.spawn(
-        auto_center,
+        auto_center_pipelined if pipelined else auto_center,
         sample_view,
         phi,
         phiy,
@@ -545,12 +649,198 @@ def start_auto(
     return CURRENT_CENTRING
 
 
-def find_loop(sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb):
-    snapshot_filename = os.path.join(
-        tempfile.gettempdir(), "mxcube_sample_snapshot.png"
-    )
-    sample_view.save_snapshot(snapshot_filename, overlay=False, bw=True)
+class LoopDetector:
+    """
+    Finds the loop in the frames of the sample view.
+    """
+
+    def find_loop(self, image, rotation=None):
+        """
+        Finds the loop in <image>.
+
+        :param image: Grayscale frame, 2D array.
+        :type image: numpy.ndarray
+        :param rotation: Angle of the pin in the frame in degrees, counter
+                         clockwise, None for a horizontal pin.
+        :type rotation: float
+
+        :returns: Information on the detection, and x, y pixel coordinates
+                  of the loop, -1, -1 if there is no loop
+        :rtype: tuple
+        """
+        raise NotImplementedError
+
+
+class LucidLoopDetector(LoopDetector):
+    """
+    Loop detection with the lucid library, fed with the frames as arrays.
+    """
+
+    def __init__(self, iteration_closing=6):
+        self.iteration_closing = iteration_closing
+
+    def find_loop(self, image, rotation=None):
+        return lucid.find_loop(
+            image,
+            rotation=rotation,
+            debug=False,
+            IterationClosing=self.iteration_closing,
+        )
+
+
+class NumpyLoopDetector(LoopDetector):
+    """
+    Reference loop detection with numpy, and OpenCV when available.
+
+    The pixels that differ from the background, the median of the frame,
+    by more than <threshold> times the median deviation (and at least
+    <min_contrast> grey levels) belong to the sample holder. The pin comes
+    from the side <pin_side> ("right" or "left" of the unrotated frame),
+    so the loop is the tip of the holder: the first <loop_depth> pixels of
+    the holder along the pin axis, its position being their centroid.
+    Pin axis positions with less than <min_width> holder pixels are noise.
+
+    The detector is only used when set, with set_loop_detector("numpy") or
+    the loop_detector property of the diffractometer.
+    """
+
+    def __init__(
+        self,
+        threshold=6.0,
+        min_contrast=20.0,
+        min_width=3,
+        loop_depth=40,
+        blur_size=5,
+        pin_side="right",
+    ):
+        self.threshold = threshold
+        self.min_contrast = min_contrast
+        self.min_width = min_width
+        self.loop_depth = loop_depth
+        self.blur_size = blur_size
+        self.pin_side = pin_side
+
+    def _blur(self, image):
+        size = self.blur_size
+        if size <= 1:
+            return image
+        if cv2 is not None:
+            return cv2.blur(image, (size, size))
+
+        # box filter with cumulative sums, edges padded
+        pad = size // 2
+        padded = numpy.pad(
+            image, ((pad, size - 1 - pad), (pad, size - 1 - pad)), "edge"
+        )
+        sums = numpy.cumsum(numpy.cumsum(padded, axis=0), axis=1)
+        sums = numpy.pad(sums, ((1, 0), (1, 0)))
+        return (
+            sums[size:, size:]
+            - sums[:-size, size:]
+            - sums[size:, :-size]
+            + sums[:-size, :-size]
+        ) / (size * size)
+
+    def get_mask(self, image):
+        """
+        :returns: The mask of the pixels of the sample holder in <image>
+        :rtype: numpy.ndarray
+        """
+        image = self._blur(numpy.asarray(image, dtype=numpy.float32))
+        deviation = numpy.abs(image - numpy.median(image))
+        noise = numpy.median(deviation)
+        return deviation > max(self.threshold * noise, self.min_contrast)
+
+    def find_loop(self, image, rotation=None):
+        rows, columns = numpy.nonzero(self.get_mask(image))
+        if rows.size == 0:
+            return "No loop detected", -1, -1
+
+        # unit vector along the pin, from the tip to the pin side
+        angle = math.radians(rotation or 0)
+        direction = 1 if self.pin_side == "right" else -1
+        axis_x = direction * math.cos(angle)
+        axis_y = -direction * math.sin(angle)
+
+        positions = numpy.rint(columns * axis_x + rows * axis_y).astype(numpy.int64)
+        offset = positions.min()
+        counts = numpy.bincount(positions - offset)
+        (holder,) = numpy.nonzero(counts >= self.min_width)
+        if holder.size == 0:
+            return "No loop detected", -1, -1
+
+        tip = holder[0] + offset
+        in_loop = (positions >= tip) & (positions < tip + self.loop_depth)
+        return "Coord", float(columns[in_loop].mean()), float(rows[in_loop].mean())
+
+
+# Loop detectors by name, see set_loop_detector
+LOOP_DETECTORS = {"lucid": LucidLoopDetector, "numpy": NumpyLoopDetector}
+LOOP_DETECTOR = None
+
+
+def get_loop_detector():
+    """
+    :returns: The loop detector of the automatic centring, lucid by
+              default, None if lucid is not installed and no other
+              detector was set (automatic centring is disabled)
+    :rtype: LoopDetector
+    """
+    global LOOP_DETECTOR
+
+    if LOOP_DETECTOR is None and lucid is not None:
+        LOOP_DETECTOR = LucidLoopDetector()
+    return LOOP_DETECTOR
+
+
+def set_loop_detector(detector):
+    """
+    Sets the loop detector of the automatic centring, None for the default.
+
+    :param detector: The loop detector, or its name in LOOP_DETECTORS.
+    :type detector: LoopDetector or str
+    """
+    global LOOP_DETECTOR
+
+    if isinstance(detector, str):
+        detector = LOOP_DETECTORS[detector]()
+    LOOP_DETECTOR = detector
+
+
+def get_frame(sample_view):
+    """
+    :returns: The current frame of <sample_view> as a grayscale 2D array,
+              taken in memory when the sample view returns arrays
+    :rtype: numpy.ndarray
+    """
+    try:
+        image = sample_view.get_snapshot(overlay=False, bw=True, return_as_array=True)
+    except (AttributeError, TypeError, NotImplementedError):
+        image = None
+
+    if not isinstance(image, numpy.ndarray) or image.ndim not in (2, 3):
+        # sample views without array snapshots, through a file
+        snapshot_filename = os.path.join(
+            tempfile.gettempdir(), "mxcube_sample_snapshot.png"
+        )
+        sample_view.save_snapshot(snapshot_filename, overlay=False, bw=True)
+        with Image.open(snapshot_filename) as snapshot:
+            image = numpy.array(snapshot.convert("L"))
 
+    if image.ndim == 3:
+        # 8-bit, as the loop detectors expect
+        grey = numpy.dot(image[..., :3], [0.299, 0.587, 0.114])
+        image = grey.round().astype(numpy.uint8)
+    return image
+
+
+def detect_loop(image, chi_angle):
+    """
+    :returns: Information on the detection and the x, y coordinates of the
+              loop in <image>, None, -1, -1 if the detector gave no
+              coordinates or failed
+    :rtype: tuple
+    """
     # Lucid does not accept 0 degree rotation and
     # has a reference frame that is reversed to the one used
     # in MXCuBE
@@ -559,14 +849,21 @@ def find_loop(sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb):
     else:
         chi_angle = -chi_angle
 
-    info, x, y = lucid.find_loop(
-        snapshot_filename, rotation=chi_angle, debug=False, IterationClosing=6
-    )
+    try:
+        info, x, y = get_loop_detector().find_loop(image, rotation=chi_angle)
+    except Exception:
+        logging.getLogger("HWR").exception("Loop detection failed")
+        return None, -1, -1
 
     try:
-        x = float(x)
-        y = float(y)
+        return info, float(x), float(y)
     except Exception:
+        return None, -1, -1
+
+
+def find_loop(sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb):
+    info, x, y = detect_loop(get_frame(sample_view), chi_angle)
+    if info is None:
         return -1, -1
 
     if callable(msg_cb):
@@ -577,6 +874,27 @@ def find_loop(sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb):
     return x, y
 
 
+def find_first_loop(sample_view, phi, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb):
+    """
+    Checks if the loop is there at the beginning, rotating phi by 90
+    degrees until it is found.
+
+    :returns: True if the loop was found
+    :rtype: bool
+    """
+    i = 0
+    while -1 in find_loop(
+        sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb
+    ):
+        phi.set_value_relative(90)
+        i += 1
+        if i > 4:
+            if callable(msg_cb):
+                msg_cb("No loop detected, aborting")
+            return False
+    return True
+
+
 def auto_center(
     sample_view,
     phi,
@@ -596,17 +914,10 @@ def auto_center(
     imgWidth = sample_view.camera.get_width()
     imgHeight = sample_view.camera.get_height()
 
-    # check if loop is there at the beginning
-    i = 0
-    while -1 in find_loop(
-        sample_view, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb
+    if not find_first_loop(
+        sample_view, phi, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb
     ):
-        phi.set_value_relative(90)
-        i += 1
-        if i > 4:
-            if callable(msg_cb):
-                msg_cb("No loop detected, aborting")
-            return
+        return
 
     for k in range(NUM_CENTRING_ROUNDS):
         if callable(msg_cb):
@@ -669,3 +980,114 @@ def auto_center(
         end(centred_pos)
 
     return centred_pos
+
+
+def auto_center_pipelined(
+    sample_view,
+    phi,
+    phiy,
+    phiz,
+    sampx,
+    sampy,
+    pixelsPerMm_Hor,
+    pixelsPerMm_Ver,
+    beam_xc,
+    beam_yc,
+    chi_angle,
+    n_points,
+    msg_cb,
+    new_point_cb,
+    phi_range=180,
+):
+    """
+    Automatic centring that finds the loop in the image of each angle while
+    phi already rotates to the next angle, the loop detection running in
+    the thread pool of gevent. The centre is fitted as the points arrive;
+    the angles where no loop is found are left out of the fit, and the
+    centring falls back to auto_center, retrying around the missed angles,
+    when the loop is found at less than 3 angles. On errors, the motors
+    are moved back to their initial positions.
+    """
+    if not find_first_loop(
+        sample_view, phi, pixelsPerMm_Hor, chi_angle, msg_cb, new_point_cb
+    ):
+        return
+
+    threadpool = gevent.get_hub().threadpool
+    phi_step = phi.direction * phi_range / (n_points - 1)
+    rad_chi_angle = math.radians(chi_angle)
+
+    for k in range(NUM_CENTRING_ROUNDS):
+        if callable(msg_cb):
+            msg_cb("Doing automatic centring")
+
+        fit = SinusoidFit()
+        pos_sum = 0.0
+        try:
+            for i in range(n_points):
+                image = get_frame(sample_view)
+                phi_position = phi.direction * math.radians(phi.get_value())
+                if i != n_points - 1:
+                    phi.set_value_relative(phi_step, timeout=0)
+
+                info, x, y = threadpool.spawn(detect_loop, image, chi_angle).get()
+                if x >= 0 and y >= 0:
+                    if callable(msg_cb):
+                        msg_cb("Loop found: %s (%d, %d)" % (info, x, y))
+                    if callable(new_point_cb):
+                        new_point_cb((x, y))
+                    pos, z = rotate_chi(
+                        rad_chi_angle,
+                        x / float(pixelsPerMm_Hor),
+                        y / float(pixelsPerMm_Ver),
+                    )
+                    fit.add_point(z, phi_position)
+                    pos_sum += pos
+
+                if i != n_points - 1:
+                    phi.wait_ready(timeout=10)
+        except Exception:
+            logging.exception("Exception while centring")
+            try:
+                phi.wait_ready(timeout=10)
+            finally:
+                move_motors(SAVED_INITIAL_POSITIONS)
+            raise
+
+        if fit.count < 3:
+            if callable(msg_cb):
+                msg_cb("Loop not found at enough angles, centring step by step")
+            return auto_center(
+                sample_view,
+                phi,
+                phiy,
+                phiz,
+                sampx,
+                sampy,
+                pixelsPerMm_Hor,
+                pixelsPerMm_Ver,
+                beam_xc,
+                beam_yc,
+                chi_angle,
+                n_points,
+                msg_cb,
+                new_point_cb,
+            )
+
+        centred_pos = get_centred_position(
+            phi,
+            phiy,
+            phiz,
+            sampx,
+            sampy,
+            pixelsPerMm_Hor,
+            pixelsPerMm_Ver,
+            beam_xc,
+            beam_yc,
+            chi_angle,
+            pos_sum / fit.count,
+            fit.get_result(),
+        )
+        end(centred_pos)
+
+    return centred_pos
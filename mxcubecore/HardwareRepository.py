@@ -44,6 +44,9 @@ from typing import (
     Union,
 )
 
+import gevent
+import gevent.event
+import gevent.pool
 from ruamel.yaml import YAML
 
 from mxcubecore import (
@@ -51,6 +54,7 @@ from mxcubecore import (
     HardwareObjectFileParser,
 )
 from mxcubecore.dispatcher import dispatcher
+from mxcubecore.utils import parse_cache
 from mxcubecore.utils.conversion import (
     make_table,
     string_types,
@@ -78,6 +82,115 @@ beamline = None
 BEAMLINE_CONFIG_FILE = "beamline_config.yml"
 
 
+def _load_content(container, class_name, role, config_file, _table):
+    """Load an object contained in a yaml-configured object
+
+    Args:
+        container (ConfiguredObject): Container object
+        class_name (str): Class name of the container
+        role (str): Role name of the contained object
+        config_file (str): Configuration file of the contained object
+        _table (List): Collecting summary output
+    """
+    fname, fext = os.path.splitext(config_file)
+    if fext in (".yaml", ".yml"):
+        load_from_yaml(config_file, role=role, _container=container, _table=_table)
+    elif fext == ".xml":
+        msg1 = ""
+        class_name1 = "None"
+        time0 = time.time()
+        try:
+            hwobj = _instance.get_hardware_object(fname)
+            if hwobj is None:
+                msg1 = "No object loaded"
+            else:
+                class_name1 = hwobj.__class__.__name__
+                if hasattr(container, role):
+                    container.replace_object(role, hwobj)
+                else:
+                    msg1 = "No such role: %s.%s" % (class_name, role)
+        except Exception as ex:
+            msg1 = "Loading error (%s)" % str(ex)
+            class_name1 = ""
+        load_time = 1000 * (time.time() - time0)
+        _table.append((role, class_name1, config_file, "%.1d" % load_time, msg1))
+
+
+def _dependency_order(objects, dependencies):
+    """Sort roles so that each role comes after the roles it depends on,
+    keeping the configuration order otherwise
+
+    Args:
+        objects (dict): Configuration files by role, in configuration order
+        dependencies (dict): Lists of roles each role depends on
+
+    Returns:
+        List[str]: Roles
+
+    Raises:
+        ValueError: In case of circular dependencies
+    """
+    result = []
+    visiting = set()
+
+    def visit(role, path=()):
+        if role in result:
+            return
+        if role in visiting:
+            raise ValueError("Circular dependency between roles %s" % (path,))
+        visiting.add(role)
+        for dependency in dependencies.get(role) or ():
+            if dependency in objects:
+                visit(dependency, path + (dependency,))
+        visiting.discard(role)
+        result.append(role)
+
+    for role in objects:
+        visit(role, (role,))
+    return result
+
+
+def _load_contents_concurrently(
+    container, class_name, objects, dependencies, concurrency, _table
+):
+    """Load the objects contained in a yaml-configured object, up to
+    concurrency of them at a time
+
+    A role is loaded once the roles it depends on have been loaded.
+    xml objects that several roles refer to are only loaded once (see
+    get_hardware_object).
+
+    Args:
+        container (ConfiguredObject): Container object
+        class_name (str): Class name of the container
+        objects (dict): Configuration files by role
+        dependencies (dict): Lists of roles each role depends on
+        concurrency (int): Maximum number of objects loaded at a time
+        _table (List): Collecting summary output
+    """
+    tables = {role: [] for role in objects}
+    loaded = {role: gevent.event.Event() for role in objects}
+
+    def load(role):
+        try:
+            for dependency in dependencies.get(role) or ():
+                if dependency in loaded:
+                    loaded[dependency].wait()
+            _load_content(container, class_name, role, objects[role], tables[role])
+        finally:
+            loaded[role].set()
+
+    # Roles are started in dependency order, so that the roles waited for
+    # always have a slot in the pool
+    pool = gevent.pool.Pool(concurrency)
+    for role in _dependency_order(objects, dependencies):
+        pool.spawn(load, role)
+    pool.join()
+
+    for role in objects:
+        _table.extend(tables[role])
+
+
 def load_from_yaml(configuration_file, role, _container=None, _table=None):
     """
 
@@ -112,7 +225,7 @@ def load_from_yaml(configuration_file, role, _container=None, _table=None):
     if not msg0:
         # Load the configuration file
         with open(configuration_path, "r") as fp0:
-            configuration = yaml.load(fp0)
+            configuration = parse_cache.load(configuration_path, fp0.read(), yaml.load)
 
         # Get actual class
         initialise_class = configuration.pop("_initialise_class", None)
@@ -183,6 +296,10 @@ def load_from_yaml(configuration_file, role, _container=None, _table=None):
     if not msg0:
         # Recursively load contained objects (of any type that the system can support)
         _objects = configuration.pop("_objects", {})
+        # Number of contained objects loaded at a time, and the roles each
+        # role depends on, when loading them concurrently
+        load_concurrency = configuration.pop("_load_concurrency", 1)
+        dependencies = configuration.pop("_dependencies", {})
         if _objects:
             load_time = 1000 * (time.time() - start_time)
             msg1 = "Start loading contents:"
@@ -190,33 +307,13 @@ def load_from_yaml(configuration_file, role, _container=None, _table=None):
                 (role, class_name, configuration_file, "%.1d" % load_time, msg1)
             )
             msg0 = "Done loading contents"
-        for role1, config_file in _objects.items():
-            fname, fext = os.path.splitext(config_file)
-            if fext in (".yaml", ".yml"):
-                load_from_yaml(
-                    config_file, role=role1, _container=result, _table=_table
-                )
-            elif fext == ".xml":
-                msg1 = ""
-                time0 = time.time()
-                try:
-                    hwobj = _instance.get_hardware_object(fname)
-                    if hwobj is None:
-                        msg1 = "No object loaded"
-                        class_name1 = "None"
-                    else:
-                        class_name1 = hwobj.__class__.__name__
-                        if hasattr(result, role1):
-                            result.replace_object(role1, hwobj)
-                        else:
-                            msg1 = "No such role: %s.%s" % (class_name, role1)
-                except Exception as ex:
-                    msg1 = "Loading error (%s)" % str(ex)
-                    class_name = ""
-                load_time = 1000 * (time.time() - time0)
-                _table.append(
-                    (role1, class_name1, config_file, "%.1d" % load_time, msg1)
-                )
+        if load_concurrency > 1 and len(_objects) > 1:
+            _load_contents_concurrently(
+                result, class_name, _objects, dependencies, load_concurrency, _table
+            )
+        else:
+            for role1, config_file in _objects.items():
+                _load_content(result, class_name, role1, config_file, _table)
 
         # Set simple, miscellaneous properties.
         # NB the attribute must have been initialied in the class __init__ first.
@@ -279,6 +376,16 @@ def set_user_file_directory(user_file_directory):
     BaseHardwareObjects.HardwareObjectNode.set_user_file_directory(user_file_directory)
 
 
+def set_parse_cache_directory(cache_directory):
+    """Sets the directory of the parsed configuration files cache.
+
+    Args:
+        cache_directory (str): absolute path to the cache directory,
+                               None to disable the cache
+    """
+    parse_cache.set_cache_directory(cache_directory)
+
+
 def init_hardware_repository(configuration_path):
     """Initialise hardware repository - must be run at program start
 
@@ -360,6 +467,12 @@ class __HardwareRepositoryClient:
         self.hwobj_info_list = []
         self.invalid_hardware_objects = None
         self.hardware_objects = None
+        # Dictionary on the form:
+        # key: Name of the Hardware Object being loaded
+        # value: (loading greenlet, AsyncResult set to the loaded object)
+        self._loading = {}
+        # Name of the Hardware Object each greenlet waits for, by greenlet
+        self._waiting = {}
 
     def connect(self):
         if self.__connected:
@@ -675,13 +788,63 @@ class __HardwareRepositoryClient:
                 if object_name in self.hardware_objects:
                     hardware_obj = self.hardware_objects[object_name]
                 else:
-                    hardware_obj = self._load_hardware_object(object_name)
+                    hardware_obj = self._load_shared(object_name)
                 return hardware_obj
         except TypeError as err:
             logging.getLogger("HWR").exception(
                 "could not get Hardware Object %s", object_name
             )
 
+    def _load_shared(self, object_name):
+        """Load a Hardware Object, or wait for it if another greenlet is
+        already loading it.
+
+        Args:
+            object_name (str): The name of the Hardware Object
+
+        Returns:
+            Union[HardwareObject, None]: The loaded Hardware Object
+        """
+        loading = self._loading.get(object_name)
+        if loading is not None:
+            current = gevent.getcurrent()
+            if loading[0] is not current and not self._waits_for(loading[0], current):
+                self._waiting[current] = object_name
+                try:
+                    return loading[1].get()
+                finally:
+                    del self._waiting[current]
+            # reentrant load, or loads that would wait for each other
+            # (objects referring to each other): load it here, as before
+            return self._load_hardware_object(object_name)
+
+        result = gevent.event.AsyncResult()
+        self._loading[object_name] = (gevent.getcurrent(), result)
+        hardware_obj = None
+        try:
+            hardware_obj = self._load_hardware_object(object_name)
+        finally:
+            del self._loading[object_name]
+            result.set(hardware_obj)
+        return hardware_obj
+
+    def _waits_for(self, greenlet, other):
+        """
+        Returns:
+            bool: True if <greenlet> waits, directly or through other
+                  loads, for an object loaded by the greenlet <other>
+        """
+        seen = set()
+        while greenlet not in seen:
+            seen.add(greenlet)
+            loading = self._loading.get(self._waiting.get(greenlet))
+            if loading is None:
+                return False
+            greenlet = loading[0]
+            if greenlet is other:
+                return True
+        return False
+
     def get_equipment(self, equipment_name):
         """Return an Equipment given its name (see get_hardware_object())"""
         return self.get_hardware_object(equipment_name)
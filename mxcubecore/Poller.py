@@ -1,4 +1,7 @@
+import heapq
+import itertools
 import logging
+import time
 
 import gevent
 import gevent.monkey
@@ -17,6 +20,20 @@ log = logging.getLogger("HWR")
 
 POLLERS = {}
 
+# (polled_call, polled_call_args) -> poller, for constant time deduplication
+_POLLERS_BY_CALL = {}
+
+# number of native threads shared by all the pollers, see set_max_polling_threads
+MAX_POLLING_THREADS = 4
+
+# a polled call running for longer than this [s] is considered blocked: it
+# no longer counts against MAX_POLLING_THREADS and an extra thread is started
+# if other pollers are waiting
+SLOW_CALL_TIME = 1.0
+
+# extra threads exit after staying idle for this long [s]
+EXTRA_THREAD_IDLE_TIME = 10.0
+
 gevent_version = list(map(int, gevent.__version__.split(".")))
 
 
@@ -37,6 +54,27 @@ def get_poller(poller_id):
     return POLLERS.get(poller_id)
 
 
+def set_max_polling_threads(max_threads):
+    """Set the number of native threads shared by all the pollers.
+
+    Args:
+        max_threads (int): Number of polling threads, at least 1.
+    """
+    _scheduler.set_max_threads(max_threads)
+
+
+def _find_poller(polled_call, polled_call_args):
+    try:
+        return _POLLERS_BY_CALL.get((polled_call, polled_call_args))
+    except TypeError:
+        # unhashable arguments, fall back to a linear search
+        for poller in POLLERS.values():
+            poller_polled_call = poller.polled_call_ref()
+            if poller_polled_call == polled_call and poller.args == polled_call_args:
+                return poller
+    return None
+
+
 def poll(
     polled_call,
     polled_call_args=(),
@@ -47,15 +85,11 @@ def poll(
     start_delay=0,
     start_value=NotInitializedValue,
 ):
-    # logging.info(">>>> %s", POLLERS)
-    for poller in POLLERS.values():
-        poller_polled_call = poller.polled_call_ref()
-        # logging.info(">>>>> poller.poll_cmd=%s, poll_cmd=%s, poller.args=%s, args=%s", poller_polled_call, polled_call, poller.args, polled_call_args)
-        if poller_polled_call == polled_call and poller.args == polled_call_args:
-            poller.set_polling_period(min(polling_period, poller.get_polling_period()))
-            return poller
-
-    # logging.info(">>>>> CREATING NEW POLLER for cmd %r, args=%s, polling time=%d", polled_call, polled_call_args, polling_period)
+    poller = _find_poller(polled_call, polled_call_args)
+    if poller is not None:
+        poller.set_polling_period(min(polling_period, poller.get_polling_period()))
+        return poller
+
     poller = _Poller(
         polled_call,
         polled_call_args,
@@ -66,10 +100,149 @@ def poll(
     )
     poller.old_res = start_value
     POLLERS[poller.get_id()] = poller
+    try:
+        _POLLERS_BY_CALL[(polled_call, polled_call_args)] = poller
+    except TypeError:
+        pass
     poller.start_delayed(start_delay)
     return poller
 
 
+class _PollScheduler:
+    """Deadline scheduler running all the pollers on a small pool of
+    native threads.
+
+    A single scheduler thread keeps a heap of pollers ordered by the time
+    they are next due, and hands them over to the worker threads. A poller
+    is put back in the heap only once its call has returned, so the same
+    poller never runs concurrently with itself.
+
+    A native call cannot be interrupted, so a blocking polled call (for
+    example a read waiting for a device timeout) keeps its thread. When
+    pollers are due while every worker is busy in a call running for longer
+    than slow_call_time, an extra thread is started so that the other
+    pollers are not starved. Extra threads exit once they are idle.
+    """
+
+    def __init__(
+        self, max_threads=MAX_POLLING_THREADS, slow_call_time=SLOW_CALL_TIME
+    ):
+        simple_queue = gevent.monkey.get_original("queue", "SimpleQueue")
+        self.max_threads = max_threads
+        self.slow_call_time = slow_call_time
+        self._heap = []
+        self._counter = itertools.count()
+        # the heap is only touched by the scheduler thread, other threads
+        # send it (due time, poller) pairs through this queue
+        self._pending = simple_queue()
+        self._ready = simple_queue()
+        self._started = False
+        # the worker bookkeeping below is protected by this lock
+        self._lock = _threading.Lock()
+        self._nb_threads = 0
+        self._nb_idle = 0
+        # worker id -> start time of the call it is running
+        self._calls = {}
+        self._worker_ids = itertools.count()
+
+    def _start(self):
+        self._started = True
+        _threading.start_new_thread(self._schedule, ())
+        with self._lock:
+            self._start_workers(self.max_threads)
+
+    def _start_workers(self, nb_threads):
+        # called with the lock held
+        for _ in range(nb_threads):
+            self._nb_threads += 1
+            _threading.start_new_thread(self._work, ())
+
+    def set_max_threads(self, max_threads):
+        """Set the number of worker threads kept running"""
+        if max_threads < 1:
+            raise ValueError("At least one polling thread is needed")
+        with self._lock:
+            self.max_threads = max_threads
+            if self._started:
+                self._start_workers(max(max_threads - self._nb_threads, 0))
+
+    def add(self, poller, delay=0):
+        """Schedule a poller to be run after delay [s]"""
+        if not self._started:
+            self._start()
+        self._pending.put((time.monotonic() + delay, poller))
+
+    def _schedule(self):
+        while True:
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.monotonic(), 0)
+            if not self._ready.empty():
+                # pollers are waiting for a worker, check for blocked ones
+                if timeout is None or timeout > self.slow_call_time:
+                    timeout = self.slow_call_time
+            try:
+                due, poller = self._pending.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                heapq.heappush(self._heap, (due, next(self._counter), poller))
+
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                poller = heapq.heappop(self._heap)[2]
+                if not poller.is_stopped():
+                    self._ready.put(poller)
+
+            if not self._ready.empty():
+                self._check_blocked(now)
+
+    def _check_blocked(self, now):
+        """Start an extra worker if all the workers are blocked in slow calls"""
+        with self._lock:
+            if self._nb_idle > 0 or not self._calls:
+                return
+            calls = self._calls.values()
+            if any(now - start < self.slow_call_time for start in calls):
+                return
+            self._start_workers(1)
+
+    def _work(self):
+        worker_id = next(self._worker_ids)
+        while True:
+            with self._lock:
+                self._nb_idle += 1
+                extra = self._nb_threads > self.max_threads
+            try:
+                poller = self._ready.get(
+                    timeout=EXTRA_THREAD_IDLE_TIME if extra else None
+                )
+            except queue.Empty:
+                with self._lock:
+                    self._nb_idle -= 1
+                    if self._nb_threads > self.max_threads:
+                        self._nb_threads -= 1
+                        return
+                continue
+
+            with self._lock:
+                self._nb_idle -= 1
+                self._calls[worker_id] = time.monotonic()
+            try:
+                reschedule = poller.poll_once()
+            except Exception:
+                log.exception("Poller: unexpected error")
+                reschedule = False
+            finally:
+                with self._lock:
+                    del self._calls[worker_id]
+            if reschedule:
+                self.add(poller, poller.get_polling_period() / 1000.0)
+
+
+_scheduler = _PollScheduler()
+
+
 class _Poller:
     def __init__(
         self,
@@ -92,18 +265,21 @@ class _Poller:
         self.delay = 0
         self.stop_event = Event()
 
-        #if gevent_version < [1,3,0]:
-            #self.async_watcher = gevent.get_hub().loop.async()
-        #else:
         self.async_watcher = gevent.get_hub().loop.async_()
 
     def start_delayed(self, delay):
         self.delay = delay
-        _threading.start_new_thread(self.run, ())
+        self.async_watcher.start(self.new_event)
+        _scheduler.add(self, delay / 1000.0)
 
     def stop(self):
         self.stop_event.set()
         del POLLERS[self.get_id()]
+        try:
+            if _POLLERS_BY_CALL.get((self.polled_call, self.args)) is self:
+                del _POLLERS_BY_CALL[(self.polled_call, self.args)]
+        except TypeError:
+            pass
 
     def is_stopped(self):
         return self.stop_event.is_set()
@@ -151,65 +327,54 @@ class _Poller:
                 if cb is not None:
                     gevent.spawn(cb, res)
 
-    def run(self):
-        sleep = gevent.monkey._get_original("time", ["sleep"])[0]
+    def poll_once(self):
+        """Call the polled function once, from a polling thread.
 
-        self.async_watcher.start(self.new_event)
-
-        err_callback_args = None
-        error_cb = None
-        first_run = True
+        Returns:
+            (bool): True if the poller has to be scheduled again.
+        """
+        if self.stop_event.is_set():
+            return False
 
-        while not self.stop_event.is_set():
-            if first_run and self.delay:
-                sleep(self.delay / 1000.0)
-            first_run = False
+        polled_call = self.polled_call_ref()
+        if polled_call is None:
+            return False
 
+        try:
+            res = polled_call(*self.args)
+        except Exception as e:
             if self.stop_event.is_set():
-                break
+                return False
+            if self.error_callback_ref() is not None:
+                self.queue.put(PollingException(e, self.get_id()))
+                self.async_watcher.send()
+            return False
 
-            polled_call = self.polled_call_ref()
-            if polled_call is None:
-                break
+        del polled_call
 
-            try:
-                res = polled_call(*self.args)
-            except Exception as e:
-                if self.stop_event.is_set():
-                    break
-                error_cb = self.error_callback_ref()
-                if error_cb is not None:
-                    self.queue.put(PollingException(e, self.get_id()))
-                break
-
-            del polled_call
-
-            if self.stop_event.is_set():
-                break
+        if self.stop_event.is_set():
+            return False
 
-            if isinstance(res, numpy.ndarray):  # for arrays
-                comparison = res == self.old_res
-                if isinstance(comparison, bool):
-                    is_equal = comparison
-                else:
-                    is_equal = all(comparison)
+        if isinstance(res, numpy.ndarray):  # for arrays
+            comparison = res == self.old_res
+            if isinstance(comparison, bool):
+                is_equal = comparison
             else:
-                is_equal = res == self.old_res
-
-            if self.compare and is_equal:
-                # do nothing: previous value is the same as "new" value
-                pass
-            else:
-                new_value = True
-                if self.compare:
-                    new_value = not is_equal
-
-                if new_value:
-                    self.old_res = res
-                    self.queue.put(res)
-                    self.async_watcher.send()
-
-            sleep(self.polling_period / 1000.0)
-
-        if error_cb is not None:
-            self.async_watcher.send()
+                is_equal = all(comparison)
+        else:
+            is_equal = res == self.old_res
+
+        if self.compare and is_equal:
+            # do nothing: previous value is the same as "new" value
+            pass
+        else:
+            new_value = True
+            if self.compare:
+                new_value = not is_equal
+
+            if new_value:
+                self.old_res = res
+                self.queue.put(res)
+                self.async_watcher.send()
+
+        return True
@@ -32,5 +32,107 @@ if not hasattr(robustapply, "_robust_apply"):
         robustapply.robust_apply = __my_robust_apply
     else:
         robustapply.robustApply = __my_robust_apply
-    del louie
     del __my_robust_apply
+
+
+if not louie and not hasattr(dispatcher, "_send"):
+    # cache the receivers of each (signal, sender) pair, with the named
+    # arguments they accept, so that 'dispatcher.send' does not walk the
+    # connections tables and introspect each receiver on every call ;
+    # the cache is cleared on connect and disconnect
+    import weakref
+
+    dispatcher._send = dispatcher.send
+    dispatcher._connect = dispatcher.connect
+    dispatcher._disconnect = dispatcher.disconnect
+
+    _receivers_cache = {}
+
+    def _accepted_names(receiver, nb_args):
+        """Return the names among 'signal' and 'sender' accepted by receiver
+        when called with nb_args positional arguments, or None if the call
+        has to go through robust_apply.
+        """
+        try:
+            _, code, start_index = robustapply.function(receiver)
+        except Exception:
+            return None
+        positional = code.co_varnames[start_index : start_index + nb_args]
+        if "signal" in positional or "sender" in positional:
+            return None
+        if code.co_flags & 8:
+            # **kwargs
+            return ("signal", "sender")
+        acceptable = code.co_varnames[start_index + nb_args : code.co_argcount]
+        return tuple(name for name in ("signal", "sender") if name in acceptable)
+
+    def _cache_receivers(signal, sender, nb_args):
+        key = (signal, id(sender), nb_args)
+        try:
+            sender_ref = weakref.ref(
+                sender, lambda ref, key=key: _receivers_cache.pop(key, None)
+            )
+        except TypeError:
+            sender_ref = lambda: sender  # noqa: E731
+
+        receivers = []
+        for receiver_ref in dispatcher.getAllReceivers(sender, signal):
+            receiver = receiver_ref
+            if isinstance(receiver_ref, dispatcher.WEAKREF_TYPES):
+                receiver = receiver_ref()
+                if receiver is None:
+                    continue
+            else:
+                receiver_ref = lambda receiver=receiver: receiver  # noqa: E731
+            receivers.append((receiver_ref, _accepted_names(receiver, nb_args)))
+            del receiver
+
+        entry = _receivers_cache[key] = (sender_ref, receivers)
+        return entry
+
+    def __cached_send(
+        signal=dispatcher.Any, sender=dispatcher.Anonymous, *args, **named
+    ):
+        if named:
+            return dispatcher._send(signal, sender, *args, **named)
+
+        entry = _receivers_cache.get((signal, id(sender), len(args)))
+        if entry is None or entry[0]() is not sender:
+            entry = _cache_receivers(signal, sender, len(args))
+
+        responses = []
+        for receiver_ref, accepted_names in entry[1]:
+            receiver = receiver_ref()
+            if receiver is None:
+                continue
+            if accepted_names is None:
+                response = robustapply.robustApply(
+                    receiver, signal=signal, sender=sender, *args
+                )
+            else:
+                kwargs = {}
+                if accepted_names:
+                    values = {"signal": signal, "sender": sender}
+                    kwargs = {name: values[name] for name in accepted_names}
+                try:
+                    response = receiver(*args, **kwargs)
+                except Exception:
+                    sys.excepthook(*sys.exc_info())
+                    response = None
+            responses.append((receiver, response))
+        return responses
+
+    def __connect(*args, **kwargs):
+        _receivers_cache.clear()
+        return dispatcher._connect(*args, **kwargs)
+
+    def __disconnect(*args, **kwargs):
+        _receivers_cache.clear()
+        return dispatcher._disconnect(*args, **kwargs)
+
+    dispatcher.send = __cached_send
+    dispatcher.connect = __connect
+    dispatcher.disconnect = __disconnect
+    del __cached_send, __connect, __disconnect
+
+del louie
@@ -0,0 +1,287 @@
+#
+#  Project: MXCuBE
+#  https://github.com/mxcube
+#
+#  This file is part of MXCuBE software.
+#
+#  MXCuBE is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  MXCuBE is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with MXCuBE. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental change feed of a queue model.
+
+The feed keeps the JSON state of the nodes of a model, and records the
+changes of the model as patches, each with a version number incremented
+by one. Clients get a full snapshot once, and then only the patches since
+the version they have:
+
+    {"version": 7, "op": "add", "id": 4, "parent": 2, "index": 0,
+     "node": {"id": 4, "parent": 2, "type": "DataCollection", "name": ...,
+              "status": {...}, "params": {...}}}
+    {"version": 8, "op": "remove", "id": 4}
+    {"version": 9, "op": "status", "id": 4, "status": {"running": True}}
+    {"version": 10, "op": "params", "id": 4, "params": {"exp_time": 0.1}}
+    {"version": 11, "op": "reset"}
+
+Status and params patches hold the changed values only, a params patch
+also holds the new name of the node when it changed. After a reset the
+clients need a new snapshot.
+"""
+
+import collections
+import itertools
+
+__copyright__ = """ Copyright © 2010 - 2024 by MXCuBE Collaboration """
+__license__ = "LGPLv3+"
+
+
+_PRIMITIVE_TYPES = (str, bool, int, float, type(None))
+
+
+def to_json_value(value):
+    """
+    :returns: <value> with the values that are not JSON types converted to
+              str, numpy scalars for instance
+    """
+    if isinstance(value, _PRIMITIVE_TYPES):
+        if type(value) in _PRIMITIVE_TYPES:
+            return value
+        for primitive_type in _PRIMITIVE_TYPES:
+            if isinstance(value, primitive_type):
+                return primitive_type(value)
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): to_json_value(item) for key, item in value.items()}
+    return str(value)
+
+
+def get_node_status(node):
+    """
+    :returns: The status of the node <node>
+    :rtype: dict
+    """
+    return {
+        "enabled": bool(node.is_enabled()),
+        "executed": bool(node.is_executed()),
+        "running": bool(node.is_running()),
+    }
+
+
+def get_node_params(node):
+    """
+    :returns: The parameters of the node <node>, as_dict() if the node has
+              it and the public attributes otherwise
+    :rtype: dict
+    """
+    as_dict = getattr(node, "as_dict", None)
+    if as_dict is not None:
+        try:
+            params = as_dict()
+        except Exception:
+            params = {}
+    else:
+        params = {
+            name: value
+            for name, value in getattr(node, "__dict__", {}).items()
+            if name[0] != "_"
+        }
+    return to_json_value(params)
+
+
+def _changed_values(old, new):
+    return {key: value for key, value in new.items() if old.get(key) != value}
+
+
+class QueueChangeFeed(object):
+    """
+    Change feed of a queue model, keeping the <size> last patches.
+    """
+
+    def __init__(self, size=10000):
+        self._version = 0
+        # version of the last reset, older versions need a snapshot
+        self._reset_version = 0
+        self._patches = collections.deque(maxlen=size)
+        # state of the nodes by node id
+        self._nodes = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Calls <callback> with each recorded patch.
+
+        :param callback: Callable taking a patch.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def get_version(self):
+        """
+        :returns: The version of the last patch
+        :rtype: int
+        """
+        return self._version
+
+    def _record(self, patch):
+        self._version += 1
+        patch["version"] = self._version
+        self._patches.append(patch)
+        for callback in self._listeners:
+            callback(patch)
+
+    def _make_node_state(self, node):
+        parent = node.get_parent()
+        return {
+            "id": node._node_id,
+            "parent": None if parent is None else parent._node_id,
+            "type": node.__class__.__name__,
+            "name": str(node.get_display_name()),
+            "status": get_node_status(node),
+            "params": get_node_params(node),
+        }
+
+    def node_added(self, node):
+        """
+        Records the addition of <node> and its descendants.
+
+        :param node: The added node.
+        :type node: TaskNode
+        """
+        state = self._make_node_state(node)
+        self._nodes[node._node_id] = state
+        parent = node.get_parent()
+        self._record(
+            {
+                "op": "add",
+                "id": node._node_id,
+                "parent": state["parent"],
+                "index": parent._children.index(node) if parent is not None else 0,
+                "node": state,
+            }
+        )
+        for child in node.get_children():
+            self.node_added(child)
+
+    def node_removed(self, node):
+        """
+        Records the removal of <node> and its descendants.
+
+        :param node: The removed node.
+        :type node: TaskNode
+        """
+        if self._forget(node):
+            self._record({"op": "remove", "id": node._node_id})
+
+    def _forget(self, node):
+        known = self._nodes.pop(node._node_id, None) is not None
+        for child in node.get_children():
+            self._forget(child)
+        return known
+
+    def node_changed(self, node, status=None):
+        """
+        Records the changes of the status, name and parameters of <node>
+        since they were last recorded.
+
+        :param node: The node.
+        :type node: TaskNode
+        :param status: Execution status of the queue entry of the node,
+                       for instance "RUNNING" or "FAILED".
+        :type status: str
+        """
+        state = self._nodes.get(node._node_id)
+        if state is None:
+            return
+
+        new_state = self._make_node_state(node)
+        if status is None:
+            status = state["status"].get("state")
+        if status is not None:
+            new_state["status"]["state"] = status
+
+        changed_status = _changed_values(state["status"], new_state["status"])
+        if changed_status:
+            self._record(
+                {"op": "status", "id": node._node_id, "status": changed_status}
+            )
+
+        changed_params = _changed_values(state["params"], new_state["params"])
+        if changed_params or state["name"] != new_state["name"]:
+            patch = {"op": "params", "id": node._node_id, "params": changed_params}
+            if state["name"] != new_state["name"]:
+                patch["name"] = new_state["name"]
+            self._record(patch)
+
+        self._nodes[node._node_id] = new_state
+
+    def refresh(self, root):
+        """
+        Records the changes of all the nodes of <root>, for changes made
+        without notifying the feed.
+
+        :param root: The root of the model.
+        :type root: RootNode
+        """
+        for child in root.get_children():
+            self.node_changed(child)
+            self.refresh(child)
+
+    def reset(self, root):
+        """
+        Restarts the feed with the nodes of <root>, the clients need a new
+        snapshot.
+
+        :param root: The root of the model.
+        :type root: RootNode
+        """
+        self._patches.clear()
+        self._nodes = {}
+        self._record({"op": "reset"})
+        self._reset_version = self._version
+        self._add_states(root)
+
+    def _add_states(self, node):
+        for child in node.get_children():
+            self._nodes[child._node_id] = self._make_node_state(child)
+            self._add_states(child)
+
+    def get_snapshot(self):
+        """
+        :returns: The version and the state of all the nodes, parents
+                  before their children
+        :rtype: dict
+        """
+        return {"version": self._version, "nodes": list(self._nodes.values())}
+
+    def get_changes(self, since):
+        """
+        :param since: Version the client has.
+        :type since: int
+
+        :returns: The patches since the version <since>, oldest first,
+                  None if they are no longer available and the client needs
+                  a new snapshot.
+        :rtype: list
+        """
+        if since < self._reset_version or since > self._version:
+            return None
+        if since == self._version:
+            return []
+
+        first_version = self._patches[0]["version"] if self._patches else 0
+        if since + 1 < first_version:
+            return None
+        return list(itertools.islice(self._patches, since + 1 - first_version, None))
@@ -23,9 +23,15 @@ This module contain objects that combined make up the data model.
 Any object that inherhits from TaskNode can be added to and handled by
 the QueueModel.
 """
+
+import bisect
 import copy
 import logging
 import os
+import re
+from collections.abc import Sequence
+
+import numpy
 
 from mxcubecore.model import queue_model_enumerables
 
@@ -50,13 +56,128 @@ from mxcubecore import HardwareRepository as HWR
 __copyright__ = """ Copyright © 2010 - 2020 by MXCuBE Collaboration """
 __license__ = "LGPLv3+"
 
+# Attribute values shared by clones, instead of copied
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, range)
+
+
+def _slot_names(cls):
+    """
+    :returns: The names of the slots of <cls> and of its base classes
+    :rtype: tuple
+    """
+    names = cls.__dict__.get("_slot_names_cache")
+    if names is None:
+        names = []
+        for klass in reversed(cls.__mro__):
+            for name in klass.__dict__.get("__slots__", ()):
+                if name not in ("__dict__", "__weakref__") and name not in names:
+                    names.append(name)
+        names = tuple(names)
+        cls._slot_names_cache = names
+    return names
+
+
+def _clone_value(value, memo):
+    if type(value) in _IMMUTABLE_TYPES:
+        return value
+    if type(value) is tuple and all(type(item) in _IMMUTABLE_TYPES for item in value):
+        return value
+    return copy.deepcopy(value, memo)
+
+
+def _clone(obj, memo=None):
+    """
+    Copies <obj> attribute by attribute, sharing the immutable values,
+    which is equivalent to, but much faster than, copy.deepcopy for the
+    slotted model objects.
+
+    :param obj: Object to copy
+    :param memo: copy.deepcopy memo dictionary
+
+    :returns: The copy
+    """
+    if memo is None:
+        memo = {}
+
+    cls = type(obj)
+    new_obj = cls.__new__(cls)
+    memo[id(obj)] = new_obj
 
-class TaskNode(object):
+    # object.__setattr__ bypasses the PathTemplate index notifications,
+    # the copy is not part of any index yet
+    set_attribute = object.__setattr__
+    for name in _slot_names(cls):
+        try:
+            value = getattr(obj, name)
+        except AttributeError:
+            continue
+        if type(value) not in _IMMUTABLE_TYPES:
+            value = _clone_value(value, memo)
+        set_attribute(new_obj, name, value)
+
+    obj_dict = getattr(obj, "__dict__", None)
+    if obj_dict:
+        new_dict = new_obj.__dict__
+        for name, value in obj_dict.items():
+            if type(value) not in _IMMUTABLE_TYPES:
+                value = _clone_value(value, memo)
+            new_dict[name] = value
+
+    return new_obj
+
+
+class _SlottedObject(object):
+    """
+    Base class of the model objects with __slots__. The state, used by
+    pickle, copy and jsonpickle, is the dictionary of all attributes, as
+    for objects without __slots__.
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))
+        for name in _slot_names(type(self)):
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        # sets the slots, and __dict__ for the other attributes
+        set_attribute = object.__setattr__
+        for name, value in state.items():
+            set_attribute(self, name, value)
+
+    def __deepcopy__(self, memo):
+        return _clone(self, memo)
+
+
+class TaskNode(_SlottedObject):
     """
     Objects that inherit TaskNode can be added to and handled by
     the QueueModel object.
     """
 
+    # Other attributes, of sub classes for instance, are kept in __dict__
+    __slots__ = (
+        "_children",
+        "_name",
+        "_number",
+        "_executed",
+        "_running",
+        "_parent",
+        "_names",
+        "_enabled",
+        "_node_id",
+        "_requires_centring",
+        "_origin",
+        "_task_data",
+        "__dict__",
+        "__weakref__",
+    )
+
     def __init__(self, task_data=None):
         self._children = []
         self._name = str()
@@ -272,6 +393,10 @@ class RootNode(TaskNode):
         TaskNode.__init__(self)
         self._name = "root"
         self._total_node_count = 0
+        # Nodes of the model by node id, and path templates of the
+        # model, maintained by QueueModel
+        self._nodes_by_id = {}
+        self._path_templates = PathTemplateIndex()
 
 
 class TaskGroup(TaskNode):
@@ -574,6 +699,28 @@ class Basket(TaskNode):
 
 
 class DataCollection(TaskNode):
+    __slots__ = (
+        "acquisitions",
+        "crystal",
+        "processing_parameters",
+        "previous_acquisition",
+        "experiment_type",
+        "html_report",
+        "id",
+        "lims_group_id",
+        "run_offline_processing",
+        "run_online_processing",
+        "grid",
+        "grid_id",
+        "shape",
+        "online_processing_results",
+        "processing_msg_list",
+        "workflow_id",
+        "center_before_collect",
+        "ispyb_group_data_collections",
+        "workflow_parameters",
+    )
+
     def __init__(
         self,
         acquisition_list=None,
@@ -1438,13 +1585,18 @@ class OpticalCentring(TaskNode):
         return self._name
 
 
-class Acquisition(object):
+class Acquisition(_SlottedObject):
+    __slots__ = ("path_template", "acquisition_parameters", "__dict__", "__weakref__")
+
     def __init__(self):
         object.__init__(self)
 
         self.path_template = PathTemplate()
         self.acquisition_parameters = AcquisitionParameters()
 
+    def copy(self):
+        return _clone(self)
+
     def get_preview_image_paths(self):
         """Returns the full paths, including the filename, to preview/thumbnail
         images stored in the archive directory.
@@ -1468,7 +1620,49 @@ class Acquisition(object):
         return paths
 
 
-class PathTemplate(object):
+# PathTemplate attributes used by PathTemplateIndex
+PATH_TEMPLATE_INDEXED_ATTRIBUTES = frozenset(
+    (
+        "directory",
+        "base_prefix",
+        "mad_prefix",
+        "reference_image_prefix",
+        "wedge_prefix",
+        "run_number",
+        "start_num",
+        "num_files",
+    )
+)
+
+
+class PathTemplate(_SlottedObject):
+    # precision is not a slot, it can be set for all templates with
+    # set_precision
+    __slots__ = (
+        "directory",
+        "process_directory",
+        "xds_dir",
+        "base_prefix",
+        "mad_prefix",
+        "reference_image_prefix",
+        "wedge_prefix",
+        "run_number",
+        "suffix",
+        "start_num",
+        "num_files",
+        "compression",
+        "__dict__",
+        "__weakref__",
+    )
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+
+        if name in PATH_TEMPLATE_INDEXED_ATTRIBUTES:
+            index = PathTemplateIndex.indexes.get(id(self))
+            if index is not None:
+                index.update(self)
+
     @staticmethod
     def set_data_base_path(base_directory):
         # os.path.abspath returns path without trailing slash, if any
@@ -1510,18 +1704,24 @@ class PathTemplate(object):
     def __init__(self):
         object.__init__(self)
 
-        self.directory = str()
-        self.process_directory = str()
-        self.xds_dir = str()
-        self.base_prefix = str()
-        self.mad_prefix = str()
-        self.reference_image_prefix = str()
-        self.wedge_prefix = str()
-        self.run_number = int()
-        self.suffix = "h5"
-        self.start_num = int()
-        self.num_files = int()
-        self.compression = False
+        # A new template is not indexed, __setstate__ sets the attributes
+        # without going through __setattr__
+        self.__setstate__(
+            {
+                "directory": str(),
+                "process_directory": str(),
+                "xds_dir": str(),
+                "base_prefix": str(),
+                "mad_prefix": str(),
+                "reference_image_prefix": str(),
+                "wedge_prefix": str(),
+                "run_number": int(),
+                "suffix": "h5",
+                "start_num": int(),
+                "num_files": int(),
+                "compression": False,
+            }
+        )
 
         if not hasattr(self, "precision"):
             self.precision = str()
@@ -1646,51 +1846,378 @@ class PathTemplate(object):
 
         return result
 
-    def intersection(self, rh_pt):
-        result = False
+    def get_image_range(self):
+        """
+        :returns: The image numbers of the template
+        :rtype: range
+        """
+        return range(self.start_num, self.start_num + self.num_files)
 
+    def intersection(self, rh_pt):
         # Only do the intersection if there is possibilty for
         # Collision, that is directories are the same.
         if (self == rh_pt) and (self.run_number == rh_pt.run_number):
-            if self.start_num < (
-                rh_pt.start_num + rh_pt.num_files
-            ) and rh_pt.start_num < (self.start_num + self.num_files):
-                result = True
+            lh_range = self.get_image_range()
+            rh_range = rh_pt.get_image_range()
+            return lh_range.start < rh_range.stop and rh_range.start < lh_range.stop
 
-        return result
+        return False
 
     def get_files_to_be_written(self):
-        file_locations = []
-        file_name_template = self.get_image_file_name()
+        """
+        :returns: The paths of the image files
+        :rtype: list
+        """
+        return list(self.get_file_sequence())
 
-        for i in range(self.start_num, self.start_num + self.num_files):
-            file_locations.append(os.path.join(self.directory, file_name_template % i))
+    def get_file_sequence(self):
+        """
+        Same paths as get_files_to_be_written, without building the list.
 
-        return file_locations
+        :returns: The paths of the image files, computed when accessed
+        :rtype: ImageFileSequence
+        """
+        return ImageFileSequence(
+            self.directory, self.get_image_file_name(), self.get_image_range()
+        )
 
     def get_first_and_last_file(self):
         return HWR.beamline.detector.get_first_and_last_file(self)
 
     def is_part_of(self, path_template):
-        result = False
-
         if self == path_template and self.run_number == path_template.run_number:
-            if (
-                path_template.start_num >= self.start_num
-                and path_template.num_files + path_template.start_num
-                <= self.num_files + self.start_num
-            ):
-                result = True
-        else:
-            result = False
+            lh_range = self.get_image_range()
+            rh_range = path_template.get_image_range()
+            return lh_range.start <= rh_range.start and rh_range.stop <= lh_range.stop
 
-        return result
+        return False
 
     def copy(self):
-        return copy.deepcopy(self)
+        return _clone(self)
+
+
+class ImageFileSequence(Sequence):
+    """
+    Read-only sequence of the image file paths of a data collection.
+
+    The paths are formatted when accessed, from the directory, the file name
+    template and the image numbers, so that the length, membership and
+    indexing do not depend on the number of images.
+    """
+
+    _NUMBER_FORMAT = re.compile(r"%0?(\d*)d")
+
+    def __init__(self, directory, file_name_template, image_range):
+        self.directory = directory
+        self.file_name_template = file_name_template
+        self.image_range = image_range
+
+    def get_file_name(self, image_number):
+        return self.file_name_template % image_number
+
+    def __len__(self):
+        return len(self.image_range)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ImageFileSequence(
+                self.directory, self.file_name_template, self.image_range[index]
+            )
+        return os.path.join(self.directory, self.get_file_name(self.image_range[index]))
+
+    def __iter__(self):
+        for image_number in self.image_range:
+            yield os.path.join(self.directory, self.get_file_name(image_number))
+
+    def __contains__(self, path):
+        return self.get_image_number(path) is not None
+
+    def index(self, path, start=0, stop=None):
+        image_number = self.get_image_number(path)
+        if image_number is not None:
+            index = self.image_range.index(image_number)
+            if start <= index and (stop is None or index < stop):
+                return index
+        raise ValueError("%r is not in the sequence" % (path,))
+
+    def count(self, path):
+        return int(path in self)
+
+    def get_image_number(self, path):
+        """
+        :param path: Image file path.
+        :type path: str
+
+        :returns: The image number of <path>, None if <path> is not
+                  in the sequence
+        :rtype: int
+        """
+        if not isinstance(path, str):
+            return None
+
+        directory, file_name = os.path.split(path)
+        if os.path.normpath(directory) != os.path.normpath(self.directory):
+            return None
+
+        match = self._NUMBER_FORMAT.search(self.file_name_template)
+        if match is None:
+            # no image number in the names, all images have the same name
+            if self.image_range and file_name == self.file_name_template:
+                return self.image_range[0]
+            return None
+
+        head = self.file_name_template[: match.start()]
+        tail = self.file_name_template[match.end() :]
+        digits = file_name[len(head) : len(file_name) - len(tail)]
+        if (
+            len(file_name) < len(head) + len(tail)
+            or not file_name.startswith(head)
+            or not file_name.endswith(tail)
+            or not digits.isdigit()
+        ):
+            return None
+
+        image_number = int(digits)
+        if image_number in self.image_range:
+            if self.get_file_name(image_number) == file_name:
+                return image_number
+        return None
+
+    def __eq__(self, other):
+        if isinstance(other, ImageFileSequence):
+            return (
+                os.path.normpath(self.directory) == os.path.normpath(other.directory)
+                and self.file_name_template == other.file_name_template
+                and self.image_range == other.image_range
+            )
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(
+                lh == rh for lh, rh in zip(self, other)
+            )
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "ImageFileSequence(%r, %r, %r)" % (
+            self.directory,
+            self.file_name_template,
+            self.image_range,
+        )
+
+
+class PathTemplateIndex(object):
+    """
+    Index of the path templates of a model by (directory, prefix), giving
+    the next run number and the path collisions without comparing with
+    every path template of the model.
+
+    Indexed path templates update the index when their directory, prefix,
+    run number or frame range change.
+    """
 
+    # Index of each indexed path template, by id of the path template
+    indexes = {}
+
+    def __init__(self):
+        # id(path_template) -> [path_template, count, indexed values]
+        self._entries = {}
+        # id(node) -> (node, path_template)
+        self._owners = {}
+        # (directory, prefix) -> sorted run numbers
+        self._run_numbers = {}
+        # (directory, prefix, run number) -> sorted (start, end, id(path_template))
+        self._frame_ranges = {}
+
+    def __getstate__(self):
+        # Copies are empty, see QueueModel.__setstate__
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @staticmethod
+    def _key(path_template):
+        return (os.path.normpath(path_template.directory), path_template.get_prefix())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, node, path_template):
+        """
+        Adds the path template <path_template> of <node> to the index.
+
+        :param node: The node of the path template.
+        :type node: TaskNode
+
+        :param path_template: The path template to add.
+        :type path_template: PathTemplate
+        """
+        self.remove(node)
+        self._owners[id(node)] = (node, path_template)
+        entry = self._entries.get(id(path_template))
+
+        if entry:
+            entry[1] += 1
+        else:
+            self._entries[id(path_template)] = [path_template, 1, None]
+            PathTemplateIndex.indexes[id(path_template)] = self
+            self._insert(path_template)
+
+    def remove(self, node):
+        """
+        Removes the path template of <node> from the index.
+
+        :param node: The node of the path template.
+        :type node: TaskNode
+        """
+        owner = self._owners.pop(id(node), None)
+        if owner is None:
+            return
+
+        path_template = owner[1]
+        entry = self._entries.get(id(path_template))
+
+        if entry:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._delete(path_template)
+                del self._entries[id(path_template)]
+                if PathTemplateIndex.indexes.get(id(path_template)) is self:
+                    del PathTemplateIndex.indexes[id(path_template)]
+
+    def clear(self):
+        """
+        Removes all the path templates from the index.
+        """
+        for node, _ in list(self._owners.values()):
+            self.remove(node)
+
+    def update(self, path_template):
+        """
+        Updates the index after a change of <path_template>.
+
+        :param path_template: The changed path template.
+        :type path_template: PathTemplate
+        """
+        if id(path_template) in self._entries:
+            self._delete(path_template)
+            self._insert(path_template)
+
+    def _insert(self, path_template):
+        key = self._key(path_template)
+        run_number = path_template.run_number
+        start = path_template.start_num
+        frame_range = (start, start + path_template.num_files, id(path_template))
+
+        bisect.insort(self._run_numbers.setdefault(key, []), run_number)
+        bisect.insort(
+            self._frame_ranges.setdefault(key + (run_number,), []), frame_range
+        )
+        self._entries[id(path_template)][2] = (key, run_number, frame_range)
+
+    def _delete(self, path_template):
+        key, run_number, frame_range = self._entries[id(path_template)][2]
+
+        run_numbers = self._run_numbers[key]
+        del run_numbers[bisect.bisect_left(run_numbers, run_number)]
+        if not run_numbers:
+            del self._run_numbers[key]
+
+        frame_ranges = self._frame_ranges[key + (run_number,)]
+        del frame_ranges[bisect.bisect_left(frame_ranges, frame_range)]
+        if not frame_ranges:
+            del self._frame_ranges[key + (run_number,)]
+
+    def get_next_run_number(self, path_template, exclude_current=True):
+        """
+        :returns: The next run number for the directory and prefix of
+                  <path_template>
+        :rtype: int
+        """
+        key = self._key(path_template)
+        run_numbers = self._run_numbers.get(key, [])
+        last = len(run_numbers) - 1
+
+        entry = self._entries.get(id(path_template))
+        if exclude_current and entry and last >= 0:
+            # skip the run number of the path template itself
+            if entry[2][0] == key and run_numbers[last] == entry[2][1]:
+                last -= 1
+
+        return max(run_numbers[last] if last >= 0 else 0, 0) + 1
+
+    def has_collision(self, path_template):
+        """
+        :returns: True if another path template of the index writes
+                  files that <path_template> writes.
+        :rtype: bool
+        """
+        key = self._key(path_template) + (path_template.run_number,)
+        frame_ranges = self._frame_ranges.get(key, [])
+        start = path_template.start_num
+        end = start + path_template.num_files
+
+        # check the frame ranges starting before the end of path_template
+        index = bisect.bisect_left(frame_ranges, (end,))
+        while index > 0:
+            index -= 1
+            other_start, other_end, other_id = frame_ranges[index]
+            if other_id != id(path_template) and start < other_end:
+                return True
+
+        return False
+
+
+class AcquisitionParameters(_SlottedObject):
+    __slots__ = (
+        "first_image",
+        "num_images",
+        "osc_start",
+        "osc_range",
+        "osc_total_range",
+        "overlap",
+        "kappa",
+        "kappa_phi",
+        "exp_time",
+        "num_passes",
+        "num_lines",
+        "energy",
+        "centred_position",
+        "resolution",
+        "detector_distance",
+        "transmission",
+        "inverse_beam",
+        "shutterless",
+        "take_snapshots",
+        "take_video",
+        "take_dark_current",
+        "skip_existing_images",
+        "detector_binning_mode",
+        "detector_roi_mode",
+        "induce_burn",
+        "mesh_range",
+        "cell_counting",
+        "mesh_center",
+        "cell_spacing",
+        "mesh_snapshot",
+        "comments",
+        "in_queue",
+        "in_interleave",
+        "sub_wedge_size",
+        "num_triggers",
+        "num_images_per_trigger",
+        "hare_num",
+        "__dict__",
+        "__weakref__",
+    )
 
-class AcquisitionParameters(object):
     def __init__(self):
         object.__init__(self)
 
@@ -1782,7 +2309,7 @@ class AcquisitionParameters(object):
         }
 
     def copy(self):
-        return copy.deepcopy(self)
+        return _clone(self)
 
 
 class XrayImagingParameters(object):
@@ -1850,7 +2377,7 @@ class Crystal(object):
                 setattr(self, dict_item[0], dict_item[1])
 
 
-class CentredPosition(object):
+class CentredPosition(_SlottedObject):
     """
     Class that represents a centred position.
     Can also be initialized with a mxcube motor dict
@@ -1861,6 +2388,16 @@ class CentredPosition(object):
     MOTOR_POS_DELTA = 1e-4
     DIFFRACTOMETER_MOTOR_NAMES = []
 
+    # The motor positions are kept in __dict__
+    __slots__ = (
+        "snapshot_image",
+        "centring_method",
+        "index",
+        "motor_pos_delta",
+        "__dict__",
+        "__weakref__",
+    )
+
     @staticmethod
     def set_diffractometer_motor_names(*names):
         CentredPosition.DIFFRACTOMETER_MOTOR_NAMES = names[:]
@@ -1924,6 +2461,9 @@ class CentredPosition(object):
     def __ne__(self, cpos):
         return not (self == cpos)
 
+    def copy(self):
+        return _clone(self)
+
     def set_index(self, index):
         self.index = index
 
@@ -2734,14 +3274,14 @@ def create_subwedges(total_num_images, sw_size, osc_range, osc_start):
     :returns: List of tuples with the format:
               (start image number, number of images, oscilation start)
     """
-    number_of_subwedges = total_num_images / sw_size
-    subwedges = []
+    sw_num = numpy.arange(int(total_num_images // sw_size))
+    first_images = sw_num * sw_size + 1
+    osc_starts = osc_start + (osc_range * sw_size * sw_num)
 
-    for sw_num in range(0, number_of_subwedges):
-        _osc_start = osc_start + (osc_range * sw_size * sw_num)
-        subwedges.append((sw_num * sw_size + 1, sw_size, _osc_start))
-
-    return subwedges
+    return [
+        (first_image, sw_size, _osc_start)
+        for first_image, _osc_start in zip(first_images.tolist(), osc_starts.tolist())
+    ]
 
 
 def create_inverse_beam_sw(num_images, sw_size, osc_range, osc_start, run_number):
@@ -2783,6 +3323,75 @@ def create_inverse_beam_sw(num_images, sw_size, osc_range, osc_start, run_number
     return subwedges
 
 
+class SubwedgePlan(Sequence):
+    """
+    Read-only sequence of the subwedges of an interleaved collection, see
+    create_interleave_sw.
+
+    The subwedge parameters are computed at once in arrays, and the
+    subwedge dictionaries are created when accessed, so that plans with
+    thousands of subwedges are built quickly.
+    """
+
+    def __init__(self, collections, num_images, sw_size):
+        """
+        :param collections: (first image, number of images, osc start,
+                            osc range) of the interleaved collections.
+        :type collections: list of tuple
+        :param num_images: Number of images of the first collection.
+        :type num_images: int
+        :param sw_size: Number of images in each subwedge.
+        :type sw_size: int
+        """
+        collections = numpy.array(collections, dtype=float).reshape(-1, 4)
+        first_image = collections[:, 0].astype(int)
+        collect_num_images = collections[:, 1].astype(int)
+        osc_start = collections[:, 2]
+        osc_range = collections[:, 3]
+
+        # subwedges by row, collections by column
+        sw_index = numpy.arange(int(num_images / sw_size))[:, numpy.newaxis]
+        included = sw_index * sw_size <= collect_num_images
+        remaining = collect_num_images - (sw_index + 1) * sw_size
+        actual_size = numpy.where(
+            (remaining > 0) & (remaining < sw_size),
+            collect_num_images % sw_size,
+            sw_size,
+        )
+        shape = included.shape
+
+        self.sw_size = sw_size
+        self.collect_first_image = first_image
+        self.collect_num_images = collect_num_images
+        self.collect_index = numpy.broadcast_to(numpy.arange(len(first_image)), shape)[
+            included
+        ]
+        self.sw_index = numpy.broadcast_to(sw_index, shape)[included]
+        self.sw_first_image = (first_image + sw_index * sw_size)[included]
+        self.sw_actual_size = actual_size[included]
+        self.sw_osc_start = (osc_start + osc_range * sw_index * sw_size)[included]
+        self.sw_osc_range = (osc_range * actual_size)[included]
+
+    def __len__(self):
+        return len(self.sw_index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        collect_index = int(self.collect_index[index])
+        return {
+            "collect_index": collect_index,
+            "collect_first_image": int(self.collect_first_image[collect_index]),
+            "collect_num_images": int(self.collect_num_images[collect_index]),
+            "sw_index": int(self.sw_index[index]),
+            "sw_first_image": int(self.sw_first_image[index]),
+            "sw_actual_size": int(self.sw_actual_size[index]),
+            "sw_osc_start": float(self.sw_osc_start[index]),
+            "sw_osc_range": float(self.sw_osc_range[index]),
+        }
+
+
 def create_interleave_sw(interleave_list, num_images, sw_size):
     """
     Creates subwedges for interleved collection.
@@ -2802,59 +3411,24 @@ def create_interleave_sw(interleave_list, num_images, sw_size):
     :param sw_size: Number of images in each subwedge
     :type sw_size: int
 
-    :returns: A list of tuples containing the swb wedges.
-              The tuples are in the form:
-              (collection_index, subwedge_index, subwedge_firt_image,
-               subwedge_start_osc)
-    :rtype: List [(...), (...)]
+    :returns: A sequence of dictionaries describing the subwedges, with the
+              keys collect_index, collect_first_image, collect_num_images,
+              sw_index, sw_first_image, sw_actual_size, sw_osc_start and
+              sw_osc_range
+    :rtype: SubwedgePlan
     """
-    subwedges = []
-    sw_first_image = None
-    for sw_index in range(int(num_images / sw_size)):
-        for collection_index in range(len(interleave_list)):
-            collection_osc_start = (
-                interleave_list[collection_index]["data_model"]
-                .acquisitions[0]
-                .acquisition_parameters.osc_start
-            )
-            collection_osc_range = (
-                interleave_list[collection_index]["data_model"]
-                .acquisitions[0]
-                .acquisition_parameters.osc_range
-            )
-            collection_first_image = (
-                interleave_list[collection_index]["data_model"]
-                .acquisitions[0]
-                .acquisition_parameters.first_image
+    collections = []
+    for item in interleave_list:
+        parameters = item["data_model"].acquisitions[0].acquisition_parameters
+        collections.append(
+            (
+                parameters.first_image,
+                parameters.num_images,
+                parameters.osc_start,
+                parameters.osc_range,
             )
-            collection_num_images = (
-                interleave_list[collection_index]["data_model"]
-                .acquisitions[0]
-                .acquisition_parameters.num_images
-            )
-            if sw_index * sw_size <= collection_num_images:
-                sw_actual_size = sw_size
-                if sw_size > collection_num_images - (sw_index + 1) * sw_size > 0:
-                    sw_actual_size = collection_num_images % sw_size
-                sw_first_image = collection_first_image + sw_index * sw_size
-                sw_osc_start = (
-                    collection_osc_start + collection_osc_range * sw_index * sw_size
-                )
-                sw_osc_range = collection_osc_range * sw_actual_size
-                subwedges.append(
-                    {
-                        "collect_index": collection_index,
-                        "collect_first_image": collection_first_image,
-                        "collect_num_images": collection_num_images,
-                        "sw_index": sw_index,
-                        "sw_first_image": sw_first_image,
-                        "sw_actual_size": sw_actual_size,
-                        "sw_osc_start": sw_osc_start,
-                        "sw_osc_range": sw_osc_range,
-                    }
-                )
-        sw_first_image += sw_actual_size
-    return subwedges
+        )
+    return SubwedgePlan(collections, num_images, sw_size)
 
 
 def try_parse_int(n):
@@ -0,0 +1,485 @@
+#
+#  Project: MXCuBE
+#  https://github.com/mxcube
+#
+#  This file is part of MXCuBE software.
+#
+#  MXCuBE is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  MXCuBE is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with MXCuBE. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary serialization of the queue model objects.
+
+Objects are converted to plain data (None, bool, int, float, str, bytes and
+lists), that is written with msgpack when available and with json otherwise.
+Only the classes of the schema can be created when loading, so loading
+runs no code from the data. The schema holds the queue model objects and
+their subclasses, defined in site modules for instance, and the GPhL
+messages held by the GPhL workflow nodes. Objects of other classes are
+not serializable, unless their class is added with register_class.
+
+The plain data is ["q", layouts, value], where the layouts are the lists
+[class name, attribute name, ...] of the objects, and value is either a
+primitive value or a list starting with a tag:
+
+    ["l", item, ...]                 list
+    ["t", item, ...]                 tuple
+    ["s", item, ...]                 set
+    ["d", key, value, ...]           dict
+    ["b", data]                      bytes (base64 str with json)
+    ["u", hex]                       UUID
+    ["o", ref, layout, value, ...]   object of the schema
+    ["r", ref]                       object already written
+
+TaskNode parents are not written, they are restored from the children.
+"""
+
+import base64
+import copy
+import hashlib
+import inspect
+import json
+import struct
+import uuid
+
+import numpy
+
+from mxcubecore.model import queue_model_objects
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__copyright__ = """ Copyright © 2010 - 2024 by MXCuBE Collaboration """
+__license__ = "LGPLv3+"
+
+
+MAGIC = b"MXCQ"
+FORMAT_VERSION = 1
+CODEC_JSON = b"j"
+CODEC_MSGPACK = b"m"
+
+# Attributes not written, per class
+EXCLUDED_ATTRIBUTES = {
+    queue_model_objects.TaskNode: ("_parent",),
+}
+
+_PRIMITIVE_TYPES = (str, bool, int, float, type(None))
+
+# Classes of the schema by name, see register_class
+_schema = {}
+# Classes of the schema whose subclasses are part of the schema as well
+_schema_bases = []
+# Default attribute values of the classes of the schema, by class
+_defaults = {}
+
+
+def register_class(cls, subclasses=False):
+    """
+    Adds the class <cls> to the schema, so that its objects can be written
+    and loaded. The attributes missing in loaded data are taken from an
+    object created with cls(), when the class allows it.
+
+    :param cls: The class to add.
+    :type cls: type
+    :param subclasses: True to add the subclasses of <cls> as well, also
+                       the ones defined later. Subclasses are only loaded
+                       once their module is imported.
+    :type subclasses: bool
+    """
+    _schema[_class_name(cls)] = cls
+    if subclasses and cls not in _schema_bases:
+        _schema_bases.append(cls)
+
+
+def _class_name(cls):
+    # Names of the queue model objects are kept short, as in older data
+    if cls.__module__ == queue_model_objects.__name__:
+        return cls.__name__
+    return "%s.%s" % (cls.__module__, cls.__qualname__)
+
+
+def _get_class(name):
+    """
+    :returns: The class of the schema named <name>, None if there is none
+    :rtype: type
+    """
+    cls = _schema.get(name)
+    if cls is None:
+        classes = list(_schema_bases)
+        while classes:
+            klass = classes.pop()
+            if _class_name(klass) == name:
+                register_class(klass)
+                return klass
+            classes.extend(klass.__subclasses__())
+    return cls
+
+
+def _is_schema_class(cls):
+    if _schema.get(_class_name(cls)) is cls:
+        return True
+    if issubclass(cls, tuple(_schema_bases)):
+        register_class(cls)
+        return True
+    return False
+
+
+def _register_queue_model_objects():
+    for name, cls in inspect.getmembers(queue_model_objects, inspect.isclass):
+        if cls.__module__ == queue_model_objects.__name__ and name[0] != "_":
+            if cls not in (
+                queue_model_objects.PathTemplateIndex,
+                queue_model_objects.ImageFileSequence,
+                queue_model_objects.SubwedgePlan,
+            ):
+                register_class(cls, subclasses=True)
+
+    # Values of the GPhL workflow nodes
+    from mxcubecore.HardwareObjects.Gphl import GphlMessages
+
+    register_class(GphlMessages.MessageData, subclasses=True)
+
+
+_register_queue_model_objects()
+
+
+def _attribute_names(cls):
+    slots = []
+    for klass in cls.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if name not in ("__dict__", "__weakref__"):
+                slots.append(name)
+    return slots
+
+
+def _excluded_attributes(cls):
+    result = ()
+    for klass, names in EXCLUDED_ATTRIBUTES.items():
+        if issubclass(cls, klass):
+            result += names
+    return result
+
+
+class _Encoder(object):
+    def __init__(self, binary):
+        self.binary = binary
+        self.refs = {}
+        self.layouts = {}
+
+    def encode(self, value):
+        if isinstance(value, _PRIMITIVE_TYPES):
+            if type(value) in _PRIMITIVE_TYPES:
+                return value
+            # subclasses, numpy scalars for instance
+            for primitive_type in _PRIMITIVE_TYPES:
+                if isinstance(value, primitive_type):
+                    return primitive_type(value)
+
+        if isinstance(value, list):
+            return ["l"] + [self.encode(item) for item in value]
+        if isinstance(value, tuple):
+            return ["t"] + [self.encode(item) for item in value]
+        if isinstance(value, (set, frozenset)):
+            return ["s"] + [self.encode(item) for item in value]
+        if isinstance(value, dict):
+            result = ["d"]
+            for key, item in value.items():
+                result.append(self.encode(key))
+                result.append(self.encode(item))
+            return result
+        if isinstance(value, (bytes, bytearray)):
+            if self.binary:
+                return ["b", bytes(value)]
+            return ["b", base64.b64encode(value).decode("ascii")]
+        if isinstance(value, numpy.generic):
+            return self.encode(value.item())
+        if isinstance(value, uuid.UUID):
+            return ["u", value.hex]
+
+        cls = type(value)
+        if _is_schema_class(cls):
+            return self.encode_object(value)
+
+        raise TypeError(
+            "Queue serializer: %s objects are not serializable" % cls.__name__
+        )
+
+    def encode_object(self, value):
+        ref = self.refs.get(id(value))
+        if ref is not None:
+            return ["r", ref[0]]
+
+        # keep value alive while encoding, so that its id is not reused
+        ref = len(self.refs)
+        self.refs[id(value)] = (ref, value)
+
+        cls = type(value)
+        excluded = _excluded_attributes(cls)
+        attributes = dict(getattr(value, "__dict__", {}))
+        for name in _attribute_names(cls):
+            if hasattr(value, name):
+                attributes[name] = getattr(value, name)
+        for name in excluded:
+            attributes.pop(name, None)
+
+        layout = (_class_name(cls),) + tuple(attributes)
+        layout_index = self.layouts.setdefault(layout, len(self.layouts))
+        result = ["o", ref, layout_index]
+        for item in attributes.values():
+            result.append(self.encode(item))
+        return result
+
+
+class _Decoder(object):
+    def __init__(self, layouts):
+        self.refs = {}
+        self.layouts = []
+        for layout in layouts:
+            cls = _get_class(layout[0])
+            if cls is None:
+                raise ValueError("Class %s is not part of the queue schema" % layout[0])
+            self.layouts.append((cls, layout[1:]))
+
+    def decode(self, data):
+        if not isinstance(data, list):
+            return data
+
+        tag = data[0]
+        if tag == "l":
+            return [self.decode(item) for item in data[1:]]
+        if tag == "t":
+            return tuple(self.decode(item) for item in data[1:])
+        if tag == "s":
+            return set(self.decode(item) for item in data[1:])
+        if tag == "d":
+            items = data[1:]
+            return {
+                self.decode(items[i]): self.decode(items[i + 1])
+                for i in range(0, len(items), 2)
+            }
+        if tag == "b":
+            if isinstance(data[1], str):
+                return base64.b64decode(data[1])
+            return bytes(data[1])
+        if tag == "u":
+            return uuid.UUID(hex=data[1])
+        if tag == "r":
+            return self.refs[data[1]]
+        if tag == "o":
+            return self.decode_object(data)
+
+        raise ValueError("Invalid queue data tag %r" % (tag,))
+
+    def decode_object(self, data):
+        ref = data[1]
+        cls, names = self.layouts[data[2]]
+        obj = cls.__new__(cls)
+        self.refs[ref] = obj
+
+        attributes = {}
+        for name, item in zip(names, data[3:]):
+            attributes[name] = self.decode(item)
+
+        for name, value in _get_defaults(cls).items():
+            if name not in attributes:
+                attributes[name] = copy.deepcopy(value)
+
+        slots = _attribute_names(cls)
+        for name in slots:
+            if name in attributes:
+                object.__setattr__(obj, name, attributes.pop(name))
+        if attributes:
+            # bypass __setattr__, the object is not set up yet
+            obj.__dict__.update(attributes)
+
+        if isinstance(obj, queue_model_objects.TaskNode):
+            for child in obj._children:
+                child._parent = obj
+            obj._parent = None
+
+        return obj
+
+
+def _get_defaults(cls):
+    defaults = _defaults.get(cls)
+    if defaults is None:
+        try:
+            prototype = cls()
+        except Exception:
+            defaults = {}
+        else:
+            defaults = dict(getattr(prototype, "__dict__", {}))
+            for name in _attribute_names(cls):
+                if hasattr(prototype, name):
+                    defaults[name] = getattr(prototype, name)
+            for name in _excluded_attributes(cls):
+                defaults.pop(name, None)
+        _defaults[cls] = defaults
+    return defaults
+
+
+def to_data(value, binary=True):
+    """
+    Converts <value> to plain data.
+
+    :param value: The value to convert.
+    :param binary: True to keep bytes, False to convert them to base64 str.
+    :type binary: bool
+
+    :returns: The plain data
+    :raises TypeError: If <value> holds objects that are not part of the
+                       schema.
+    """
+    encoder = _Encoder(binary)
+    data = encoder.encode(value)
+    return ["q", [list(layout) for layout in encoder.layouts], data]
+
+
+def from_data(data):
+    """
+    Converts plain data returned by to_data back to a value.
+
+    :param data: The plain data.
+
+    :returns: The value
+    """
+    if not isinstance(data, list) or len(data) != 3 or data[0] != "q":
+        raise ValueError("Invalid queue data")
+    return _Decoder(data[1]).decode(data[2])
+
+
+def dumps(value, codec=None):
+    """
+    Serializes <value>.
+
+    :param value: The value to serialize, queue model objects and
+                  containers of them.
+    :param codec: CODEC_MSGPACK or CODEC_JSON, msgpack if available
+                  by default.
+    :type codec: bytes
+
+    :returns: The serialized value
+    :rtype: bytes
+    """
+    if codec is None:
+        codec = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+
+    header = MAGIC + struct.pack("<H", FORMAT_VERSION) + codec
+    if codec == CODEC_MSGPACK:
+        return header + msgpack.packb(to_data(value, True), use_bin_type=True)
+    if codec == CODEC_JSON:
+        data = json.dumps(to_data(value, False), separators=(",", ":"))
+        return header + data.encode("utf-8")
+    raise ValueError("Unknown codec %r" % (codec,))
+
+
+def is_serialized(data):
+    """
+    :returns: True if <data> was returned by dumps
+    :rtype: bool
+    """
+    return data[: len(MAGIC)] == MAGIC
+
+
+def loads(data):
+    """
+    Loads a value serialized with dumps.
+
+    :param data: The serialized value.
+    :type data: bytes
+
+    :returns: The value
+    """
+    if not is_serialized(data):
+        raise ValueError("Not a serialized queue")
+
+    offset = len(MAGIC)
+    (version,) = struct.unpack_from("<H", data, offset)
+    if version > FORMAT_VERSION:
+        raise ValueError("Queue format version %d is not supported" % version)
+    codec = data[offset + 2 : offset + 3]
+    payload = data[offset + 3 :]
+
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is needed to load this queue")
+        return from_data(msgpack.unpackb(payload, raw=False, strict_map_key=False))
+    if codec == CODEC_JSON:
+        return from_data(json.loads(payload.decode("utf-8")))
+    raise ValueError("Unknown codec %r" % (codec,))
+
+
+class IncrementalDumper(object):
+    """
+    Serializes keyed items, keeping track of what was serialized last, so
+    that only the items marked dirty since, and the new items, need to be
+    serialized and saved again.
+    """
+
+    def __init__(self, codec=None):
+        self.codec = codec
+        self._digests = {}
+        self._dirty = set()
+
+    def mark_dirty(self, key):
+        """
+        Marks the item <key> as changed, to serialize at the next dump.
+
+        :param key: Key of the item.
+        """
+        self._dirty.add(key)
+
+    def dump(self, items):
+        """
+        Serializes the new items and the items marked dirty among <items>.
+
+        :param items: The items, by key.
+        :type items: dict
+
+        :returns: The serialized items that changed since the previous
+                  call, by key, and the keys of the removed items.
+        :rtype: tuple
+        """
+        changed = {}
+        digests = {}
+
+        for key, item in items.items():
+            digest = self._digests.get(key)
+            if digest is None or key in self._dirty:
+                data = dumps(item, self.codec)
+                new_digest = hashlib.sha1(data).digest()
+                if new_digest != digest:
+                    changed[key] = data
+                digest = new_digest
+            digests[key] = digest
+
+        removed = [key for key in self._digests if key not in digests]
+        self._digests = digests
+        self._dirty.clear()
+        return changed, removed
+
+    def reset(self):
+        """
+        Forgets the previous items, so that all items are changed.
+        """
+        self._digests = {}
+        self._dirty.clear()
+
+    def is_reset(self):
+        """
+        :returns: True if no items were serialized since the last reset
+        :rtype: bool
+        """
+        return not self._digests
@@ -24,6 +24,7 @@ execute queue entries in a hierarchical manner.
 
 import copy
 import logging
+import os
 import sys
 import time
 import traceback
@@ -38,6 +39,7 @@ from mxcubecore.model.queue_model_enumerables import (
     CENTRING_METHOD,
     EXPERIMENT_TYPE,
 )
+from mxcubecore.utils import queue_profiler
 
 __credits__ = ["MXCuBE collaboration"]
 __license__ = "LGPLv3+"
@@ -75,6 +77,10 @@ class QueueEntryContainer(object):
     controls/handles the execution of the queue entries.
     """
 
+    # Incremented when entries are enqueued, dequeued or swapped in any
+    # container, see QueueManager.get_execution_plan
+    queue_version = 0
+
     def __init__(self):
         object.__init__(self)
         self._queue_entry_list = []
@@ -91,6 +97,7 @@ class QueueEntryContainer(object):
         # These are set in subclasses
         queue_entry.set_container(self)
         self._queue_entry_list.append(queue_entry)
+        QueueEntryContainer.queue_version += 1
 
     def dequeue(self, queue_entry):
         """
@@ -117,6 +124,7 @@ class QueueEntryContainer(object):
 
         if index is not None:
             result = self._queue_entry_list.pop(index)
+            QueueEntryContainer.queue_version += 1
 
         log = logging.getLogger("queue_exec")
         msg = "dequeue called with: " + str(queue_entry)
@@ -155,6 +163,7 @@ class QueueEntryContainer(object):
             temp = self._queue_entry_list[index_a]
             self._queue_entry_list[index_a] = self._queue_entry_list[index_b]
             self._queue_entry_list[index_b] = temp
+            QueueEntryContainer.queue_version += 1
 
         log = logging.getLogger("queue_exec")
         msg = "swap called with: " + str(queue_entry_a) + ", " + str(queue_entry_b)
@@ -294,15 +303,13 @@ class BaseQueueEntry(QueueEntryContainer):
         The default executer calls excute on all child entries after
         this method but before post_execute.
         """
-        msg = "Calling execute on: " + str(self)
-        logging.getLogger("queue_exec").info(msg)
+        logging.getLogger("queue_exec").info("Calling execute on: %s", self)
 
     def pre_execute(self):
         """
         Procedure to be done before execute.
         """
-        msg = "Calling pre_execute on: " + str(self)
-        logging.getLogger("queue_exec").info(msg)
+        logging.getLogger("queue_exec").info("Calling pre_execute on: %s", self)
         self.get_data_model().set_running(True)
 
     def post_execute(self):
@@ -310,8 +317,7 @@ class BaseQueueEntry(QueueEntryContainer):
         Procedure to be done after execute, and execute of all
         children of this entry.
         """
-        msg = "Calling post_execute on: " + str(self)
-        logging.getLogger("queue_exec").info(msg)
+        logging.getLogger("queue_exec").info("Calling post_execute on: %s", self)
 
         # view = self.get_view()
         # view.setHighlighted(True)
@@ -645,10 +651,17 @@ class SampleQueueEntry(BaseQueueEntry):
     def __init__(self, view=None, data_model=None):
         BaseQueueEntry.__init__(self, view, data_model)
         self.sample_centring_result = None
+        # LIMS information of the sample, set when it was prefetched and
+        # passed to the collect as its current_lims_sample
+        self.lims_sample = None
+        self._prefetch_task = None
+        self._next_sample_entry = None
 
     def __getstate__(self):
         d = dict(self.__dict__)
         d["sample_centring_result"] = None
+        d["_prefetch_task"] = None
+        d["_next_sample_entry"] = None
         return d
 
     def __setstate__(self, d):
@@ -659,6 +672,12 @@ class SampleQueueEntry(BaseQueueEntry):
         log = logging.getLogger("queue_exec")
         sc_used = not self._data_model.free_pin_mode
 
+        # The sample changer may still be preparing the load of this sample
+        self.wait_for_prefetch()
+        # LIMS sample updated by the collections of this sample
+        if self.lims_sample is not None and HWR.beamline.collect is not None:
+            HWR.beamline.collect.current_lims_sample = self.lims_sample
+
         # Only execute samples with collections and when sample changer is used
         if len(self.get_data_model().get_children()) != 0 and sc_used:
             if HWR.beamline.diffractometer.in_plate_mode():
@@ -702,6 +721,64 @@ class SampleQueueEntry(BaseQueueEntry):
                 )
                 log.info(msg)
             self.get_view().setText(1, "")
+            self.prefetch_next_sample()
+
+    def wait_for_prefetch(self):
+        """
+        Waits until the prefetch of this sample, started while the previous
+        sample was collected, is done.
+        """
+        if self._prefetch_task is not None:
+            lims_sample = self._prefetch_task.get()
+            if lims_sample is not None:
+                self.lims_sample = lims_sample
+            self._prefetch_task = None
+
+    def get_next_sample_entry(self):
+        """
+        :returns: The sample entry executed after this one, None if there
+                  is none
+        :rtype: SampleQueueEntry
+        """
+        queue_manager = self.get_queue_controller() or HWR.beamline.queue_manager
+        plan = queue_manager.get_execution_plan()
+        index = plan.index(self)
+        if index is None:
+            return None
+
+        for entry in plan.entries[plan.subtree_ends[index] :]:
+            if (
+                isinstance(entry, SampleQueueEntry)
+                and entry.is_enabled()
+                and not entry.get_data_model().is_executed()
+                and entry.get_data_model().get_children()
+            ):
+                return entry
+        return None
+
+    def prefetch_next_sample(self):
+        """
+        Starts preparing the next sample while this one is collected, when
+        the prefetch_next_sample property of the queue manager is set.
+        """
+        queue_manager = self.get_queue_controller() or HWR.beamline.queue_manager
+        if not getattr(queue_manager, "prefetch_next_sample", False):
+            return
+
+        next_entry = self.get_next_sample_entry()
+        if next_entry is not None and next_entry._prefetch_task is None:
+            next_entry._prefetch_task = gevent.spawn(
+                prefetch_sample, next_entry.get_data_model()
+            )
+            self._next_sample_entry = next_entry
+
+    def stop(self):
+        BaseQueueEntry.stop(self)
+        next_entry = self._next_sample_entry
+        if next_entry is not None and next_entry._prefetch_task is not None:
+            next_entry._prefetch_task.kill(block=False)
+            next_entry._prefetch_task = None
+        self._next_sample_entry = None
 
     def centring_done(self, success, centring_info):
         if not success:
@@ -765,6 +842,49 @@ class BasketQueueEntry(BaseQueueEntry):
         BaseQueueEntry.__init__(self, view, data_model)
 
 
+def prefetch_sample(data_model):
+    """
+    Prepares the sample <data_model> while the previous sample is collected:
+    gets its LIMS information, creates the directories of its data
+    collections and lets the sample changer prepare its load. Errors are
+    logged, they are handled again when the sample is executed.
+
+    :param data_model: The sample.
+    :type data_model: Sample
+
+    :returns: The LIMS information of the sample, None if not available
+    :rtype: dict
+    """
+    log = logging.getLogger("queue_exec")
+    lims_sample = None
+
+    try:
+        lims = HWR.beamline.lims
+        if lims and data_model.has_lims_data() and hasattr(lims, "get_bl_sample"):
+            lims_sample = lims.get_bl_sample(data_model.lims_id)
+
+        for task_group in data_model.get_children():
+            for task in task_group.get_children():
+                path_template = task.get_path_template()
+                if path_template is None:
+                    continue
+                for directory in (
+                    path_template.directory,
+                    path_template.process_directory,
+                ):
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+
+        sample_changer = HWR.beamline.sample_changer
+        if sample_changer is not None and not data_model.free_pin_mode:
+            if hasattr(sample_changer, "prestage"):
+                sample_changer.prestage(data_model.loc_str)
+    except Exception:
+        log.exception("Could not prefetch sample %s", data_model.loc_str)
+
+    return lims_sample
+
+
 def mount_sample(data_model, centring_done_cb, async_result):
     HWR.beamline.sample_changer.trigger_progress_message("Loading sample")
     HWR.beamline.sample_view.clear_all()
@@ -782,7 +902,9 @@ def mount_sample(data_model, centring_done_cb, async_result):
         "startTime": time.strftime("%Y-%m-%d %H:%M:%S"),
     }
 
-    if not HWR.beamline.sample_changer.load(sample=data_model.loc_str, wait=True):
+    with queue_profiler.span("mount"):
+        loaded = HWR.beamline.sample_changer.load(sample=data_model.loc_str, wait=True)
+    if not loaded:
         raise QueueSkipEntryException("Sample changer could not load sample", "")
 
     robot_action_dict["endTime"] = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -793,7 +915,8 @@ def mount_sample(data_model, centring_done_cb, async_result):
         robot_action_dict["message"] = "Sample was not loaded"
         robot_action_dict["status"] = "ERROR"
 
-    HWR.beamline.lims.store_robot_action(robot_action_dict)
+    with queue_profiler.span("lims_store"):
+        HWR.beamline.lims.store_robot_action(robot_action_dict)
 
     if not HWR.beamline.sample_changer.has_loaded_sample():
         HWR.beamline.sample_changer.trigger_progress_message("Sample not loaded")
@@ -825,7 +948,8 @@ def mount_sample(data_model, centring_done_cb, async_result):
                     dm.start_centring_method(dm.MANUAL3CLICK_MODE)
 
                 HWR.beamline.sample_changer.trigger_progress_message("Centring !")
-                centring_result = async_result.get()
+                with queue_profiler.span("centring"):
+                    centring_result = async_result.get()
 
                 if centring_result["valid"]:
                     HWR.beamline.sample_changer.trigger_progress_message(
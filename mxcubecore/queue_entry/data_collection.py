@@ -34,6 +34,7 @@ from mxcubecore.queue_entry.base_queue_entry import (
     QueueExecutionException,
     center_before_collect,
 )
+from mxcubecore.utils import queue_profiler
 
 __credits__ = ["MXCuBE collaboration"]
 __license__ = "LGPLv3+"
@@ -236,7 +237,8 @@ class DataCollectionQueueEntry(BaseQueueEntry):
                 else:
                     pos_dict = HWR.beamline.diffractometer.get_positions()
                     cpos = queue_model_objects.CentredPosition(pos_dict)
-                    snapshot = HWR.beamline.sample_view.get_snapshot()
+                    with queue_profiler.span("snapshot"):
+                        snapshot = HWR.beamline.sample_view.get_snapshot()
                     acq_1.acquisition_parameters.centred_position = cpos
                     acq_1.acquisition_parameters.centred_position.snapshot_image = (
                         snapshot
@@ -252,10 +254,11 @@ class DataCollectionQueueEntry(BaseQueueEntry):
                 )
 
                 # TODO this is wrong. Rename to something like collect.start_procedure
-                self.collect_task = HWR.beamline.collect.collect(
-                    COLLECTION_ORIGIN_STR.MXCUBE, param_list
-                )
-                self.collect_task.get()
+                with queue_profiler.span("collect"):
+                    self.collect_task = HWR.beamline.collect.collect(
+                        COLLECTION_ORIGIN_STR.MXCUBE, param_list
+                    )
+                    self.collect_task.get()
 
                 if "collection_id" in param_list[0]:
                     dc.id = param_list[0]["collection_id"]
@@ -28,6 +28,7 @@ from mxcubecore.queue_entry.base_queue_entry import (
     QueueAbortedException,
     QueueExecutionException,
 )
+from mxcubecore.utils import queue_profiler
 
 __credits__ = ["MXCuBE collaboration"]
 __license__ = "LGPLv3+"
@@ -78,7 +79,8 @@ class EnergyScanQueueEntry(BaseQueueEntry):
                 cpos=energy_scan.centred_position,
             )
 
-        HWR.beamline.energy_scan.ready_event.wait()
+        with queue_profiler.span("energy_scan"):
+            HWR.beamline.energy_scan.ready_event.wait()
         HWR.beamline.energy_scan.ready_event.clear()
 
     def pre_execute(self):
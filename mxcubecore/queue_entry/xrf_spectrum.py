@@ -30,6 +30,7 @@ from mxcubecore.queue_entry.base_queue_entry import (
     QueueAbortedException,
     QueueExecutionException,
 )
+from mxcubecore.utils import queue_profiler
 
 __credits__ = ["MXCuBE collaboration"]
 __copyright__ = """ Copyright © by the MXCuBE collaboration """
@@ -61,16 +62,17 @@ class XrfSpectrumQueueEntry(BaseQueueEntry):
                 xrf_spectrum.centred_position = point.get_centred_position()
             self.get_view().setText(1, "Starting xrf spectrum")
             path_template = xrf_spectrum.path_template
-            HWR.beamline.xrf_spectrum.start_spectrum(
-                integration_time=xrf_spectrum.count_time,
-                data_dir=xrf_spectrum.path_template.directory,
-                archive_dir=xrf_spectrum.path_template.get_archive_directory(),
-                prefix=f"{path_template.get_prefix()}_{path_template.run_number}",
-                session_id=HWR.beamline.session.session_id,
-                blsample_id=xrf_spectrum._node_id,
-                cpos=xrf_spectrum.centred_position,
-            )
-            HWR.beamline.xrf_spectrum._ready_event.wait()
+            with queue_profiler.span("xrf_spectrum"):
+                HWR.beamline.xrf_spectrum.start_spectrum(
+                    integration_time=xrf_spectrum.count_time,
+                    data_dir=xrf_spectrum.path_template.directory,
+                    archive_dir=xrf_spectrum.path_template.get_archive_directory(),
+                    prefix=f"{path_template.get_prefix()}_{path_template.run_number}",
+                    session_id=HWR.beamline.session.session_id,
+                    blsample_id=xrf_spectrum._node_id,
+                    cpos=xrf_spectrum.centred_position,
+                )
+                HWR.beamline.xrf_spectrum._ready_event.wait()
             HWR.beamline.xrf_spectrum._ready_event.clear()
         else:
             logging.getLogger("user_level_log").info(
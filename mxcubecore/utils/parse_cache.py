@@ -0,0 +1,147 @@
+"""
+On-disk cache of parsed YAML configuration files.
+
+The result of parsing a file is stored with marshal, keyed by the file path,
+and is used again as long as the file modification time and content hash
+are unchanged. Only plain data is stored (no code is run when loading),
+and anything that cannot be stored is simply parsed every time.
+
+The cache is disabled unless a cache directory is set, with
+set_cache_directory or the MXCUBE_PARSE_CACHE_DIR environment variable.
+"""
+
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import tempfile
+
+from ruamel.yaml.compat import ordereddict
+
+# Changing the format of the stored data requires changing the version
+FORMAT_VERSION = (1, marshal.version) + tuple(sys.version_info[:2])
+
+# tags of the containers stored as tuples (see encode)
+_TUPLE = "tuple"
+_OMAP = "omap"
+
+_cache_directory = os.environ.get("MXCUBE_PARSE_CACHE_DIR") or None
+
+
+def set_cache_directory(cache_directory):
+    """
+    set the directory of the cache files, None disables the cache
+    """
+    global _cache_directory
+    _cache_directory = cache_directory
+
+
+def get_cache_directory():
+    """
+    get the directory of the cache files, None if the cache is disabled
+    """
+    return _cache_directory
+
+
+def encode(value):
+    """
+    convert value to a structure marshal can store, tuples being used
+    for the containers that marshal does not restore as such
+
+    Raises:
+        TypeError: value contains an object that cannot be stored
+    """
+    if value is None or isinstance(value, (str, bool, int, float, bytes)):
+        return value
+    if isinstance(value, ordereddict):
+        return (_OMAP, [(encode(key), encode(val)) for key, val in value.items()])
+    if isinstance(value, dict):
+        return {encode(key): encode(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, tuple):
+        return (_TUPLE, [encode(item) for item in value])
+    if isinstance(value, (set, frozenset)):
+        for item in value:
+            encode(item)
+        return value
+    raise TypeError("Cannot cache %s object" % type(value).__name__)
+
+
+def decode(value):
+    """
+    convert a structure returned by encode back to the original value
+    """
+    if isinstance(value, tuple):
+        tag, items = value
+        if tag == _OMAP:
+            return ordereddict((decode(key), decode(val)) for key, val in items)
+        return tuple(decode(item) for item in items)
+    if isinstance(value, dict):
+        return {decode(key): decode(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def _cache_file(file_path):
+    file_path = os.path.abspath(file_path)
+    name = hashlib.sha1(file_path.encode()).hexdigest()
+    return os.path.join(_cache_directory, name + ".cache")
+
+
+def load(file_path, data, parse):
+    """
+    get parse(data) from the cache, or parse data and store the result
+
+    Args:
+        file_path (str): path of the parsed file
+        data (str): content of the file
+        parse (callable): function parsing data
+
+    Returns:
+        the result of parse(data)
+    """
+    if _cache_directory is None:
+        return parse(data)
+
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
+    except OSError:
+        return parse(data)
+    key = (FORMAT_VERSION, mtime, hashlib.sha1(data.encode()).hexdigest())
+    cache_file = _cache_file(file_path)
+
+    try:
+        with open(cache_file, "rb") as fp:
+            cached_key, result = marshal.load(fp)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    else:
+        if cached_key == key:
+            return decode(result)
+
+    result = parse(data)
+    try:
+        cached = marshal.dumps((key, encode(result)))
+    except (TypeError, ValueError):
+        logging.getLogger("HWR").debug("Cannot cache parsed file %s", file_path)
+        return result
+
+    # write to a temporary file first, so that readers never see partial data
+    try:
+        os.makedirs(_cache_directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=_cache_directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(cached)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        logging.getLogger("HWR").debug(
+            "Cannot write parse cache for %s", file_path, exc_info=True
+        )
+    return result
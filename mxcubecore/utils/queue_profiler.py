@@ -0,0 +1,334 @@
+"""
+Timing of the queue execution.
+
+The profiler records the wall-clock duration of the execution steps of the
+queue entries (pre_execute, execute and post_execute) and of the hardware
+calls made by the entries (sample mount, centring, data collection ...) as
+spans, kept in a ring buffer. The spans can be queried, are passed to the
+listeners as they are recorded, and can also be appended to a JSON-lines
+or SQLite file. The spans are written to the file in batches by a
+background thread, so that the queue execution does not wait for the disk.
+
+The QueueManager has a profiler, see QueueManager.profiler; queue entries
+time their hardware calls with queue_profiler.span(step), the spans
+recorded in the greenlets they spawn are attributed to them as well.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import gevent
+import gevent.threadpool
+
+from mxcubecore import HardwareRepository as HWR
+
+# Span of the execution of a step
+#   step: name of the step, "entry" for the whole execution of an entry
+#   entry_type: class name of the queue entry, None outside of entries
+#   node_id: node id of the data model of the queue entry
+#   sample: location of the sample of the queue entry
+#   start: start time, seconds since the epoch
+#   duration: duration in seconds
+#   failed: True if the step raised an exception
+Span = collections.namedtuple(
+    "Span", ("step", "entry_type", "node_id", "sample", "start", "duration", "failed")
+)
+
+# File extensions of the SQLite output files, other files are JSON-lines
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+# The recorded spans are written to the output file at most WRITE_INTERVAL
+# seconds later, or as soon as WRITE_BATCH_SIZE spans are waiting
+WRITE_INTERVAL = 1.0
+WRITE_BATCH_SIZE = 100
+
+
+class QueueProfiler(object):
+    """
+    Records the spans of the queue execution in a ring buffer of <size>
+    spans.
+    """
+
+    def __init__(self, size=10000):
+        self.enabled = True
+        self._spans = collections.deque(maxlen=size)
+        self._listeners = []
+        # Entries being executed, by greenlet
+        self._entries = {}
+        self._output_file = None
+        self._output = None
+        # Spans waiting to be written, writer thread, and timer writing them
+        self._pending = []
+        self._writer = None
+        self._write_timer = None
+
+    def add_listener(self, callback):
+        """
+        Calls <callback> with each recorded span.
+
+        :param callback: Callable taking a Span.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def set_output_file(self, file_path):
+        """
+        Appends the spans to the file <file_path>, a SQLite database if
+        its extension is one of SQLITE_EXTENSIONS and a JSON-lines file
+        otherwise. None stops writing the spans.
+
+        :param file_path: Path of the file.
+        :type file_path: str
+        """
+        if self._output is not None:
+            self.flush()
+            self._writer.apply(self._output.close)
+            self._output = None
+        self._output_file = file_path
+
+        if file_path:
+            if self._writer is None:
+                # One thread, the writes are done in order
+                self._writer = gevent.threadpool.ThreadPool(1)
+            self._output = self._writer.apply(self._open_output, (file_path,))
+
+    def get_output_file(self):
+        return self._output_file
+
+    @staticmethod
+    def _open_output(file_path):
+        if os.path.splitext(file_path)[1].lower() not in SQLITE_EXTENSIONS:
+            return open(file_path, "a")
+
+        output = sqlite3.connect(file_path, check_same_thread=False)
+        output.execute(
+            "CREATE TABLE IF NOT EXISTS spans (step TEXT, "
+            "entry_type TEXT, node_id INTEGER, sample TEXT, "
+            "start REAL, duration REAL, failed INTEGER)"
+        )
+        output.commit()
+        return output
+
+    def flush(self):
+        """
+        Writes the recorded spans to the output file and waits for the end
+        of the writes.
+        """
+        self._write_pending()
+        if self._writer is not None:
+            self._writer.join()
+
+    def _write_pending(self):
+        if self._write_timer is not None:
+            if self._write_timer is not gevent.getcurrent():
+                self._write_timer.kill(block=False)
+            self._write_timer = None
+
+        spans, self._pending = self._pending, []
+        if spans and self._output is not None:
+            self._writer.spawn(
+                self._write_spans, self._output, self._output_file, spans
+            )
+
+    @staticmethod
+    def _write_spans(output, file_path, spans):
+        # Runs in the writer thread
+        try:
+            if isinstance(output, sqlite3.Connection):
+                output.executemany(
+                    "INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?)", spans
+                )
+                output.commit()
+            else:
+                output.writelines(json.dumps(span._asdict()) + "\n" for span in spans)
+                output.flush()
+        except Exception:
+            logging.getLogger("HWR").exception(
+                "Could not write queue profile to %s", file_path
+            )
+
+    @contextlib.contextmanager
+    def entry_span(self, entry):
+        """
+        Context manager recording the execution of the queue entry
+        <entry>, the spans recorded meanwhile in the same greenlet are
+        attributed to <entry>.
+
+        :param entry: The queue entry.
+        :type entry: BaseQueueEntry
+        """
+        greenlet = gevent.getcurrent()
+        self._entries.setdefault(greenlet, []).append(entry)
+        try:
+            with self.span("entry", entry):
+                yield
+        finally:
+            entries = self._entries[greenlet]
+            entries.pop()
+            if not entries:
+                del self._entries[greenlet]
+
+    @contextlib.contextmanager
+    def span(self, step, entry=None):
+        """
+        Context manager recording the execution of <step>.
+
+        :param step: Name of the step.
+        :type step: str
+        :param entry: The queue entry executing the step, by default the
+                      entry executed by the current greenlet.
+        :type entry: BaseQueueEntry
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        start_counter = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            duration = time.perf_counter() - start_counter
+            if entry is None:
+                entry = self._get_current_entry()
+            self.record(self._make_span(step, entry, start, duration, failed))
+
+    def _get_current_entry(self):
+        # Entry executed by the current greenlet, or by the greenlets having
+        # spawned it
+        greenlet = gevent.getcurrent()
+        while greenlet is not None:
+            entries = self._entries.get(greenlet)
+            if entries:
+                return entries[-1]
+            greenlet = getattr(greenlet, "spawning_greenlet", None)
+            if greenlet is not None:
+                greenlet = greenlet()
+        return None
+
+    @staticmethod
+    def _make_span(step, entry, start, duration, failed):
+        if entry is None:
+            return Span(step, None, None, None, start, duration, failed)
+
+        model = entry.get_data_model()
+        node_id = getattr(model, "_node_id", None)
+        sample = None
+        get_sample_node = getattr(model, "get_sample_node", None)
+        if get_sample_node is not None:
+            sample_node = get_sample_node()
+            if sample_node is not None:
+                sample = sample_node.loc_str or None
+        return Span(
+            step, entry.__class__.__name__, node_id, sample, start, duration, failed
+        )
+
+    def record(self, span):
+        """
+        Adds <span> to the ring buffer, passes it to the listeners, and
+        schedules its writing to the output file.
+
+        :param span: The span.
+        :type span: Span
+        """
+        self._spans.append(span)
+
+        if self._output is not None:
+            self._pending.append(span)
+            if len(self._pending) >= WRITE_BATCH_SIZE:
+                self._write_pending()
+            elif self._write_timer is None:
+                self._write_timer = gevent.spawn_later(
+                    WRITE_INTERVAL, self._write_pending
+                )
+
+        for callback in self._listeners:
+            try:
+                callback(span)
+            except Exception:
+                logging.getLogger("HWR").exception("Queue profile listener failed")
+
+    def get_spans(self, step=None, node_id=None, sample=None, since=None):
+        """
+        :param step: Only the spans of this step.
+        :param node_id: Only the spans of the entry with this node id.
+        :param sample: Only the spans of the entries of this sample.
+        :param since: Only the spans started from this time.
+
+        :returns: The recorded spans, oldest first
+        :rtype: list
+        """
+        return [
+            span
+            for span in self._spans
+            if (step is None or span.step == step)
+            and (node_id is None or span.node_id == node_id)
+            and (sample is None or span.sample == sample)
+            and (since is None or span.start >= since)
+        ]
+
+    def get_statistics(self, key="step", spans=None):
+        """
+        :param key: Span field to group the spans by.
+        :type key: str
+        :param spans: The spans, all the recorded spans by default.
+
+        :returns: Number, total, mean and maximum duration of the spans, by
+                  value of <key>
+        :rtype: dict
+        """
+        if spans is None:
+            spans = self._spans
+
+        statistics = {}
+        for span in spans:
+            value = getattr(span, key)
+            stat = statistics.get(value)
+            if stat is None:
+                statistics[value] = stat = {"count": 0, "total": 0.0, "max": 0.0}
+            stat["count"] += 1
+            stat["total"] += span.duration
+            stat["max"] = max(stat["max"], span.duration)
+
+        for stat in statistics.values():
+            stat["mean"] = stat["total"] / stat["count"]
+        return statistics
+
+    def clear(self):
+        """
+        Removes the spans from the ring buffer.
+        """
+        self._spans.clear()
+
+
+def get_profiler():
+    """
+    :returns: The profiler of the queue manager, None if there is none
+    :rtype: QueueProfiler
+    """
+    queue_manager = getattr(HWR.beamline, "queue_manager", None)
+    return getattr(queue_manager, "profiler", None)
+
+
+def span(step):
+    """
+    Context manager recording the execution of <step> with the profiler of
+    the queue manager, if any, attributed to the queue entry executed by
+    the current greenlet.
+
+    :param step: Name of the step, for instance "mount" or "collect".
+    :type step: str
+    """
+    profiler = get_profiler()
+    if not isinstance(profiler, QueueProfiler):
+        return contextlib.nullcontext()
+    return profiler.span(step)
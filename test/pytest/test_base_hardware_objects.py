@@ -16,6 +16,7 @@ from typing import (
 )
 from unittest.mock import MagicMock
 
+import gevent
 import pytest
 
 from mxcubecore.BaseHardwareObjects import (
@@ -23,6 +24,7 @@ from mxcubecore.BaseHardwareObjects import (
     HardwareObject,
     HardwareObjectMixin,
     HardwareObjectNode,
+    HardwareObjectState,
     HardwareObjectYaml,
     PropertySet,
 )
@@ -1375,6 +1377,50 @@ class TestHardwareObjectMixin:
 
     # def test_emit(self): ...
 
+    def test_emit_coalesced(self, hw_obj_mixin: HardwareObjectMixin):
+        """Test rate limiting of the coalesced signals.
+
+        Args:
+            hw_obj_mixin (HardwareObjectMixin): Object instance.
+        """
+
+        received = []
+        states = []
+
+        def value_changed(value):
+            received.append(value)
+
+        def state_changed(state):
+            states.append((state, received[-1]))
+
+        hw_obj_mixin.connect("valueChanged", value_changed)
+        hw_obj_mixin.connect("stateChanged", state_changed)
+        hw_obj_mixin.signal_rate_limit = 50
+
+        for value in range(10):
+            hw_obj_mixin.emit("valueChanged", (value,))
+
+        # First value is emitted at once, the latest one after the interval
+        assert received == [0]
+        with gevent.Timeout(1):
+            while len(received) < 2:
+                gevent.sleep(0.01)
+        assert received == [0, 9]
+
+        # Once the interval has elapsed, the first value is emitted at once
+        gevent.sleep(0.06)
+        for value in range(10, 20):
+            hw_obj_mixin.emit("valueChanged", (value,))
+        assert received == [0, 9, 10]
+
+        # The pending value is flushed before the READY state
+        hw_obj_mixin.emit("valueChanged", (20,))
+        hw_obj_mixin.emit("stateChanged", (HardwareObjectState.READY,))
+        assert received == [0, 9, 10, 20]
+        assert states == [(HardwareObjectState.READY, 20)]
+        gevent.sleep(0.1)
+        assert received == [0, 9, 10, 20]
+
     # def test_connect(self): ...
 
     # def test_disconnect(self): ...
@@ -0,0 +1,107 @@
+"""Test the dispatcher receivers cache"""
+
+import logging
+import time
+
+import pytest
+
+from mxcubecore.dispatcher import dispatcher
+
+
+class Sender:
+    """Signal sender"""
+
+
+class Receiver:
+    """Signal receiver, with slots accepting different arguments"""
+
+    def __init__(self):
+        self.received = []
+
+    def value_changed(self, value):
+        self.received.append(value)
+
+    def value_changed_sender(self, value, sender=None):
+        self.received.append((value, sender))
+
+    def value_changed_kwargs(self, value, **kwargs):
+        self.received.append((value, sorted(kwargs)))
+
+    def failing(self, value):
+        raise RuntimeError("receiver error")
+
+
+def test_send_arguments(mocker):
+    sender = Sender()
+    receiver = Receiver()
+    excepthook = mocker.patch("sys.excepthook")
+
+    for slot in (
+        receiver.value_changed,
+        receiver.failing,
+        receiver.value_changed_sender,
+        receiver.value_changed_kwargs,
+    ):
+        dispatcher.connect(slot, "valueChanged", sender)
+
+    for _ in range(2):
+        responses = dispatcher.send("valueChanged", sender, 1)
+        assert len(responses) == 4
+    assert receiver.received == 2 * [
+        1,
+        (1, sender),
+        (1, ["sender", "signal"]),
+    ]
+    assert excepthook.call_count == 2
+
+
+def test_send_cache_invalidation():
+    sender = Sender()
+    receiver = Receiver()
+
+    dispatcher.connect(receiver.value_changed, "valueChanged", sender)
+    dispatcher.send("valueChanged", sender, 1)
+    dispatcher.send("otherSignal", sender, 2)
+
+    other = Receiver()
+    dispatcher.connect(other.value_changed, "valueChanged", sender)
+    dispatcher.send("valueChanged", sender, 3)
+
+    dispatcher.disconnect(receiver.value_changed, "valueChanged", sender)
+    dispatcher.send("valueChanged", sender, 4)
+
+    del other
+    assert dispatcher.send("valueChanged", sender, 5) == []
+    assert receiver.received == [1, 3]
+
+    # receivers of a dead sender are not called for a new sender
+    dispatcher.connect(receiver.value_changed, "valueChanged", sender)
+    del sender
+    assert dispatcher.send("valueChanged", Sender(), 6) == []
+    assert receiver.received == [1, 3]
+
+
+@pytest.mark.parametrize("nb_receivers", [1, 10, 100])
+def test_send_benchmark(nb_receivers):
+    """Measure the number of sends per second"""
+    sender = Sender()
+    receivers = [Receiver() for _ in range(nb_receivers)]
+    for receiver in receivers:
+        dispatcher.connect(receiver.value_changed, "valueChanged", sender)
+
+    nb_sends = 100000 // nb_receivers
+    rates = {}
+    for send in (dispatcher._send, dispatcher.send):
+        start = time.perf_counter()
+        for value in range(nb_sends):
+            send("valueChanged", sender, value)
+        rates[send.__name__] = nb_sends / (time.perf_counter() - start)
+
+    logging.getLogger("HWR").info(
+        "dispatcher.send with %d receivers: %.0f sends/s (%.0f without cache)",
+        nb_receivers,
+        rates["__cached_send"],
+        rates["send"],
+    )
+    for receiver in receivers:
+        assert receiver.received == 2 * list(range(nb_sends))
@@ -0,0 +1,254 @@
+"""Test the Exporter client against a local exporter-like server"""
+
+import logging
+import socket
+import time
+
+import gevent
+import gevent.server
+import pytest
+
+from mxcubecore.Command.Exporter import (
+    EXPORTER_CLIENTS,
+    Exporter,
+    ExporterChannel,
+)
+from mxcubecore.Command.exporter.ExporterClient import (
+    PARAMETER_SEPARATOR,
+    ExporterClient,
+)
+from mxcubecore.Command.exporter.StandardClient import (
+    PROTOCOL,
+    StandardClient,
+    StreamParser,
+    TimeoutError,
+)
+
+STX = b"\x02"
+ETX = b"\x03"
+
+
+class FakeExporterServer(gevent.server.StreamServer):
+    """Exporter server answering READ and EXEC requests in order.
+
+    READ <name> returns the property value, EXEC sleep <seconds>
+    sleeps before replying.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), self.handle)
+        self.properties = {}
+        self.max_pending = 0
+
+    def handle(self, sock, address):
+        buffer = b""
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            buffer += data
+            requests = []
+            while ETX in buffer:
+                msg, buffer = buffer.split(ETX, 1)
+                requests.append(msg.lstrip(STX).decode())
+            self.max_pending = max(self.max_pending, len(requests))
+            for request in requests:
+                sock.sendall(STX + self.reply(request).encode() + ETX)
+
+    def reply(self, request):
+        cmd, _, args = request.partition(" ")
+        if cmd == "NAME":
+            return "RET:FakeExporter"
+        if cmd == "READ":
+            if args not in self.properties:
+                return "ERR:unknown property"
+            return "RET:" + str(self.properties[args])
+        if cmd == "EXEC":
+            method, _, pars = args.partition(" ")
+            if method == "sleep":
+                gevent.sleep(float(pars.rstrip(PARAMETER_SEPARATOR)))
+                return "RET:" + pars.rstrip(PARAMETER_SEPARATOR)
+        return "ERR:unknown request"
+
+
+@pytest.fixture
+def server():
+    server = FakeExporterServer()
+    server.start()
+    server.properties = {"Prop%d" % i: i for i in range(20)}
+    yield server
+    server.stop()
+
+
+def make_client(server, max_in_flight=1):
+    return ExporterClient(
+        "127.0.0.1", server.server_port, PROTOCOL.STREAM, 3, 1, max_in_flight
+    )
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_read_property(server, max_in_flight):
+    client = make_client(server, max_in_flight)
+    try:
+        assert client.read_property("Prop3") == "3"
+        tasks = [gevent.spawn(client.read_property, "Prop%d" % i) for i in range(20)]
+        gevent.joinall(tasks, raise_error=True)
+        assert [task.value for task in tasks] == [str(i) for i in range(20)]
+    finally:
+        client.disconnect()
+
+
+def test_pipelined_requests(server):
+    client = make_client(server, 4)
+    try:
+        tasks = [
+            gevent.spawn(client.execute, "sleep", (0.05,)),
+            gevent.spawn(client.read_property, "Prop1"),
+            gevent.spawn(client.read_property, "Prop2"),
+        ]
+        gevent.joinall(tasks, raise_error=True)
+        assert [task.value for task in tasks] == ["0.05", "1", "2"]
+        # requests were sent without waiting for the previous replies
+        assert server.max_pending > 1
+    finally:
+        client.disconnect()
+
+
+def test_set_max_in_flight_during_request(server):
+    client = make_client(server)
+    try:
+        assert client.read_property("Prop3") == "3"
+        tasks = [
+            gevent.spawn(client.execute, "sleep", (0.05,)),
+            gevent.spawn(client.set_max_in_flight, 4),
+            gevent.spawn(client.read_property, "Prop1"),
+            gevent.spawn(client.read_property, "Prop2"),
+        ]
+        gevent.joinall(tasks, raise_error=True)
+        assert [task.value for task in tasks] == ["0.05", None, "1", "2"]
+        assert client.max_in_flight == 4
+    finally:
+        client.disconnect()
+
+
+def test_pipelined_timeout_keeps_replies_in_order(server):
+    client = make_client(server, 4)
+    try:
+        with pytest.raises(TimeoutError):
+            client.execute("sleep", (0.2,), timeout=0.05)
+        assert client.read_property("Prop5") == "5"
+    finally:
+        client.disconnect()
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_read_properties(server, max_in_flight):
+    client = make_client(server, max_in_flight)
+    try:
+        names = ["Prop%d" % i for i in range(10)] + ["Unknown"]
+        values = client.read_properties(names)
+        assert values == dict({"Prop%d" % i: str(i) for i in range(10)}, Unknown=None)
+        # a single write was sent for the whole batch
+        assert server.max_pending == len(names)
+    finally:
+        client.disconnect()
+
+
+def test_channel_get_values_bulk(server):
+    channels = [
+        ExporterChannel(
+            "chan%d" % i,
+            "Prop%d" % i,
+            address="127.0.0.1",
+            port=server.server_port,
+        )
+        for i in range(5)
+    ]
+    exporter = EXPORTER_CLIENTS.pop(("127.0.0.1", server.server_port))
+    try:
+        server.properties["Prop2"] = 12
+        assert ExporterChannel.get_values_bulk(channels) == [0, 1, 12, 3, 4]
+        assert channels[2].value == 12
+    finally:
+        exporter.stop()
+
+
+def test_cached_value_types():
+    exporter = Exporter("127.0.0.1", 0)
+    values = [
+        "1",
+        "2.5",
+        "-3",
+        "1e3",
+        "nan",
+        "true",
+        "false",
+        "Ready",
+        "",
+        " 7",
+        "\x1f1\x1f2\x1f",
+        "\x1f1.5\x1f2\x1f",
+        "\x1fReady\x1fMoving\x1f",
+        "\x1f1\x1fReady\x1f",
+        "\x1f",
+    ]
+    for first in values:
+        for value in values:
+            exporter._value_types.clear()
+            exporter._to_python_value(first, "Prop")
+            expected, _ = exporter._decode(value)
+            converted = exporter._to_python_value(value, "Prop")
+            assert repr(converted) == repr(expected), (first, value)
+
+
+def test_stream_parser():
+    parser = StreamParser(max_size=10)
+    assert parser.feed(bytearray(b"junk\x02RET:1\x03\x02RET:")) == [b"RET:1"]
+    assert parser.feed(bytearray(b"2\x03junk\x03")) == [b"RET:2"]
+    # a new STX discards the incomplete message
+    assert parser.feed(bytearray(b"\x02lost\x02RET:3\x03")) == [b"RET:3"]
+    # only the given size is parsed
+    assert parser.feed(bytearray(b"\x02RET:4\x03\x02RET:5\x03"), 7) == [b"RET:4"]
+    # messages longer than max_size are dropped
+    assert parser.feed(bytearray(b"\x02" + b"x" * 20)) == []
+    assert parser.feed(bytearray(b"yyy\x03\x02RET:6\x03")) == [b"RET:6"]
+
+
+class CountingClient(StandardClient):
+    """Client recording the received messages"""
+
+    def __init__(self, sock):
+        super().__init__("localhost", 0, PROTOCOL.STREAM, 3, 1)
+        self._StandardClient__sock = sock
+        self._is_connected = True
+        self.messages = []
+
+    def on_message_received(self, msg):
+        self.messages.append(msg)
+
+
+def test_recv_thread_benchmark():
+    """Feed 10k messages through a local socket pair"""
+    nb_messages = 10000
+    client_sock, server_sock = socket.socketpair()
+    client = CountingClient(client_sock)
+    payload = b"".join(
+        b"\x02RET:" + (b"\x1f%d" % i) * (i % 50) + b"\x03" for i in range(nb_messages)
+    )
+
+    start = time.perf_counter()
+    receiver = gevent.spawn(client.recv_thread)
+    server_sock.sendall(payload)
+    server_sock.close()
+    receiver.join(timeout=30)
+    elapsed = time.perf_counter() - start
+
+    logging.getLogger("HWR").info(
+        "recv_thread: %d messages (%d bytes) in %.3f s",
+        nb_messages,
+        len(payload),
+        elapsed,
+    )
+    assert len(client.messages) == nb_messages
+    assert client.messages[-1] == "RET:" + "\x1f9999" * (9999 % 50)
+    assert client.error == "Disconnected"
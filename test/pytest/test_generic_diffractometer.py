@@ -0,0 +1,340 @@
+"""Test the GenericDiffractometer motor positions and projection of centred
+positions"""
+
+import logging
+import math
+import random
+import time
+from unittest import mock
+
+import gevent
+import numpy
+import pytest
+
+from mxcubecore.HardwareObjects import sample_centring
+from mxcubecore.HardwareObjects.GenericDiffractometer import (
+    CENTRED_POSITION_DTYPE,
+    DiffractometerState,
+    GenericDiffractometer,
+    MotorPositionCache,
+    centred_positions_to_array,
+)
+
+MOTOR_NAMES = ("phi", "sampx", "sampy", "phiy", "phiz")
+
+
+class FakeMotor(object):
+    """Motor counting the reads of its position, moving in <move_time>
+    seconds, after <start_delay> seconds"""
+
+    def __init__(self, value, move_time=0, start_delay=0):
+        self.value = value
+        self.nb_reads = 0
+        self.ready = True
+        self.move_time = move_time
+        self.start_delay = start_delay
+        self.slots = {"valueChanged": [], "stateChanged": []}
+        # (motor, state) of the moves, may be shared by several motors
+        self.events = []
+
+    def connect(self, signal, slot):
+        self.slots[signal].append(slot)
+
+    def disconnect(self, signal, slot):
+        self.slots[signal].remove(slot)
+
+    def emit(self, signal, value):
+        for slot in list(self.slots[signal]):
+            slot(value)
+
+    def get_value(self):
+        self.nb_reads += 1
+        return self.value
+
+    def is_ready(self):
+        return self.ready
+
+    def set_value(self, value, emit=True):
+        if self.move_time:
+            gevent.spawn(self._move, value)
+            return
+        self.value = value
+        if emit:
+            self.emit("valueChanged", value)
+
+    def _move(self, value):
+        gevent.sleep(self.start_delay)
+        self.ready = False
+        self.events.append((self, "MOVING"))
+        self.emit("stateChanged", "MOVING")
+        gevent.sleep(self.move_time)
+        self.value = value
+        self.emit("valueChanged", value)
+        self.ready = True
+        self.events.append((self, "READY"))
+        self.emit("stateChanged", "READY")
+
+
+def make_diffractometer(mocker, cls=GenericDiffractometer):
+    diffractometer = cls("diffractometer")
+    diffractometer.use_sample_centring = True
+    diffractometer.pixels_per_mm_x = 500.0
+    diffractometer.pixels_per_mm_y = 480.0
+    diffractometer.beam_position = [320, 256]
+    diffractometer.zoom_centre = {"x": 0, "y": 0}
+    mocker.patch.object(diffractometer, "update_zoom_calibration")
+
+    rng = random.Random(21)
+    for name in MOTOR_NAMES:
+        motor = FakeMotor(0)
+        diffractometer.motor_hwobj_dict[name] = motor
+        diffractometer.motor_positions.add_motor(name, motor)
+        motor.set_value(37.5 if name == "phi" else rng.uniform(-1, 1))
+        centring_motor = sample_centring.CentringMotor(
+            motor, direction=rng.choice((-1, 1))
+        )
+        setattr(diffractometer, "centring_" + name, centring_motor)
+    return diffractometer
+
+
+@pytest.fixture
+def diffractometer(mocker):
+    return make_diffractometer(mocker)
+
+
+def old_motor_positions_to_screen(diffractometer, centred_positions_dict):
+    """motor_positions_to_screen before the batch projection"""
+    phi_angle = math.radians(
+        diffractometer.centring_phi.direction * diffractometer.centring_phi.get_value()
+    )
+    sampx = diffractometer.centring_sampx.direction * (
+        centred_positions_dict["sampx"] - diffractometer.centring_sampx.get_value()
+    )
+    sampy = diffractometer.centring_sampy.direction * (
+        centred_positions_dict["sampy"] - diffractometer.centring_sampy.get_value()
+    )
+    phiy = diffractometer.centring_phiy.direction * (
+        centred_positions_dict["phiy"] - diffractometer.centring_phiy.get_value()
+    )
+    phiz = diffractometer.centring_phiz.direction * (
+        centred_positions_dict["phiz"] - diffractometer.centring_phiz.get_value()
+    )
+    rot_matrix = numpy.matrix(
+        [
+            math.cos(phi_angle),
+            -math.sin(phi_angle),
+            math.sin(phi_angle),
+            math.cos(phi_angle),
+        ]
+    )
+    rot_matrix.shape = (2, 2)
+    inv_rot_matrix = numpy.array(rot_matrix.I)
+    dx, dy = (
+        numpy.dot(numpy.array([sampx, sampy]), inv_rot_matrix)
+        * diffractometer.pixels_per_mm_x
+    )
+    x = (phiy * diffractometer.pixels_per_mm_x) + diffractometer.beam_position[0]
+    y = dy + (phiz * diffractometer.pixels_per_mm_y) + diffractometer.beam_position[1]
+    return x, y
+
+
+def random_positions(nb_positions):
+    rng = random.Random(nb_positions)
+    return [
+        {name: rng.uniform(-1, 1) for name in MOTOR_NAMES} for _ in range(nb_positions)
+    ]
+
+
+def test_motor_positions_to_screen_array(diffractometer):
+    positions = random_positions(50)
+    expected = numpy.array(
+        [old_motor_positions_to_screen(diffractometer, pos) for pos in positions]
+    )
+
+    motor = diffractometer.motor_hwobj_dict["sampx"]
+    motor.nb_reads = 0
+    result = diffractometer.motor_positions_to_screen_array(positions)
+    assert result.shape == (50, 2)
+    assert numpy.allclose(result, expected, rtol=0, atol=1e-9)
+
+    array = centred_positions_to_array(positions)
+    assert array.dtype == CENTRED_POSITION_DTYPE
+    assert numpy.array_equal(
+        diffractometer.motor_positions_to_screen_array(array), result
+    )
+    assert numpy.allclose(
+        diffractometer.motor_positions_to_screen(positions[3]), expected[3]
+    )
+
+    # the positions come from the valueChanged signals
+    assert motor.nb_reads == 0
+    motor.set_value(motor.value + 0.5)
+    assert not numpy.array_equal(
+        diffractometer.motor_positions_to_screen_array(positions), result
+    )
+    assert diffractometer.motor_positions_to_screen_array([]).shape == (0, 2)
+
+    diffractometer.pixels_per_mm_x = None
+    assert diffractometer.motor_positions_to_screen(positions[0]) == (0, 0)
+
+
+def test_motor_positions_to_screen_array_subclass(mocker):
+    class Diffractometer(GenericDiffractometer):
+        def motor_positions_to_screen(self, centred_positions_dict):
+            return centred_positions_dict["phiy"], centred_positions_dict["phiz"]
+
+    diffractometer = make_diffractometer(mocker, Diffractometer)
+    positions = random_positions(3)
+    expected = [[pos["phiy"], pos["phiz"]] for pos in positions]
+    for centred_positions in (positions, centred_positions_to_array(positions)):
+        result = diffractometer.motor_positions_to_screen_array(centred_positions)
+        assert result.tolist() == expected
+
+
+def test_motor_positions_to_screen_benchmark(diffractometer):
+    """Projection of 1000 positions, one at a time and at once"""
+    positions = random_positions(1000)
+    start = time.perf_counter()
+    for pos in positions:
+        old_motor_positions_to_screen(diffractometer, pos)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    diffractometer.motor_positions_to_screen_array(positions)
+    batch_time = time.perf_counter() - start
+
+    logging.getLogger("HWR").info(
+        "1000 positions projected in %.4f s, %.4f s one at a time",
+        batch_time,
+        old_time,
+    )
+
+
+def test_motor_position_cache(diffractometer):
+    motors = diffractometer.motor_hwobj_dict
+    snapshot = diffractometer.get_motor_positions_snapshot()
+    assert snapshot.positions == {name: motors[name].value for name in MOTOR_NAMES}
+    assert snapshot.timestamp <= time.time()
+    assert sum(motor.nb_reads for motor in motors.values()) == 0
+
+    # positions fresher than max_age, or read from the motors
+    motors["phiy"].set_value(2, emit=False)
+    assert diffractometer.get_motor_positions_snapshot().positions["phiy"] != 2
+    snapshot = diffractometer.get_motor_positions_snapshot(["phiy"], refresh=True)
+    assert snapshot.positions == {"phiy": 2}
+    time.sleep(0.01)
+    diffractometer.get_motor_positions_snapshot(max_age=0.005)
+    assert all(motor.nb_reads for motor in motors.values())
+
+    # motors without valueChanged signals are read again after max_age
+    cache = MotorPositionCache(max_age=0.01)
+    motor = FakeMotor(1)
+    cache.add_motor("silent", motor)
+    motor.slots["valueChanged"] = []
+    assert cache.get_value("silent") == 1
+    motor.value = 2
+    assert cache.get_value("silent") == 1
+    time.sleep(0.02)
+    assert cache.get_value("silent") == 2
+    assert motor.nb_reads == 2
+    cache.invalidate()
+    assert cache.get_value("silent") == 2
+    assert motor.nb_reads == 3
+
+    # signalled motors whose signals stop are read again after max_age,
+    # unless the caller accepts the positions of the last signals
+    motor = FakeMotor(1)
+    cache.add_motor("signalled", motor)
+    motor.set_value(2)
+    motor.set_value(3, emit=False)
+    assert cache.get_value("signalled") == 2
+    time.sleep(0.02)
+    assert cache.get_value("signalled", signal_only=True) == 2
+    assert cache.get_snapshot(["signalled"], signal_only=True).positions == {
+        "signalled": 2
+    }
+    assert cache.get_value("signalled") == 3
+
+    # motors added to motor_hwobj_dict after init
+    motors["kappa"] = FakeMotor(3)
+    assert diffractometer.get_positions()["kappa"] == 3
+
+
+def add_moving_motors(diffractometer, move_time, start_delay=0):
+    diffractometer.current_state = DiffractometerState.tostring(
+        DiffractometerState.Ready
+    )
+    motors = {}
+    events = []
+    for name in ("phiy", "phiz", "sampx"):
+        motors[name] = FakeMotor(0, move_time, start_delay)
+        motors[name].events = events
+        motors[name].actuator_name = name.title()
+        diffractometer.motor_hwobj_dict[name] = motors[name]
+        # as connected at init
+        motors[name].connect("stateChanged", diffractometer._motor_state_signalled)
+    return motors
+
+
+def test_move_motors(diffractometer):
+    motors = add_moving_motors(diffractometer, 0.1)
+    targets = {"phiy": 1.0, "phiz": 2.0, "sampx": 3.0, "kappa": None}
+
+    # the motors move together: all started before any stopped
+    diffractometer.move_motors(targets)
+    events = motors["phiy"].events
+    assert [state for _, state in events] == ["MOVING"] * 3 + ["READY"] * 3
+    assert {motor for motor, _ in events} == set(motors.values())
+    assert {name: motor.value for name, motor in motors.items()} == {
+        "phiy": 1.0,
+        "phiz": 2.0,
+        "sampx": 3.0,
+    }
+    # the signals are connected once, at init
+    assert all(
+        motor.slots["stateChanged"] == [diffractometer._motor_state_signalled]
+        for motor in motors.values()
+    )
+
+    # with the simultaneous move command of the controller
+    def move_sync(argin):
+        for item in argin.rstrip(";").split(";"):
+            name, position = item.split("=")
+            motors[name.lower()].set_value(float(position))
+
+    command = diffractometer.command_dict["startSimultaneousMoveMotors"] = mock.Mock(
+        side_effect=move_sync
+    )
+    diffractometer.move_motors({"phiy": 0.5, "sampx": 0.25})
+    command.assert_called_once_with("Phiy=0.5;Sampx=0.25;")
+    assert (motors["phiy"].value, motors["sampx"].value) == (0.5, 0.25)
+
+    with pytest.raises(Exception, match="Timeout"):
+        diffractometer.move_motors({"phiz": 5.0}, timeout=0.05)
+
+    # enumerated actuators, waited for by their state only
+    motors["phiy"].move_time = 0
+    motors["phiy"].value = "OUT"
+    diffractometer.wait_motors_ready([(motors["phiy"], "IN")])
+
+
+def test_move_motors_delayed_start(diffractometer):
+    """Controller reporting the move after it was started"""
+    motors = add_moving_motors(diffractometer, 0.05, start_delay=0.05)
+    diffractometer.delay_state_polling = 10
+    start = time.perf_counter()
+    diffractometer.move_motors({"phiy": 1.0, "phiz": 1.0})
+    # done when the motors stopped, well before delay_state_polling
+    assert [state for _, state in motors["phiy"].events] == [
+        "MOVING",
+        "MOVING",
+        "READY",
+        "READY",
+    ]
+    assert motors["phiy"].value == motors["phiz"].value == 1.0
+    assert time.perf_counter() - start < 5
+
+    # motors already in position are not waited for
+    with mock.patch.object(diffractometer, "motors_state_event") as event:
+        diffractometer.wait_motors_ready([(motors["phiy"], 1.0)])
+    event.wait.assert_not_called()
@@ -0,0 +1,80 @@
+"""Test the concurrent loading of hardware objects"""
+
+import gevent
+import pytest
+
+from mxcubecore import HardwareRepository as HWR
+
+
+class Container:
+    """yaml-configured object with roles a, b, c and d"""
+
+    a = b = c = d = None
+
+    def replace_object(self, role, hwobj):
+        setattr(self, role, hwobj)
+
+
+class Loaded:
+    """Loaded hardware object"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def test_dependency_order():
+    objects = dict.fromkeys("abcd", "x.xml")
+    assert HWR._dependency_order(objects, {}) == list("abcd")
+    assert HWR._dependency_order(objects, {"a": ["d"], "b": ["e"]}) == list("dabc")
+    with pytest.raises(ValueError):
+        HWR._dependency_order(objects, {"a": ["c"], "c": ["a"]})
+
+
+def test_load_contents_concurrently(mocker, beamline):
+    loaded = []
+
+    def load(name):
+        gevent.sleep(0.05)
+        loaded.append(name)
+        return Loaded(name)
+
+    load_hwobj = mocker.patch.object(
+        HWR._instance, "_load_hardware_object", side_effect=load
+    )
+    container = Container()
+    objects = {"a": "/a.xml", "b": "/b.xml", "c": "/a.xml", "d": "/d.xml"}
+    table = []
+
+    HWR._load_contents_concurrently(
+        container, "Container", objects, {"b": ["d"]}, 4, table
+    )
+
+    # /a is loaded once for both a and c
+    assert load_hwobj.call_count == 3
+    assert loaded.index("/d") < loaded.index("/b")
+    assert container.a is container.c
+    assert container.b.name == "/b"
+    # the summary keeps the configuration order
+    assert [row[0] for row in table] == list("abcd")
+
+
+def test_load_objects_referring_to_each_other(mocker, beamline):
+    loads = []
+
+    def load(name):
+        gevent.sleep(0.01)
+        loads.append(name)
+        if loads.count(name) == 1:
+            # as in init, referring to the other object
+            HWR._instance.get_hardware_object({"/a": "/b", "/b": "/a"}[name])
+        return Loaded(name)
+
+    mocker.patch.object(HWR._instance, "_load_hardware_object", side_effect=load)
+    tasks = [
+        gevent.spawn(HWR._instance.get_hardware_object, name) for name in ("/a", "/b")
+    ]
+    # the second load does not wait for the first, that waits for it
+    gevent.joinall(tasks, timeout=5, raise_error=True)
+    assert [task.value.name for task in tasks] == ["/a", "/b"]
+    assert sorted(loads) == ["/a", "/a", "/b"]
+    assert HWR._instance._waiting == {}
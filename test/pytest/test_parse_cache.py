@@ -0,0 +1,80 @@
+"""Test the parsed configuration files cache"""
+
+import logging
+import os
+import time
+
+import pytest
+from ruamel.yaml.compat import ordereddict
+
+from mxcubecore import HardwareRepository as HWR
+from mxcubecore.utils import parse_cache
+
+from .conftest import ROOT_DIR
+
+MOCKUP_DIR = os.path.join(ROOT_DIR, "mxcubecore/configuration/mockup")
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    parse_cache.set_cache_directory(str(tmp_path / "cache"))
+    yield tmp_path / "cache"
+    parse_cache.set_cache_directory(None)
+
+
+def test_encode_decode():
+    value = {
+        "a": [1, 2.5, None, True, "x"],
+        "b": ordereddict([("z", 1), ("y", (1, [2]))]),
+        "c": {1, 2},
+    }
+    decoded = parse_cache.decode(parse_cache.encode(value))
+    assert decoded == value
+    assert type(decoded["b"]) is ordereddict
+    assert list(decoded["b"]) == ["z", "y"]
+    assert isinstance(decoded["b"]["y"], tuple)
+    with pytest.raises(TypeError):
+        parse_cache.encode({"object": object()})
+
+
+def test_load_invalidation(cache_dir, tmp_path):
+    file_path = tmp_path / "config.yml"
+    calls = []
+
+    def parse(data):
+        calls.append(data)
+        return {"data": data}
+
+    file_path.write_text("a")
+    assert parse_cache.load(str(file_path), "a", parse) == {"data": "a"}
+    assert parse_cache.load(str(file_path), "a", parse) == {"data": "a"}
+    assert calls == ["a"]
+
+    file_path.write_text("b")
+    assert parse_cache.load(str(file_path), "b", parse) == {"data": "b"}
+    assert calls == ["a", "b"]
+
+    # results that cannot be stored are parsed every time
+    parse_cache.load(str(file_path), "b", lambda data: object())
+    assert len(os.listdir(str(cache_dir))) == 1
+
+
+def test_beamline_load(cache_dir):
+    hwr_path = "%s%s%s" % (
+        MOCKUP_DIR,
+        os.path.pathsep,
+        os.path.join(MOCKUP_DIR, "test"),
+    )
+    load_times = []
+    # the first load imports the modules, the third one fills the cache
+    for cache_directory in (None, None, str(cache_dir), str(cache_dir)):
+        parse_cache.set_cache_directory(cache_directory)
+        HWR._instance = HWR.beamline = None
+        start = time.perf_counter()
+        HWR.init_hardware_repository(hwr_path)
+        load_times.append(time.perf_counter() - start)
+        assert HWR.beamline.energy is not None
+    logging.getLogger("HWR").info(
+        "Beamline load: %.3f s, %.3f s with parse cache", load_times[1], load_times[3]
+    )
+    assert os.listdir(str(cache_dir))
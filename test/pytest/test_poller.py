@@ -0,0 +1,122 @@
+"""Test the Poller shared scheduler"""
+
+import itertools
+
+import gevent
+import gevent.monkey
+import pytest
+
+from mxcubecore import Poller
+
+
+class PolledObject:
+    """Object providing the polled call and the callbacks"""
+
+    def __init__(self):
+        self.counter = itertools.count()
+        self.values = []
+        self.errors = []
+
+    def read(self, step=1):
+        return next(self.counter) // step
+
+    def fail(self):
+        raise RuntimeError("polling failed")
+
+    def value_changed(self, value):
+        self.values.append(value)
+
+    def error(self, exc, poller_id):
+        self.errors.append((exc, poller_id))
+
+
+def test_poll_same_call_returns_same_poller():
+    obj = PolledObject()
+    poller = Poller.poll(obj.read, (2,), 100, obj.value_changed, obj.error)
+    try:
+        other = Poller.poll(obj.read, (2,), 50, obj.value_changed, obj.error)
+        assert other is poller
+        assert poller.get_polling_period() == 50
+        assert Poller.get_poller(poller.get_id()) is poller
+    finally:
+        poller.stop()
+
+    assert Poller.get_poller(poller.get_id()) is None
+    new_poller = Poller.poll(obj.read, (2,), 100, obj.value_changed, obj.error)
+    assert new_poller is not poller
+    new_poller.stop()
+
+
+def test_poll_value_changed():
+    obj = PolledObject()
+    poller = Poller.poll(obj.read, (2,), 10, obj.value_changed, obj.error)
+    gevent.sleep(0.2)
+    poller.stop()
+    gevent.sleep(0.05)
+
+    nb_values = len(obj.values)
+    assert nb_values > 2
+    # same values are only reported once
+    assert obj.values == list(range(nb_values))
+
+    # nothing is reported after stop
+    gevent.sleep(0.1)
+    assert len(obj.values) == nb_values
+
+
+def test_poll_error():
+    obj = PolledObject()
+    poller = Poller.poll(obj.fail, (), 10, obj.value_changed, obj.error)
+    gevent.sleep(0.1)
+
+    assert len(obj.errors) == 1
+    exc, poller_id = obj.errors[0]
+    assert isinstance(exc, RuntimeError)
+    assert poller_id == poller.get_id()
+    poller.stop()
+
+
+def test_blocking_poll_does_not_starve_other_pollers(monkeypatch):
+    scheduler = Poller._PollScheduler(max_threads=1, slow_call_time=0.05)
+    monkeypatch.setattr(Poller, "_scheduler", scheduler)
+    release = gevent.monkey.get_original("threading", "Event")()
+
+    def blocking_read():
+        release.wait(5)
+        return 0
+
+    obj = PolledObject()
+    blocked_obj = PolledObject()
+    blocked = Poller.poll(
+        blocking_read, (), 10, blocked_obj.value_changed, blocked_obj.error
+    )
+    poller = Poller.poll(obj.read, (), 10, obj.value_changed, obj.error)
+    try:
+        gevent.sleep(0.3)
+        # the only worker is blocked, an extra one runs the other poller
+        assert len(obj.values) > 2
+        assert scheduler._nb_threads == 2
+    finally:
+        release.set()
+        poller.stop()
+        blocked.stop()
+
+
+def test_set_max_polling_threads(monkeypatch):
+    scheduler = Poller._PollScheduler(max_threads=1)
+    monkeypatch.setattr(Poller, "_scheduler", scheduler)
+
+    with pytest.raises(ValueError):
+        Poller.set_max_polling_threads(0)
+
+    Poller.set_max_polling_threads(2)
+    assert scheduler._nb_threads == 0
+
+    obj = PolledObject()
+    poller = Poller.poll(obj.read, (), 10, obj.value_changed, obj.error)
+    try:
+        assert scheduler._nb_threads == 2
+        Poller.set_max_polling_threads(3)
+        assert scheduler._nb_threads == 3
+    finally:
+        poller.stop()
@@ -0,0 +1,358 @@
+"""Test the QueueManager execution plan"""
+
+import json
+import logging
+import sqlite3
+import time
+
+import gevent
+import pytest
+
+from mxcubecore import HardwareRepository as HWR
+from mxcubecore import queue_entry
+from mxcubecore.HardwareObjects.QueueManager import QueueManager
+from mxcubecore.HardwareObjects.QueueModel import QueueModel
+from mxcubecore.model import queue_model_objects
+from mxcubecore.queue_entry.base_queue_entry import (
+    BaseQueueEntry,
+    SampleQueueEntry,
+)
+from mxcubecore.utils import queue_profiler
+
+
+class RecordingQueueEntry(BaseQueueEntry):
+    """Queue entry recording its execution in <executed>"""
+
+    def __init__(self, executed, node_id):
+        model = queue_model_objects.TaskNode()
+        model._node_id = node_id
+        BaseQueueEntry.__init__(self, data_model=model)
+        self.set_enabled(True)
+        self._executed = executed
+
+    def execute(self):
+        queue_manager = self.get_queue_controller()
+        self._executed.append(
+            (
+                self,
+                [
+                    node_id
+                    for node_id in range(1, 100)
+                    if queue_manager.is_executing(node_id)
+                ],
+                queue_manager.get_progress(),
+            )
+        )
+
+
+class QuickQueueEntry(RecordingQueueEntry):
+    """Queue entry only recording that it was executed"""
+
+    def execute(self):
+        self._executed.append(self)
+
+
+@pytest.fixture
+def queue_manager():
+    # as QueueManager.init
+    queue_entry.import_queue_entries()
+    return QueueManager("queue")
+
+
+def make_queue(
+    queue_manager, nb_samples, nb_tasks, executed, entry_class=RecordingQueueEntry
+):
+    """Queue of samples with tasks, node ids numbered in execution order"""
+    entries = []
+    for _ in range(nb_samples):
+        sample_entry = entry_class(executed, len(entries) + 1)
+        queue_manager.enqueue(sample_entry)
+        entries.append(sample_entry)
+        for _ in range(nb_tasks):
+            task_entry = entry_class(executed, len(entries) + 1)
+            sample_entry.enqueue(task_entry)
+            entries.append(task_entry)
+    return entries
+
+
+def run_queue(queue_manager):
+    queue_manager.execute()
+    queue_manager._root_task.join()
+
+
+def test_execution_plan(queue_manager):
+    executed = []
+    entries = make_queue(queue_manager, 3, 2, executed)
+
+    plan = queue_manager.get_execution_plan()
+    assert plan.entries == entries
+    assert plan.get_container(entries[0]) is queue_manager
+    assert plan.get_container(entries[1]) is entries[0]
+    assert plan.subtree_ends[:3] == [3, 2, 3]
+    assert queue_manager.get_execution_plan() is plan
+
+    run_queue(queue_manager)
+    assert [entry for entry, _, _ in executed] == entries
+    # a task is executed within its sample
+    assert executed[0][1] == [1]
+    assert executed[1][1] == [1, 2]
+    assert [progress for _, _, progress in executed] == [
+        (index + 1, len(entries)) for index in range(len(entries))
+    ]
+    assert not queue_manager.is_executing(1)
+
+    # changes to the queue invalidate the plan
+    entries[0].dequeue(entries[1])
+    plan = queue_manager.get_execution_plan()
+    assert entries[1] not in plan.entries
+    assert plan.index(entries[1]) is None
+    entries[0].enqueue(entries[1])
+    assert queue_manager.get_execution_plan().entries[2] is entries[1]
+    queue_manager.clear()
+    assert len(queue_manager.get_execution_plan()) == 0
+
+
+def test_skip_to_entry(queue_manager):
+    executed = []
+    entries = make_queue(queue_manager, 3, 2, executed)
+
+    queue_manager.skip_to_entry(entries[5])
+    run_queue(queue_manager)
+    # the sample containing the entry is executed
+    assert [entry for entry, _, _ in executed] == [entries[3]] + entries[5:]
+    assert executed[0][2] == (4, len(entries))
+    assert queue_manager.get_progress() == (len(entries), len(entries))
+
+    with pytest.raises(ValueError):
+        queue_manager.skip_to_entry(RecordingQueueEntry(executed, 0))
+
+
+def test_execution_benchmark(queue_manager):
+    """Time per entry of the queue execution, for growing queues"""
+    times = []
+    for nb_samples in (10, 100):
+        queue_manager.clear()
+        executed = []
+        entries = make_queue(queue_manager, nb_samples, 20, executed, QuickQueueEntry)
+        start = time.perf_counter()
+        run_queue(queue_manager)
+        times.append((time.perf_counter() - start) / len(entries))
+        assert len(executed) == len(entries)
+
+    logging.getLogger("HWR").info(
+        "Queue execution: %.1f us per entry for 210 entries, "
+        "%.1f us per entry for 2100 entries",
+        times[0] * 1e6,
+        times[1] * 1e6,
+    )
+
+
+def add_sample_entry(queue_manager, tmp_path, index):
+    sample = queue_model_objects.Sample()
+    sample.loc_str = "1:%02d" % index
+    sample.lims_id = 100 + index
+    group = queue_model_objects.TaskGroup()
+    collection = queue_model_objects.DataCollection()
+    path_template = collection.acquisitions[0].path_template
+    path_template.directory = str(tmp_path / ("sample%d" % index) / "raw")
+    path_template.process_directory = str(tmp_path / ("sample%d" % index) / "proc")
+    sample._children = [group]
+    group._children = [collection]
+
+    sample_entry = SampleQueueEntry(data_model=sample)
+    sample_entry.set_enabled(True)
+    queue_manager.enqueue(sample_entry)
+    return sample_entry
+
+
+def test_prefetch_next_sample(mocker, tmp_path, queue_manager):
+    mocker.patch.object(HWR, "beamline")
+    HWR.beamline.lims.get_bl_sample.side_effect = lambda lims_id: {"id": lims_id}
+    entries = [add_sample_entry(queue_manager, tmp_path, index) for index in range(3)]
+    entries[1].set_enabled(False)
+
+    # disabled by default
+    entries[0].prefetch_next_sample()
+    assert entries[2]._prefetch_task is None
+
+    queue_manager.prefetch_next_sample = True
+    entries[0].prefetch_next_sample()
+    assert entries[0].get_next_sample_entry() is entries[2]
+    entries[2].wait_for_prefetch()
+    assert entries[2].lims_sample == {"id": 102}
+    assert (tmp_path / "sample2" / "raw").is_dir()
+    assert (tmp_path / "sample2" / "proc").is_dir()
+    assert not (tmp_path / "sample1").exists()
+    HWR.beamline.sample_changer.prestage.assert_called_once_with("1:02")
+    assert entries[2].get_next_sample_entry() is None
+
+    # the collections of the sample update its LIMS information
+    HWR.beamline.diffractometer.in_plate_mode.return_value = True
+    entries[2].execute()
+    assert HWR.beamline.collect.current_lims_sample == {"id": 102}
+    # left as set elsewhere for samples that were not prefetched
+    HWR.beamline.collect.current_lims_sample = {"id": 1}
+    entries[0].execute()
+    assert HWR.beamline.collect.current_lims_sample == {"id": 1}
+
+    # errors are only logged
+    HWR.beamline.sample_changer.prestage.side_effect = RuntimeError("busy")
+    entries[1].set_enabled(True)
+    entries[0].prefetch_next_sample()
+    entries[1].wait_for_prefetch()
+    assert entries[1].lims_sample == {"id": 101}
+
+
+class FailingQueueEntry(RecordingQueueEntry):
+    """Queue entry whose execution fails"""
+
+    def execute(self):
+        raise RuntimeError("failed")
+
+
+def test_profiler_spans(mocker, queue_manager):
+    mocker.patch.object(HWR, "beamline")
+    HWR.beamline.queue_manager = queue_manager
+
+    class MountingQueueEntry(RecordingQueueEntry):
+        def execute(self):
+            with queue_profiler.span("mount"):
+                pass
+            # spans of the greenlets spawned by the entry
+            gevent.spawn(self.change_energy).get()
+
+        def change_energy(self):
+            with queue_profiler.span("energy"):
+                pass
+
+    recorded = []
+
+    def span_recorded(span):
+        recorded.append(span)
+
+    queue_manager.connect("queue_profile_span", span_recorded)
+    executed = []
+    entries = make_queue(queue_manager, 2, 1, executed, MountingQueueEntry)
+    run_queue(queue_manager)
+
+    profiler = queue_manager.profiler
+    spans = profiler.get_spans()
+    assert recorded == spans
+    assert len(profiler.get_spans("entry")) == len(entries)
+    assert [span.node_id for span in profiler.get_spans("mount")] == [1, 2, 3, 4]
+    assert [span.node_id for span in profiler.get_spans("energy")] == [1, 2, 3, 4]
+    assert [span.node_id for span in profiler.get_spans(node_id=2)] == [2] * 6
+    assert all(span.entry_type == "MountingQueueEntry" for span in spans)
+    assert not any(span.failed for span in spans)
+
+    statistics = profiler.get_statistics()
+    assert set(statistics) == {
+        "entry",
+        "pre_execute",
+        "execute",
+        "post_execute",
+        "mount",
+        "energy",
+    }
+    assert statistics["mount"]["count"] == len(entries)
+    assert statistics["entry"]["max"] >= statistics["entry"]["mean"]
+    assert statistics["entry"]["total"] >= statistics["execute"]["total"]
+
+    # spans outside of queue entries
+    with queue_profiler.span("move"):
+        pass
+    assert profiler.get_spans("move")[0].entry_type is None
+
+    profiler.clear()
+    profiler.enabled = False
+    run_queue(queue_manager)
+    assert profiler.get_spans() == []
+
+
+def test_profiler_failed_span(queue_manager):
+    queue_manager.enqueue(FailingQueueEntry([], 1))
+    run_queue(queue_manager)
+    (span,) = queue_manager.profiler.get_spans("execute")
+    assert span.failed
+    assert queue_manager.profiler.get_spans("entry")[0].failed
+
+
+def test_profiler_ring_buffer():
+    profiler = queue_profiler.QueueProfiler(size=3)
+    for index in range(5):
+        with profiler.span("step%d" % index):
+            pass
+    assert [span.step for span in profiler.get_spans()] == ["step2", "step3", "step4"]
+
+
+@pytest.mark.parametrize("file_name", ["profile.jsonl", "profile.db"])
+def test_profiler_output_file(tmp_path, queue_manager, file_name):
+    file_path = str(tmp_path / file_name)
+    queue_manager.profiler.set_output_file(file_path)
+    make_queue(queue_manager, 1, 1, [], QuickQueueEntry)
+    run_queue(queue_manager)
+    queue_manager.profiler.set_output_file(None)
+
+    if file_name.endswith(".db"):
+        with sqlite3.connect(file_path) as connection:
+            steps = [row[0] for row in connection.execute("SELECT step FROM spans")]
+    else:
+        with open(file_path) as output:
+            steps = [json.loads(line)["step"] for line in output]
+    assert steps == [span.step for span in queue_manager.profiler.get_spans()]
+    assert len(steps) == 8
+
+
+def read_steps(file_path):
+    with open(file_path) as output:
+        return [json.loads(line)["step"] for line in output]
+
+
+def test_profiler_writes_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(queue_profiler, "WRITE_INTERVAL", 0.05)
+    monkeypatch.setattr(queue_profiler, "WRITE_BATCH_SIZE", 3)
+    file_path = str(tmp_path / "profile.jsonl")
+    profiler = queue_profiler.QueueProfiler()
+    profiler.set_output_file(file_path)
+
+    # written later by the writer thread
+    for step in ("step1", "step2"):
+        with profiler.span(step):
+            pass
+    assert read_steps(file_path) == []
+    gevent.sleep(0.2)
+    profiler._writer.join()
+    assert read_steps(file_path) == ["step1", "step2"]
+
+    # written as soon as a batch is complete
+    for step in ("step3", "step4", "step5"):
+        with profiler.span(step):
+            pass
+    profiler._writer.join()
+    assert read_steps(file_path)[2:] == ["step3", "step4", "step5"]
+
+    # written when the file is closed
+    with profiler.span("step6"):
+        pass
+    profiler.set_output_file(None)
+    assert read_steps(file_path)[5:] == ["step6"]
+
+
+def test_queue_changes_on_execution(mocker, queue_manager):
+    mocker.patch.object(HWR, "beamline")
+    queue_model = QueueModel("queue-model")
+    HWR.beamline.queue_model = queue_model
+    task = queue_model_objects.TaskNode()
+    queue_model.add_child(queue_model.get_model_root(), task)
+    version = queue_model.get_queue_snapshot()["version"]
+
+    entry = QuickQueueEntry([], task._node_id)
+    entry.set_data_model(task)
+    queue_manager.enqueue(entry)
+    run_queue(queue_manager)
+
+    patches = queue_model.get_queue_changes(version)["patches"]
+    assert [patch["status"] for patch in patches] == [
+        {"running": True, "state": "RUNNING"},
+        {"enabled": False, "executed": True, "running": False, "state": "SUCCESS"},
+    ]
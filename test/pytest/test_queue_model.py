@@ -0,0 +1,643 @@
+"""Test the QueueModel node id index and the QueueManager entry index"""
+
+import copy
+import functools
+import logging
+import pickle
+import random
+import time
+import tracemalloc
+
+import pytest
+
+from mxcubecore import HardwareRepository as HWR
+from mxcubecore.HardwareObjects.QueueManager import QueueManager
+from mxcubecore.HardwareObjects.QueueModel import QueueModel
+from mxcubecore.model import (
+    queue_change_feed,
+    queue_model_objects,
+)
+from mxcubecore.queue_entry.base_queue_entry import BaseQueueEntry
+
+
+@pytest.fixture
+def queue_model(mocker):
+    mocker.patch.object(HWR, "beamline")
+    return QueueModel("queue-model")
+
+
+def all_nodes(node):
+    for child in node.get_children():
+        yield child
+        yield from all_nodes(child)
+
+
+def check_index(queue_model):
+    """The index holds exactly the nodes of the selected model"""
+    root = queue_model.get_model_root()
+    nodes = list(all_nodes(root))
+    assert len({node._node_id for node in nodes}) == len(nodes)
+    assert root._nodes_by_id == {node._node_id: node for node in nodes}
+    for node in nodes:
+        assert queue_model.get_node(node._node_id) is node
+
+
+def add_sample(queue_model, nb_groups=2, nb_tasks=3):
+    sample = queue_model_objects.Sample()
+    queue_model.add_child(queue_model.get_model_root(), sample)
+    for _ in range(nb_groups):
+        group = queue_model_objects.TaskGroup()
+        queue_model.add_child(sample, group)
+        for _ in range(nb_tasks):
+            queue_model.add_child(group, queue_model_objects.TaskNode())
+    return sample
+
+
+def test_add_and_delete(queue_model):
+    samples = [add_sample(queue_model) for _ in range(3)]
+    check_index(queue_model)
+    assert queue_model.get_node(1000) is None
+
+    group = samples[1].get_children()[0]
+    task = group.get_children()[1]
+    queue_model.del_child(group, task)
+    check_index(queue_model)
+    assert queue_model.get_node(task._node_id) is None
+
+    queue_model.del_child(queue_model.get_model_root(), samples[0])
+    check_index(queue_model)
+    assert queue_model.get_node(samples[0]._node_id) is None
+
+
+def test_move(queue_model):
+    samples = [add_sample(queue_model) for _ in range(2)]
+    group = samples[0].get_children()[0]
+    old_id = group._node_id
+
+    queue_model.del_child(samples[0], group)
+    queue_model.add_child(samples[1], group)
+    check_index(queue_model)
+    assert group._node_id != old_id
+    assert queue_model.get_node(old_id) is None
+    assert queue_model.get_node(group._node_id) is group
+
+
+def test_subtree_and_copies(queue_model):
+    sample = add_sample(queue_model)
+
+    # a group built before being attached to the model
+    group = queue_model_objects.TaskGroup()
+    queue_model.add_child(group, queue_model_objects.TaskNode())
+    queue_model.add_child(sample, group)
+    check_index(queue_model)
+
+    # copies have the node ids of the original nodes
+    queue_model.add_child(sample, sample.get_children()[0].copy())
+    check_index(queue_model)
+
+
+def test_reload(queue_model):
+    add_sample(queue_model)
+    ispyb_root = queue_model.get_model_root()
+    queue_model.clear_model("ispyb")
+    assert queue_model.get_model_root() is not ispyb_root
+    check_index(queue_model)
+    assert queue_model.get_node(1) is None
+
+    add_sample(queue_model)
+    check_index(queue_model)
+
+    queue_model._selected_model = queue_model._models["plate"]
+    add_sample(queue_model, nb_groups=1)
+    check_index(queue_model)
+    queue_model.clear_model()
+    check_index(queue_model)
+    assert queue_model.get_model_root() is queue_model._models["plate"]
+
+
+def test_get_entry_with_model():
+    queue_manager = QueueManager("queue")
+    samples = [queue_model_objects.Sample() for _ in range(3)]
+    tasks = [queue_model_objects.TaskNode() for _ in range(3)]
+    sample_entries = [BaseQueueEntry(data_model=sample) for sample in samples]
+    task_entries = [BaseQueueEntry(data_model=task) for task in tasks]
+    for sample_entry, task_entry in zip(sample_entries, task_entries):
+        queue_manager.enqueue(sample_entry)
+        sample_entry.enqueue(task_entry)
+
+    for model, entry in zip(samples + tasks, sample_entries + task_entries):
+        assert queue_manager.get_entry_with_model(model) is entry
+
+    # entries added after the index was built
+    task = queue_model_objects.TaskNode()
+    task_entry = BaseQueueEntry(data_model=task)
+    sample_entries[0].enqueue(task_entry)
+    assert queue_manager.get_entry_with_model(task) is task_entry
+
+    sample_entries[0].dequeue(task_entry)
+    assert queue_manager.get_entry_with_model(task) is None
+    queue_manager.dequeue(sample_entries[1])
+    assert queue_manager.get_entry_with_model(tasks[1]) is None
+    assert queue_manager.get_entry_with_model(tasks[2]) is task_entries[2]
+
+    queue_manager.clear()
+    assert queue_manager.get_entry_with_model(samples[0]) is None
+
+
+def old_next_run_number(queue_model, new_path_template, exclude_current=True):
+    """get_next_run_number, comparing with every path template"""
+    run_numbers = [0]
+    for _, path_template in queue_model.get_path_templates():
+        if exclude_current and path_template is new_path_template:
+            continue
+        if path_template == new_path_template:
+            run_numbers.append(path_template.run_number)
+    return max(run_numbers) + 1
+
+
+def old_path_collisions(queue_model, new_path_template):
+    """check_for_path_collisions, comparing with every path template"""
+    return any(
+        new_path_template.intersection(path_template)
+        for _, path_template in queue_model.get_path_templates()
+        if path_template is not new_path_template
+    )
+
+
+def add_collection(queue_model, parent, rng):
+    collection = queue_model_objects.DataCollection()
+    path_template = collection.get_path_template()
+    path_template.directory = rng.choice(["/data/a", "/data/a/", "/data/b"])
+    path_template.base_prefix = rng.choice(["x", "y"])
+    path_template.run_number = rng.randint(1, 4)
+    path_template.start_num = rng.randint(1, 20)
+    path_template.num_files = rng.randint(0, 10)
+    queue_model.add_child(parent, collection)
+    return collection
+
+
+def check_path_templates(queue_model, rng):
+    probe = queue_model_objects.PathTemplate()
+    path_templates = [pt for _, pt in queue_model.get_path_templates()]
+    for path_template in path_templates + [probe] * 5:
+        if path_template is probe:
+            probe.directory = rng.choice(["/data/a", "/data/b", "/data/c"])
+            probe.base_prefix = rng.choice(["x", "y"])
+            probe.run_number = rng.randint(1, 5)
+            probe.start_num = rng.randint(1, 30)
+            probe.num_files = rng.randint(1, 10)
+        for exclude_current in (True, False):
+            assert queue_model.get_next_run_number(
+                path_template, exclude_current
+            ) == old_next_run_number(queue_model, path_template, exclude_current)
+        assert queue_model.check_for_path_collisions(
+            path_template
+        ) == old_path_collisions(queue_model, path_template)
+
+
+def test_path_template_index(queue_model):
+    rng = random.Random(0)
+    samples = [add_sample(queue_model, nb_groups=1, nb_tasks=0) for _ in range(4)]
+    groups = [sample.get_children()[0] for sample in samples]
+
+    for step in range(300):
+        collections = [node for _, node in queue_model.get_path_templates()]
+        action = rng.random()
+        if action < 0.4 or not collections:
+            add_collection(queue_model, rng.choice(groups), rng)
+        elif action < 0.6:
+            path_template = rng.choice(collections)
+            path_template.run_number = rng.randint(1, 4)
+            path_template.start_num = rng.randint(1, 20)
+            path_template.set_from_dict(
+                {"directory": rng.choice(["/data/a", "/data/b"])}
+            )
+        elif action < 0.75:
+            node = rng.choice(queue_model.get_path_templates())[0]
+            queue_model.del_child(node.get_parent(), node)
+        elif action < 0.85:
+            node = rng.choice(queue_model.get_path_templates())[0]
+            queue_model.del_child(node.get_parent(), node)
+            queue_model.add_child(rng.choice(groups), node)
+        elif action < 0.95:
+            node = rng.choice(queue_model.get_path_templates())[0]
+            queue_model.add_child(node.get_parent(), queue_model.copy_node(node))
+        else:
+            node = rng.choice(queue_model.get_path_templates())[0]
+            node.acquisitions[0].path_template = queue_model_objects.PathTemplate()
+            queue_model.update_path_template(node)
+        if step % 10 == 0:
+            check_path_templates(queue_model, rng)
+
+    check_path_templates(queue_model, rng)
+    index = queue_model.get_model_root()._path_templates
+    assert len(index) > 0
+    queue_model.clear_model()
+    assert len(index) == 0
+    assert index not in queue_model_objects.PathTemplateIndex.indexes.values()
+
+
+def test_path_template_index_benchmark(queue_model):
+    """Time get_next_run_number and check_for_path_collisions on a
+    queue of 500 samples, with one data collection each"""
+    rng = random.Random(0)
+    samples = [add_sample(queue_model, nb_groups=1, nb_tasks=0) for _ in range(500)]
+    collections = [
+        add_collection(queue_model, sample.get_children()[0], rng) for sample in samples
+    ]
+
+    times = {}
+    for name, next_run_number, path_collisions in (
+        (
+            "index",
+            queue_model.get_next_run_number,
+            queue_model.check_for_path_collisions,
+        ),
+        (
+            "tree walk",
+            functools.partial(old_next_run_number, queue_model),
+            functools.partial(old_path_collisions, queue_model),
+        ),
+    ):
+        start = time.perf_counter()
+        for collection in collections:
+            path_template = collection.get_path_template()
+            next_run_number(path_template)
+            path_collisions(path_template)
+        times[name] = time.perf_counter() - start
+
+    logging.getLogger("HWR").info(
+        "Run numbers and path collisions of 500 collections: "
+        "%.3f s with index, %.3f s walking the tree",
+        times["index"],
+        times["tree walk"],
+    )
+
+
+def image_file_name(path_template, suffix=None):
+    """AbstractDetector.get_image_file_name"""
+    return "%s_%s_%%05d.%s" % (
+        path_template.get_prefix(),
+        path_template.run_number,
+        suffix or path_template.suffix,
+    )
+
+
+def test_files_to_be_written(queue_model):
+    HWR.beamline.detector.get_image_file_name.side_effect = image_file_name
+    path_template = queue_model_objects.PathTemplate()
+    path_template.directory = "/data/a"
+    path_template.base_prefix = "x"
+    path_template.run_number = 2
+    path_template.start_num = 5
+    path_template.num_files = 100000
+
+    files = path_template.get_file_sequence()
+    assert len(files) == 100000
+    assert files[0] == "/data/a/x_2_00005.h5"
+    assert files[-1] == "/data/a/x_2_100004.h5"
+    assert list(files[10:13]) == [
+        "/data/a/x_2_00015.h5",
+        "/data/a/x_2_00016.h5",
+        "/data/a/x_2_00017.h5",
+    ]
+    assert files[10:13] == list(files)[10:13]
+    assert "/data/a/x_2_00005.h5" in files
+    assert "/data/a/./x_2_50000.h5" in files
+    assert files.index("/data/a/x_2_00105.h5") == 100
+    for path in (
+        "/data/a/x_2_00004.h5",
+        "/data/a/x_2_100005.h5",
+        "/data/a/x_2_0005.h5",
+        "/data/a/x_2_005.h5",
+        "/data/a/x_2_000005.h5",
+        "/data/a/x_3_00005.h5",
+        "/data/b/x_2_00005.h5",
+        "/data/a/x_2_00005.cbf",
+        "/data/a/x_2_+0005.h5",
+        None,
+    ):
+        assert path not in files
+
+    path_template.num_files = 3
+    expected = [
+        "/data/a/x_2_00005.h5",
+        "/data/a/x_2_00006.h5",
+        "/data/a/x_2_00007.h5",
+    ]
+    assert path_template.get_file_sequence() == expected
+    assert path_template.get_files_to_be_written() == expected
+    assert isinstance(path_template.get_files_to_be_written(), list)
+
+
+def test_intersection_and_is_part_of():
+    """Compare with the image files of the templates"""
+    rng = random.Random(0)
+    path_templates = []
+    for _ in range(60):
+        path_template = queue_model_objects.PathTemplate()
+        path_template.directory = rng.choice(["/data/a", "/data/a/", "/data/b"])
+        path_template.base_prefix = rng.choice(["x", "y"])
+        path_template.run_number = rng.randint(1, 2)
+        path_template.start_num = rng.randint(1, 10)
+        path_template.num_files = rng.randint(0, 6)
+        path_templates.append(path_template)
+
+    def image_files(path_template):
+        return set(
+            (path_template.get_prefix(), path_template.run_number, number)
+            for number in range(
+                path_template.start_num,
+                path_template.start_num + path_template.num_files,
+            )
+        )
+
+    for lh_pt in path_templates:
+        for rh_pt in path_templates:
+            if not lh_pt.num_files or not rh_pt.num_files:
+                continue
+            same_dir = lh_pt.directory.rstrip("/") == rh_pt.directory.rstrip("/")
+            lh_files = image_files(lh_pt) if same_dir else set()
+            rh_files = image_files(rh_pt)
+            assert lh_pt.intersection(rh_pt) == bool(lh_files & rh_files)
+            assert lh_pt.is_part_of(rh_pt) == (bool(lh_files) and rh_files <= lh_files)
+
+
+def model_state(obj):
+    """Attributes of the model objects, recursively"""
+    if hasattr(obj, "__getstate__") and type(obj).__module__ == (
+        queue_model_objects.__name__
+    ):
+        state = obj.__getstate__()
+        if isinstance(state, dict):
+            return (type(obj), {k: model_state(v) for k, v in state.items()})
+    if isinstance(obj, (list, tuple)):
+        return [model_state(item) for item in obj]
+    if isinstance(obj, dict):
+        return {k: model_state(v) for k, v in obj.items()}
+    return obj
+
+
+def test_model_object_copies(queue_model):
+    queue_model_objects.CentredPosition.set_diffractometer_motor_names("phi", "kappa")
+    collection = queue_model_objects.DataCollection()
+    collection.grid_id = 3
+    collection.extra = [1, 2]
+    acq = collection.acquisitions[0]
+    acq.path_template.base_prefix = "x"
+    acq.path_template.precision = "05"
+    acq.acquisition_parameters.mesh_range = [1, 2]
+    acq.acquisition_parameters.centred_position = queue_model_objects.CentredPosition(
+        {"phi": 1.5, "kappa": 2.0}
+    )
+    # slots, not instance dictionary entries
+    assert "acquisitions" not in vars(collection)
+
+    for clone in (
+        collection.copy(),
+        copy.deepcopy(collection),
+        pickle.loads(pickle.dumps(collection)),
+    ):
+        assert model_state(clone) == model_state(collection)
+        clone_acq = clone.acquisitions[0]
+        assert clone_acq is not acq
+        assert clone_acq.acquisition_parameters is not acq.acquisition_parameters
+        assert clone_acq.path_template is not acq.path_template
+        assert clone.extra is not collection.extra
+        assert clone_acq.acquisition_parameters.mesh_range == [1, 2]
+        assert clone_acq.acquisition_parameters.mesh_range is not (
+            acq.acquisition_parameters.mesh_range
+        )
+        clone_acq.acquisition_parameters.centred_position.phi = 0
+        assert acq.acquisition_parameters.centred_position.phi == 1.5
+
+    # a copy of an indexed template is not indexed
+    group = add_sample(queue_model, nb_groups=1, nb_tasks=0).get_children()[0]
+    queue_model.add_child(group, collection)
+    path_template = acq.path_template.copy()
+    assert model_state(path_template) == model_state(acq.path_template)
+    path_template.run_number = 5
+    assert queue_model.get_next_run_number(path_template) == 1
+
+
+def test_model_objects_benchmark():
+    """Memory and construction time of 10000 data collections"""
+    tracemalloc.start()
+    try:
+        collections = [queue_model_objects.DataCollection() for _ in range(10000)]
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    start = time.perf_counter()
+    collections = [queue_model_objects.DataCollection() for _ in range(10000)]
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clones = [collection.acquisitions[0].copy() for collection in collections]
+    clone_time = time.perf_counter() - start
+    assert len(clones) == len(collections)
+
+    logging.getLogger("HWR").info(
+        "10000 data collections: %.1f MB, built in %.3f s, "
+        "acquisitions copied in %.3f s",
+        memory / 1e6,
+        build_time,
+        clone_time,
+    )
+
+
+def apply_changes(nodes, changes):
+    """Client side of the change feed, nodes by node id"""
+    if "nodes" in changes:
+        nodes.clear()
+        nodes.update((node["id"], copy.deepcopy(node)) for node in changes["nodes"])
+        return
+
+    for patch in changes["patches"]:
+        if patch["op"] == "add":
+            nodes[patch["id"]] = copy.deepcopy(patch["node"])
+        elif patch["op"] == "remove":
+            removed = {patch["id"]}
+            for node in list(nodes.values()):
+                if node["parent"] in removed or node["id"] in removed:
+                    removed.add(node["id"])
+                    del nodes[node["id"]]
+        elif patch["op"] == "status":
+            nodes[patch["id"]]["status"].update(patch["status"])
+        elif patch["op"] == "params":
+            nodes[patch["id"]]["params"].update(patch["params"])
+            if "name" in patch:
+                nodes[patch["id"]]["name"] = patch["name"]
+        elif patch["op"] == "reset":
+            nodes.clear()
+
+
+def check_changes(queue_model, nodes, version):
+    """Applies the changes since <version>, returns the new version"""
+    changes = queue_model.get_queue_changes(version)
+    apply_changes(nodes, changes)
+    snapshot = queue_model.get_queue_snapshot()
+    assert changes["version"] == snapshot["version"]
+    assert nodes == {node["id"]: node for node in snapshot["nodes"]}
+    assert set(nodes) == set(
+        root_node._node_id for root_node in all_nodes(queue_model.get_model_root())
+    )
+    return changes["version"]
+
+
+def test_queue_changes(queue_model):
+    patches = []
+
+    def queue_changed(patch):
+        patches.append(patch)
+
+    queue_model.connect("queue_changed", queue_changed)
+    nodes = {}
+    samples = [add_sample(queue_model) for _ in range(2)]
+    version = check_changes(queue_model, nodes, 0)
+    assert len(patches) == version == 2 * 9
+    assert [patch["version"] for patch in patches] == list(range(1, version + 1))
+
+    group = samples[0].get_children()[0]
+    collection = queue_model_objects.DataCollection()
+    queue_model.add_child(group, collection)
+    version = check_changes(queue_model, nodes, version)
+    assert nodes[collection._node_id]["params"]["exp_time"] == (
+        collection.acquisitions[0].acquisition_parameters.exp_time
+    )
+
+    # status and parameter patches hold the changed values only
+    collection.set_running(True)
+    queue_model.node_changed(collection, "RUNNING")
+    assert patches[-1] == {
+        "op": "status",
+        "id": collection._node_id,
+        "status": {"running": True, "state": "RUNNING"},
+        "version": version + 1,
+    }
+    collection.acquisitions[0].acquisition_parameters.exp_time = 0.25
+    queue_model.refresh_queue_changes()
+    assert patches[-1]["params"] == {"exp_time": 0.25}
+    version = check_changes(queue_model, nodes, version)
+    queue_model.refresh_queue_changes()
+    assert queue_model.get_queue_changes(version)["patches"] == []
+
+    # removed and moved nodes
+    queue_model.del_child(samples[1], samples[1].get_children()[1])
+    queue_model.add_child(samples[1], group)
+    version = check_changes(queue_model, nodes, version)
+
+    # a new model needs a new snapshot
+    queue_model.select_model("plate")
+    assert "nodes" in queue_model.get_queue_changes(version)
+    version = check_changes(queue_model, nodes, version)
+    assert nodes == {}
+    add_sample(queue_model, nb_groups=1)
+    queue_model.clear_model()
+    assert "nodes" in queue_model.get_queue_changes(version)
+    check_changes(queue_model, nodes, version)
+
+
+def test_queue_changes_overflow(queue_model):
+    queue_model._change_feed = queue_change_feed.QueueChangeFeed(size=5)
+    add_sample(queue_model)
+    assert len(queue_model.get_queue_changes(3)["nodes"]) == 9
+    assert len(queue_model.get_queue_changes(4)["patches"]) == 5
+    assert queue_model.get_queue_changes(9)["patches"] == []
+
+
+def old_create_interleave_sw(interleave_list, num_images, sw_size):
+    """create_interleave_sw before SubwedgePlan, for comparison"""
+    subwedges = []
+    for sw_index in range(int(num_images / sw_size)):
+        for collection_index, item in enumerate(interleave_list):
+            parameters = item["data_model"].acquisitions[0].acquisition_parameters
+            collection_num_images = parameters.num_images
+            if sw_index * sw_size <= collection_num_images:
+                sw_actual_size = sw_size
+                if sw_size > collection_num_images - (sw_index + 1) * sw_size > 0:
+                    sw_actual_size = collection_num_images % sw_size
+                subwedges.append(
+                    {
+                        "collect_index": collection_index,
+                        "collect_first_image": parameters.first_image,
+                        "collect_num_images": collection_num_images,
+                        "sw_index": sw_index,
+                        "sw_first_image": parameters.first_image + sw_index * sw_size,
+                        "sw_actual_size": sw_actual_size,
+                        "sw_osc_start": parameters.osc_start
+                        + parameters.osc_range * sw_index * sw_size,
+                        "sw_osc_range": parameters.osc_range * sw_actual_size,
+                    }
+                )
+    return subwedges
+
+
+def make_interleave_list(rng, nb_collections, num_images):
+    interleave_list = []
+    for _ in range(nb_collections):
+        collection = queue_model_objects.DataCollection()
+        parameters = collection.acquisitions[0].acquisition_parameters
+        parameters.first_image = rng.randint(1, 10)
+        parameters.num_images = rng.randint(num_images // 2, num_images)
+        parameters.osc_start = rng.uniform(-180, 180)
+        parameters.osc_range = rng.choice((0.1, 0.25, 1))
+        interleave_list.append({"data_model": collection})
+    return interleave_list
+
+
+def test_create_interleave_sw():
+    rng = random.Random(20)
+    for _ in range(50):
+        interleave_list = make_interleave_list(rng, rng.randint(0, 4), 100)
+        num_images = (
+            interleave_list[0]["data_model"]
+            .acquisitions[0]
+            .acquisition_parameters.num_images
+            if interleave_list
+            else 100
+        )
+        sw_size = rng.randint(1, 30)
+        expected = old_create_interleave_sw(interleave_list, num_images, sw_size)
+        plan = queue_model_objects.create_interleave_sw(
+            interleave_list, num_images, sw_size
+        )
+        assert len(plan) == len(expected)
+        assert list(plan) == expected
+        assert plan[1:3] == expected[1:3]
+        if expected:
+            assert plan[-1] == expected[-1]
+
+    assert queue_model_objects.create_subwedges(10, 3, 0.5, 10) == [
+        (1, 3, 10),
+        (4, 3, 11.5),
+        (7, 3, 13),
+    ]
+    assert queue_model_objects.create_inverse_beam_sw(4, 2, 1, 0, 1) == [
+        (1, 2, 0, 1),
+        (1, 2, 180, 2),
+        (3, 2, 2, 1),
+        (3, 2, 182, 2),
+    ]
+
+
+def test_create_interleave_sw_benchmark():
+    """Planning time of 4 interleaved collections of 3600 images"""
+    interleave_list = make_interleave_list(random.Random(4), 4, 3600)
+    num_images = 3600
+    start = time.perf_counter()
+    expected = old_create_interleave_sw(interleave_list, num_images, 1)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    plan = queue_model_objects.create_interleave_sw(interleave_list, num_images, 1)
+    plan_time = time.perf_counter() - start
+    assert len(plan) == len(expected)
+
+    logging.getLogger("HWR").info(
+        "%d subwedges planned in %.4f s, %.4f s with the loop",
+        len(plan),
+        plan_time,
+        old_time,
+    )
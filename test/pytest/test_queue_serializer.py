@@ -0,0 +1,411 @@
+"""Test the queue model serializer"""
+
+import importlib
+import logging
+import sys
+import time
+import types
+
+import jsonpickle
+import numpy
+import pytest
+
+from mxcubecore import HardwareRepository as HWR
+from mxcubecore.HardwareObjects.QueueModel import QueueModel
+from mxcubecore.model import queue_model_objects as qmo
+from mxcubecore.model import queue_serializer
+
+
+@pytest.fixture(autouse=True)
+def beamline(mocker):
+    """The display names of the nodes use the beamline session"""
+    mocker.patch.object(HWR, "beamline")
+    HWR.beamline.session.get_default_prefix.return_value = "prefix"
+
+
+def make_queue(nb_samples=2, nb_groups=2):
+    """Root with samples, holding task groups of various tasks"""
+    queue_model = QueueModel("queue-model")
+    root = queue_model.get_model_root()
+    crystal = qmo.Crystal()
+    for i in range(nb_samples):
+        sample = qmo.Sample()
+        sample.location = (1, i + 1)
+        sample.crystals = [crystal]
+        queue_model.add_child(root, sample)
+        for _ in range(nb_groups):
+            group = qmo.TaskGroup()
+            queue_model.add_child(sample, group)
+            collection = qmo.DataCollection(crystal=crystal)
+            path_template = collection.get_path_template()
+            path_template.directory = "/data/sample%d" % i
+            path_template.base_prefix = "prefix"
+            path_template.num_files = 100
+            cpos = qmo.CentredPosition({"phi": 1.5, "sampx": -0.25})
+            cpos.snapshot_image = b"\x89PNG\x00\xff"
+            collection.acquisitions[0].acquisition_parameters.centred_position = cpos
+            queue_model.add_child(group, collection)
+            queue_model.add_child(group, qmo.Characterisation())
+            queue_model.add_child(group, qmo.EnergyScan(sample=sample))
+            queue_model.add_child(group, qmo.XRFSpectrum())
+            queue_model.add_child(group, qmo.SampleCentring(name="centring"))
+    return queue_model, root
+
+
+@pytest.mark.parametrize("codec", [queue_serializer.CODEC_JSON, None])
+def test_round_trip(codec):
+    _, root = make_queue()
+    sample = root.get_children()[0]
+    group = sample.get_children()[0]
+
+    loaded = queue_serializer.loads(
+        queue_serializer.dumps([(sample.location, group)], codec)
+    )
+    ((location, loaded_group),) = loaded
+    assert location == (1, 1)
+    assert queue_serializer.to_data(loaded_group) == queue_serializer.to_data(group)
+
+    # parents are restored from the children, not saved
+    assert loaded_group.get_parent() is None
+    for child in loaded_group.get_children():
+        assert child.get_parent() is loaded_group
+
+    # shared objects stay shared
+    collection = loaded_group.get_children()[0]
+    assert (
+        collection.crystal
+        is collection.get_parent().get_children()[2].sample.crystals[0]
+    )
+    cpos = collection.acquisitions[0].acquisition_parameters.centred_position
+    assert cpos.phi == 1.5
+    assert cpos.snapshot_image == b"\x89PNG\x00\xff"
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    _, root = make_queue(1, 1)
+    data = queue_serializer.dumps(
+        root.get_children()[0], queue_serializer.CODEC_MSGPACK
+    )
+    loaded = queue_serializer.loads(data)
+    assert queue_serializer.to_data(loaded) == queue_serializer.to_data(
+        root.get_children()[0]
+    )
+
+
+def test_load_is_restricted_to_schema():
+    data = queue_serializer.to_data(qmo.TaskGroup(), binary=False)
+    data[1][0][0] = "Popen"
+    with pytest.raises(ValueError):
+        queue_serializer.from_data(data)
+    with pytest.raises(ValueError):
+        queue_serializer.loads(b"(1, __import__('os'))")
+
+
+def test_missing_attributes_get_defaults():
+    data = queue_serializer.to_data(qmo.PathTemplate())
+    # remove the suffix attribute, as in data saved by earlier versions
+    layout, value = data[1][0], data[2]
+    index = layout.index("suffix")
+    del layout[index]
+    del value[index + 2]
+    path_template = queue_serializer.from_data(data)
+    assert path_template.suffix == "h5"
+
+
+def test_numpy_and_unknown_values():
+    value = {"a": numpy.int64(5), "b": numpy.float32(0.5), "c": numpy.bool_(True)}
+    loaded = queue_serializer.loads(queue_serializer.dumps(value))
+    assert loaded == {"a": 5, "b": 0.5, "c": True}
+    assert type(loaded["a"]) is int
+
+    group = qmo.TaskGroup()
+    group.interleave_num_images = object()
+    with pytest.raises(TypeError):
+        queue_serializer.dumps(group)
+
+
+class SiteCollection(qmo.DataCollection):
+    """Data collection subclass defined outside of queue_model_objects"""
+
+    def __init__(self):
+        qmo.DataCollection.__init__(self)
+        self.site_parameter = 2.5
+
+
+def test_subclasses_and_gphl_messages():
+    from mxcubecore.HardwareObjects.Gphl import GphlMessages
+
+    group = qmo.TaskGroup()
+    collection = SiteCollection()
+    # as held by the GPhL workflow nodes
+    collection.wavelengths = (GphlMessages.PhasingWavelength(wavelength=0.98),)
+    group._children = [collection]
+
+    data = queue_serializer.to_data(group)
+    assert SiteCollection.__module__ + ".SiteCollection" in [
+        layout[0] for layout in data[1]
+    ]
+    loaded = queue_serializer.loads(queue_serializer.dumps(group))
+    (loaded_collection,) = loaded.get_children()
+    assert type(loaded_collection) is SiteCollection
+    assert loaded_collection.site_parameter == 2.5
+    (wavelength,) = loaded_collection.wavelengths
+    assert type(wavelength) is GphlMessages.PhasingWavelength
+    assert wavelength.wavelength == 0.98
+    assert wavelength.id_ == collection.wavelengths[0].id_
+
+
+def test_incremental_dumper():
+    _, root = make_queue()
+    groups = {
+        str(group._node_id): group
+        for sample in root.get_children()
+        for group in sample.get_children()
+    }
+    dumper = queue_serializer.IncrementalDumper()
+    assert dumper.is_reset()
+    changed, removed = dumper.dump(groups)
+    assert set(changed) == set(groups) and removed == []
+
+    changed, removed = dumper.dump(groups)
+    assert changed == {} and removed == []
+
+    # only the items marked dirty are serialized again
+    key, group = next(iter(groups.items()))
+    group.get_children()[0].get_path_template().run_number = 7
+    changed, removed = dumper.dump(groups)
+    assert changed == {}
+    dumper.mark_dirty(key)
+    other_key = list(groups)[-1]
+    dumper.mark_dirty(other_key)
+    del groups[other_key]
+    changed, removed = dumper.dump(groups)
+    assert list(changed) == [key] and removed == [other_key]
+
+    # dirty items that did not change are not saved
+    dumper.mark_dirty(key)
+    assert dumper.dump(groups) == ({}, [])
+
+
+def test_save_and_load_queue_file(mocker, tmp_path):
+    queue_model, root = make_queue()
+    mocker.patch.object(queue_model, "get_queue_items").return_value = (
+        "ispyb",
+        [(sample.location, sample.get_children()[0]) for sample in root.get_children()],
+    )
+    filename = str(tmp_path / "queue_active.dat")
+    queue_model.save_queue(filename)
+
+    loaded = []
+    mocker.patch.object(queue_model, "select_model")
+    mocker.patch.object(
+        queue_model,
+        "load_queue_items",
+        side_effect=lambda items, _: loaded.extend(items),
+    )
+    assert queue_model.load_queue_from_file(filename) == "ispyb"
+    assert [location for location, _ in loaded] == [(1, 1), (1, 2)]
+    assert queue_serializer.to_data(loaded[1][1]) == queue_serializer.to_data(
+        root.get_children()[1].get_children()[0]
+    )
+
+
+def test_load_legacy_queue_file(mocker, tmp_path):
+    """Queue files saved with jsonpickle by earlier versions"""
+    queue_model, root = make_queue(1, 1)
+    group = root.get_children()[0].get_children()[0]
+    filename = tmp_path / "queue_active.dat"
+    filename.write_text(
+        repr(
+            (
+                "ispyb",
+                [
+                    {
+                        "sample_location": (1, 1),
+                        "task_group_entry": jsonpickle.encode(group),
+                    }
+                ],
+            )
+        )
+    )
+
+    loaded = []
+    mocker.patch.object(queue_model, "select_model")
+    mocker.patch.object(
+        queue_model,
+        "load_queue_items",
+        side_effect=lambda items, _: loaded.extend(items),
+    )
+    assert queue_model.load_queue_from_file(str(filename)) == "ispyb"
+    ((location, loaded_group),) = loaded
+    assert location == (1, 1)
+    assert isinstance(loaded_group, qmo.TaskGroup)
+    assert [child.__class__ for child in loaded_group.get_children()] == [
+        child.__class__ for child in group.get_children()
+    ]
+
+
+class FakeRedis:
+    """In memory Redis, recording the hash fields written"""
+
+    def __init__(self):
+        self.data = {}
+        self.written = []
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def hset(self, key, mapping):
+        self.written.extend(mapping)
+        self.data.setdefault(key, {}).update(mapping)
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+    def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        for name, args, kwargs in self.calls:
+            getattr(self.client, name)(*args, **kwargs)
+
+
+@pytest.fixture
+def redis_client(mocker):
+    # the redis package is not needed with FakeRedis
+    mocker.patch.dict(sys.modules, {"redis": types.ModuleType("redis")})
+    sys.modules.pop("mxcubecore.HardwareObjects.RedisClient", None)
+    module = importlib.import_module("mxcubecore.HardwareObjects.RedisClient")
+    client = module.RedisClient("redis")
+    client.redis_client = FakeRedis()
+    client.active = True
+    client.proposal_id = 1
+    client.beamline_name = "bl"
+    return client
+
+
+def test_redis_save_and_load_queue(mocker, redis_client):
+    queue_model, root = make_queue()
+    HWR.beamline.queue_model = queue_model
+    redis_client.connect(queue_model, "queue_changed", redis_client.queue_changed)
+    groups = [
+        group for sample in root.get_children() for group in sample.get_children()
+    ]
+    mocker.patch.object(queue_model, "get_queue_items").return_value = (
+        "ispyb",
+        [(group.get_parent().location, group) for group in groups],
+    )
+    redis = redis_client.redis_client
+
+    redis_client.save_queue_task()
+    assert len(redis.written) == len(groups)
+    redis.written = []
+    redis_client.save_queue_task()
+    assert redis.written == []
+
+    # changes notified to the queue model only
+    queue_model.add_child(groups[1], qmo.XRFSpectrum())
+    collection = groups[2].get_children()[0]
+    collection.get_path_template().run_number = 7
+    groups[3].get_children()[0].get_path_template().run_number = 8
+    queue_model.node_changed(collection)
+    refresh = mocker.spy(queue_model, "refresh_queue_changes")
+    redis_client.save_queue_task()
+    refresh.assert_not_called()
+    assert sorted(redis.written) == sorted(
+        [str(groups[1]._node_id), str(groups[2]._node_id)]
+    )
+
+    loaded = []
+    mocker.patch.object(queue_model, "select_model")
+    mocker.patch.object(
+        queue_model,
+        "load_queue_items",
+        side_effect=lambda items, snapshot: loaded.extend(items),
+    )
+    # missing task groups are skipped
+    del redis.data["mxcube:1:bl:queue_items"][str(groups[0]._node_id)]
+    assert redis_client.load_queue() == "ispyb"
+    assert [group._node_id for _, group in loaded] == [
+        group._node_id for group in groups[1:]
+    ]
+    assert len(loaded[0][1].get_children()) == 6
+    assert loaded[1][1].get_children()[0].get_path_template().run_number == 7
+
+
+def test_redis_save_error(mocker, caplog, redis_client):
+    queue_model, root = make_queue(1, 2)
+    HWR.beamline.queue_model = queue_model
+    groups = root.get_children()[0].get_children()
+    mocker.patch.object(queue_model, "get_queue_items").return_value = (
+        "ispyb",
+        [(group.get_parent().location, group) for group in groups],
+    )
+    redis = redis_client.redis_client
+    redis_client.save_queue_task()
+
+    # the error is logged, and the next save writes everything
+    groups[0].interleave_num_images = object()
+    redis_client.queue_changed({"op": "params", "id": groups[0]._node_id})
+    redis.written = []
+    with caplog.at_level(logging.ERROR, logger="HWR"):
+        redis_client.save_queue_task()
+    assert "Could not save queue" in caplog.text
+    assert redis.written == []
+    assert redis_client.queue_dumper.is_reset()
+
+    groups[0].interleave_num_images = 0
+    redis_client.save_queue_task()
+    assert sorted(redis.written) == sorted(str(group._node_id) for group in groups)
+
+
+def test_serializer_benchmark():
+    """Save and load a queue of 1000 nodes"""
+    _, root = make_queue(nb_samples=42, nb_groups=4)
+    items = [
+        (sample.location, group)
+        for sample in root.get_children()
+        for group in sample.get_children()
+    ]
+    nb_nodes = sum(1 + len(group.get_children()) for _, group in items)
+    assert nb_nodes >= 1000
+
+    start = time.perf_counter()
+    data = queue_serializer.dumps(items)
+    loaded = queue_serializer.loads(data)
+    serializer_time = time.perf_counter() - start
+    assert len(loaded) == len(items)
+
+    start = time.perf_counter()
+    pickled = jsonpickle.encode(items)
+    jsonpickle.decode(pickled)
+    jsonpickle_time = time.perf_counter() - start
+
+    logging.getLogger("HWR").info(
+        "Queue of %d nodes: %d bytes in %.3f s, jsonpickle %d bytes in %.3f s",
+        nb_nodes,
+        len(data),
+        serializer_time,
+        len(pickled),
+        jsonpickle_time,
+    )
@@ -0,0 +1,269 @@
+"""Test the loop detection of the automatic centring"""
+
+import numpy
+import pytest
+from PIL import Image
+
+from mxcubecore.HardwareObjects import sample_centring
+
+
+def make_frame(tip=(200, 120), width=640, height=480):
+    """Frame with a pin coming from the right and a loop at <tip>"""
+    frame = numpy.full((height, width), 200, dtype=numpy.uint8)
+    x, y = tip
+    # pin
+    frame[y - 3 : y + 4, x + 30 :] = 40
+    # loop, a ring of radius 30 left of the pin
+    rows, columns = numpy.ogrid[:height, :width]
+    distance = numpy.hypot(columns - (x + 30), rows - y)
+    frame[(distance > 26) & (distance < 31)] = 40
+    return frame
+
+
+@pytest.fixture
+def loop_detector():
+    yield
+    sample_centring.set_loop_detector(None)
+
+
+def test_numpy_loop_detector():
+    detector = sample_centring.NumpyLoopDetector()
+    info, x, y = detector.find_loop(make_frame())
+    assert info == "Coord"
+    assert 200 <= x < 200 + detector.loop_depth
+    assert y == pytest.approx(120, abs=2)
+
+    # pin coming from the bottom, rotated clockwise
+    info, x, y = detector.find_loop(make_frame().T.copy(), rotation=-90)
+    assert 200 <= y < 200 + detector.loop_depth
+    assert x == pytest.approx(120, abs=2)
+
+    # no loop, noise only
+    noise = numpy.random.default_rng(0).normal(200, 2, (480, 640))
+    assert detector.find_loop(noise) == ("No loop detected", -1, -1)
+
+
+def test_find_loop_in_memory(mocker, loop_detector):
+    frame = numpy.stack([make_frame()] * 3, axis=-1)
+    sample_view = mocker.Mock()
+    sample_view.get_snapshot.return_value = frame
+    detector = mocker.Mock()
+    detector.find_loop.return_value = ("Coord", 210, 120)
+    sample_centring.set_loop_detector(detector)
+    new_point_cb = mocker.Mock()
+
+    assert sample_centring.find_loop(sample_view, 1000, 0, None, new_point_cb) == (
+        210,
+        120,
+    )
+    sample_view.save_snapshot.assert_not_called()
+    new_point_cb.assert_called_once_with((210.0, 120.0))
+    image = detector.find_loop.call_args[0][0]
+    assert image.shape == (480, 640)
+    assert image.dtype == numpy.uint8
+    assert image[0, 0] == 200
+    assert detector.find_loop.call_args[1] == {"rotation": None}
+
+    # chi angle in the reference frame of the detector
+    sample_centring.find_loop(sample_view, 1000, 30, None, None)
+    assert detector.find_loop.call_args[1] == {"rotation": -30}
+
+    detector.find_loop.return_value = ("No loop detected", None, None)
+    assert sample_centring.find_loop(sample_view, 1000, 0, None, None) == (-1, -1)
+
+    # detector errors are misses
+    detector.find_loop.side_effect = RuntimeError("detection failed")
+    assert sample_centring.detect_loop(image, 0) == (None, -1, -1)
+    assert sample_centring.find_loop(sample_view, 1000, 0, None, None) == (-1, -1)
+
+
+def test_find_loop_from_file(mocker, loop_detector):
+    """Sample views without array snapshots"""
+
+    def save_snapshot(path, overlay=None, bw=False):
+        Image.fromarray(make_frame()).save(path)
+
+    sample_view = mocker.Mock(spec=["save_snapshot"])
+    sample_view.save_snapshot.side_effect = save_snapshot
+    sample_centring.set_loop_detector(sample_centring.NumpyLoopDetector())
+
+    x, y = sample_centring.find_loop(sample_view, 1000, 0, None, None)
+    assert 200 <= x < 240
+    assert y == pytest.approx(120, abs=2)
+
+
+def test_default_loop_detector(mocker, loop_detector):
+    mocker.patch.object(sample_centring, "lucid", None)
+    # automatic centring is disabled without lucid
+    assert sample_centring.get_loop_detector() is None
+    with pytest.raises(RuntimeError):
+        sample_centring.start_auto(mocker.Mock(), {}, 1000, 1000, 320, 240)
+
+    sample_centring.set_loop_detector("numpy")
+    assert isinstance(
+        sample_centring.get_loop_detector(), sample_centring.NumpyLoopDetector
+    )
+
+    sample_centring.set_loop_detector(None)
+    mocker.patch.object(sample_centring, "lucid")
+    assert isinstance(
+        sample_centring.get_loop_detector(), sample_centring.LucidLoopDetector
+    )
+
+
+def test_multi_point_centre():
+    from scipy import optimize
+
+    rng = numpy.random.default_rng(0)
+    phis = numpy.radians(numpy.arange(0, 360, 30))
+    z = 0.2 * numpy.sin(phis + 0.7) + 0.05 + rng.normal(0, 0.001, phis.size)
+
+    def errfunc(p, x, y):
+        return p[0] * numpy.sin(x + p[1]) + p[2] - y
+
+    r, a, offset = optimize.leastsq(errfunc, [1.0, 0.0, 0.0], args=(phis, z))[0]
+    expected = [r * numpy.cos(a), r * numpy.sin(a), offset]
+    r, a, offset = sample_centring.multiPointCentre(z, phis)
+    assert [r * numpy.cos(a), r * numpy.sin(a), offset] == pytest.approx(expected)
+
+    # the incremental fit matches the fit of the points so far
+    fit = sample_centring.SinusoidFit()
+    for index in range(phis.size):
+        fit.add_point(z[index], phis[index])
+        if index >= 2:
+            assert fit.get_result() == pytest.approx(
+                sample_centring.multiPointCentre(z[: index + 1], phis[: index + 1])
+            )
+
+
+class FakeMotor:
+    """Motor reaching its position at once, recording the moves in <events>"""
+
+    def __init__(self, events, name, value=0.0):
+        self.events = events
+        self.name = name
+        self.value = value
+
+    def get_value(self):
+        return self.value
+
+    def set_value(self, value, timeout=0):
+        self.events.append(("move", self.name))
+        self.value = value
+
+    def set_value_relative(self, relative_value, timeout=0):
+        self.set_value(self.value + relative_value, timeout)
+
+    def is_ready(self):
+        return True
+
+    def wait_ready(self, timeout=None):
+        self.events.append(("wait", self.name))
+
+
+class FakeLoopDetector(sample_centring.LoopDetector):
+    """Loop off the rotation axis, frames hold the phi angle"""
+
+    def __init__(self, events, missed_angles=()):
+        self.events = events
+        # angles where the loop is not found, once
+        self.missed_angles = list(missed_angles)
+
+    def find_loop(self, image, rotation=None):
+        self.events.append(("detect", float(image[0, 0])))
+        if float(image[0, 0]) in self.missed_angles:
+            self.missed_angles.remove(float(image[0, 0]))
+            return "No loop", None, None
+        phi = numpy.radians(image[0, 0])
+        return "Coord", 320 + 20, 240 + 1000 * 0.1 * numpy.sin(phi + 0.3)
+
+
+def start_auto(mocker, events, n_points, pipelined, missed_angles=()):
+    """Starts the automatic centring of a loop off the rotation axis"""
+    motors = {
+        name: FakeMotor(events, name)
+        for name in ("phi", "phiy", "phiz", "sampx", "sampy")
+    }
+    centring_motors = {
+        name: sample_centring.CentringMotor(motor) for name, motor in motors.items()
+    }
+    sample_view = mocker.Mock()
+    sample_view.camera.get_width.return_value = 640
+    sample_view.camera.get_height.return_value = 480
+    sample_view.get_snapshot.side_effect = lambda **kwargs: numpy.full(
+        (4, 4), motors["phi"].value
+    )
+    sample_centring.set_loop_detector(FakeLoopDetector(events, missed_angles))
+
+    centring = sample_centring.start_auto(
+        sample_view,
+        centring_motors,
+        1000,
+        1000,
+        320,
+        240,
+        n_points=n_points,
+        pipelined=pipelined,
+    )
+    return centring, motors, sample_view
+
+
+def assert_centred(motors):
+    assert motors["phi"].value == 0
+    assert motors["sampx"].value == pytest.approx(0.1 * numpy.cos(0.3))
+    assert motors["sampy"].value == pytest.approx(0.1 * numpy.sin(0.3))
+    assert motors["phiy"].value == pytest.approx(0.02)
+    assert motors["phiz"].value == pytest.approx(0)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_auto_center(mocker, loop_detector, pipelined):
+    events = []
+    centring, motors, _ = start_auto(mocker, events, 4, pipelined)
+    centring.get(timeout=5)
+
+    assert motors["phi"].value == 0
+    assert motors["sampx"].value == pytest.approx(0.1 * numpy.cos(0.3))
+    assert motors["sampy"].value == pytest.approx(0.1 * numpy.sin(0.3))
+    assert motors["phiy"].value == pytest.approx(0.02)
+    assert motors["phiz"].value == pytest.approx(0)
+
+    if pipelined:
+        # the loop is found while phi moves to the next angle
+        phi_events = [event for event in events if event[1] != "sampx"][1:7]
+        assert phi_events == [
+            ("move", "phi"),
+            ("detect", 0.0),
+            ("wait", "phi"),
+            ("move", "phi"),
+            ("detect", 60.0),
+            ("wait", "phi"),
+        ]
+
+
+def test_auto_center_pipelined_missed_loop(mocker, loop_detector):
+    events = []
+    # the loop is missed at 90 degrees, found at 2 angles out of 3
+    centring, motors, _ = start_auto(mocker, events, 3, True, [90.0])
+    centring.get(timeout=5)
+    assert_centred(motors)
+    # centred step by step after the pipelined pass, from 180 degrees
+    assert ("detect", 270.0) in events
+
+
+def test_auto_center_pipelined_error(mocker, loop_detector):
+    events = []
+    centring, motors, sample_view = start_auto(mocker, events, 4, True)
+    snapshot = sample_view.get_snapshot.side_effect
+
+    def get_snapshot(**kwargs):
+        if motors["phi"].value == 60:
+            raise RuntimeError("camera failed")
+        return snapshot(**kwargs)
+
+    sample_view.get_snapshot.side_effect = get_snapshot
+    with pytest.raises(RuntimeError, match="camera failed"):
+        centring.get(timeout=5)
+    # phi stopped, and the motors are back to their initial positions
+    assert events[-6] == ("wait", "phi")
+    assert all(motor.value == 0 for motor in motors.values())
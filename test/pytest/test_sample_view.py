@@ -15,8 +15,7 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with MXCuBE. If not, see <https://www.gnu.org/licenses/>.
-"""
-"""
+""" """
 
 from __future__ import (
     absolute_import,
@@ -25,6 +24,7 @@ from __future__ import (
     unicode_literals,
 )
 
+import numpy
 import pytest
 
 __copyright__ = """ Copyright © 2010 - 2020 by MXCuBE Collaboration """
@@ -137,3 +137,25 @@ def test_sample_view_select_shape(sample_view):
 
     sample_view.de_select_all()
     assert len(sample_view.get_selected_shapes()) == 0
+
+
+def test_sample_view_update_shape_positions(beamline, sample_view, mocker):
+    def to_screen_array(positions):
+        return numpy.array(
+            [(pos["phiy"] * 10, pos["phiz"] * 10) for pos in positions]
+        ).reshape(-1, 2)
+
+    mocker.patch.object(
+        beamline.diffractometer,
+        "motor_positions_to_screen_array",
+        side_effect=to_screen_array,
+        create=True,
+    )
+    mocker.patch.object(beamline.diffractometer.omega, "get_value", return_value=0)
+    sample_view._update_shape_positions()
+
+    # the centred positions of all the shapes are projected at once
+    beamline.diffractometer.motor_positions_to_screen_array.assert_called_once()
+    assert sample_view.get_points()[0].screen_coord == (0, 0)
+    assert sample_view.get_lines()[0].screen_coord == (0, 0, 10, 10)
+    assert sample_view.get_grids()[0].screen_coord == (0, 0)
@@ -0,0 +1,185 @@
+"""Test the polling of Tango channels grouped by device, with a fake device"""
+
+import numpy
+import pytest
+
+PyTango = pytest.importorskip("PyTango")
+
+from mxcubecore.Command import Tango  # noqa: E402
+from mxcubecore.Command.Tango import (  # noqa: E402
+    TangoChannel,
+    TangoPollingGroup,
+)
+
+
+class FakeAttribute:
+    def __init__(self, name, value, has_failed=False):
+        self.name = name
+        self.value = value
+        self.has_failed = has_failed
+
+    def get_err_stack(self):
+        return ()
+
+
+class FakeDevice:
+    """Device with the attributes <values>, <failed> being the attributes
+    failing to read"""
+
+    def __init__(self, name):
+        self.name = name
+        self.values = {"position": 1.0, "state": "ON", "image": numpy.zeros(3)}
+        self.failed = set()
+        self.read_attributes_calls = []
+
+    def ping(self):
+        pass
+
+    def set_timeout_millis(self, timeout):
+        pass
+
+    def attribute_list_query(self):
+        return [FakeAttribute(name, None) for name in self.values]
+
+    def read_attributes(self, names):
+        self.read_attributes_calls.append(list(names))
+        return [
+            FakeAttribute(name, self.values[name], name in self.failed)
+            for name in names
+        ]
+
+    def read_attribute(self, name, *extract_as):
+        return FakeAttribute(name, str(self.values[name]) if extract_as else None)
+
+
+@pytest.fixture
+def devices(mocker):
+    devices = {}
+
+    def device_proxy(name):
+        return devices.setdefault(name, FakeDevice(name))
+
+    mocker.patch.object(Tango, "DeviceProxy", side_effect=device_proxy)
+    mocker.patch.dict(TangoChannel._pollingGroups, clear=True)
+    poll = mocker.patch.object(Tango.Poller, "poll")
+    poll.return_value.get_id.return_value = 1
+    return devices
+
+
+def make_channel(attribute_name, device_name="dev/1", polling=100, **kwargs):
+    channel = TangoChannel(
+        attribute_name,
+        attribute_name,
+        tangoname=device_name,
+        polling=polling,
+        **kwargs,
+    )
+    channel.values = []
+
+    def value_changed(value):
+        channel.values.append(value)
+
+    # keep a reference, the dispatcher only holds weak references
+    channel.value_changed = value_changed
+    channel.connect_signal("update", value_changed)
+    return channel
+
+
+def poll_group(group):
+    group.update(group.poll())
+
+
+def test_channels_grouped_by_device_and_period(devices):
+    position = make_channel("position")
+    state = make_channel("state")
+    slow_state = make_channel("state", polling=500)
+    other_position = make_channel("position", device_name="dev/2")
+
+    groups = TangoChannel._pollingGroups
+    assert set(groups) == {("dev/1", 100), ("dev/1", 500), ("dev/2", 100)}
+    group = groups[("dev/1", 100)]
+    assert group.channels == (position, state)
+    assert groups[("dev/1", 500)].channels == (slow_state,)
+    assert groups[("dev/2", 100)].channels == (other_position,)
+    # one poller per group
+    assert Tango.Poller.poll.call_count == 3
+
+    # the attributes of a group are read with one call
+    poll_group(group)
+    assert group.raw_device.read_attributes_calls == [["position", "state"]]
+    assert position.values == [1.0] and state.values == ["ON"]
+
+
+def test_values_sent_when_changed(devices):
+    position = make_channel("position")
+    image = make_channel("image")
+    group = TangoChannel._pollingGroups[("dev/1", 100)]
+    device = devices["dev/1"]
+
+    poll_group(group)
+    poll_group(group)
+    assert position.values == [1.0]
+    assert image.values == [[0.0, 0.0, 0.0]]
+
+    device.values["position"] = 2.0
+    poll_group(group)
+    assert position.values == [1.0, 2.0]
+    assert len(image.values) == 1
+
+    device.values["image"] = numpy.ones(3)
+    poll_group(group)
+    assert image.values[-1] == [1.0, 1.0, 1.0]
+    assert position.values == [1.0, 2.0]
+
+
+def test_failed_attribute_removed(devices):
+    position = make_channel("position")
+    state = make_channel("state")
+    group = TangoChannel._pollingGroups[("dev/1", 100)]
+    devices["dev/1"].failed.add("state")
+
+    poll_group(group)
+    assert group.channels == (position,)
+    assert state.values == [None]
+    assert position.values == [1.0]
+
+    devices["dev/1"].values["position"] = 3.0
+    poll_group(group)
+    assert group.raw_device.read_attributes_calls[-1] == ["position"]
+    assert position.values == [1.0, 3.0]
+    assert state.values == [None]
+
+
+def test_group_poll_failed(mocker, devices):
+    position = make_channel("position")
+    state = make_channel("state")
+    group = TangoChannel._pollingGroups[("dev/1", 100)]
+    poll_group(group)
+    poller = mocker.Mock()
+    mocker.patch.object(Tango.Poller, "get_poller", return_value=poller)
+
+    group.poll_failed(PyTango.DevFailed(), 1)
+    poller.stop.assert_called_once()
+    assert group.channels == () and group.poller is None
+    assert group.last_values == {}
+    assert position.values == [1.0, None]
+    assert state.values == ["ON", None]
+
+    # a new channel starts polling again
+    Tango.Poller.poll.reset_mock()
+    make_channel("position")
+    Tango.Poller.poll.assert_called_once()
+
+
+def test_read_as_str_channel_polled_alone(devices):
+    state = make_channel("state", read_as_str=True)
+    assert TangoChannel._pollingGroups == {}
+    Tango.Poller.poll.assert_called_once()
+    assert Tango.Poller.poll.call_args[0][0] == state.poll
+    assert state.poll() == "ON"
+
+
+def test_empty_group():
+    group = TangoPollingGroup.__new__(TangoPollingGroup)
+    group.channels = ()
+    assert group.poll() == ((), [])